@@ -128,6 +128,7 @@ export class ChatStack extends NestedStack implements ChatStackOutputs {
         CHATBOT_TABLE_NAME: props.sharedConstructOutputs.chatbotTable.tableName,
         SESSIONS_TABLE_NAME: chatTablesConstruct.sessionsTableName,
         MESSAGES_TABLE_NAME: chatTablesConstruct.messagesTableName,
+        MESSAGES_BY_SESSION_ID_TIMESTAMP_INDEX_NAME: chatTablesConstruct.bySessionIdTimestampIndex,
         PROMPT_TABLE_NAME: chatTablesConstruct.promptTableName,
         INTENTION_TABLE_NAME: chatTablesConstruct.intentionTableName,
         STOP_SIGNALS_TABLE_NAME: chatTablesConstruct.stopSignalsTableName,
@@ -185,7 +186,12 @@ export class ChatStack extends NestedStack implements ChatStackOutputs {
 
     this.lambdaOnlineMain.addToRolePolicy(this.sqsStatement);
     this.lambdaOnlineMain.addEventSource(
-      new lambdaEventSources.SqsEventSource(this.messageQueue, { batchSize: 1 }),
+      // records of a batch are processed concurrently, failed records are
+      // reported in batchItemFailures
+      new lambdaEventSources.SqsEventSource(this.messageQueue, {
+        batchSize: 10,
+        reportBatchItemFailures: true,
+      }),
     );
     this.lambdaOnlineMain.addToRolePolicy(this.iamHelper.s3Statement);
     this.lambdaOnlineMain.addToRolePolicy(this.iamHelper.endpointStatement);
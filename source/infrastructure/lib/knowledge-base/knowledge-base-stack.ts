@@ -17,6 +17,7 @@ import * as iam from "aws-cdk-lib/aws-iam";
 import { Architecture, Code, Function, Runtime } from "aws-cdk-lib/aws-lambda";
 import * as s3 from "aws-cdk-lib/aws-s3";
 import * as sns from "aws-cdk-lib/aws-sns";
+import * as sqs from "aws-cdk-lib/aws-sqs";
 import * as subscriptions from "aws-cdk-lib/aws-sns-subscriptions";
 import * as sfn from "aws-cdk-lib/aws-stepfunctions";
 import * as tasks from "aws-cdk-lib/aws-stepfunctions-tasks";
@@ -200,10 +201,29 @@ export class KnowledgeBaseStack extends NestedStack implements KnowledgeBaseStac
     glueRole.addToPolicy(this.iamHelper.dynamodbStatement);
     glueRole.addToPolicy(this.iamHelper.secretsManagerStatement);
 
+    // Completion notifications of the ETL model async inferences, the job
+    // falls back to polling S3 without them
+    let etlNotificationQueueUrl = "-";
+    if (props.modelConstructOutputs.knowledgeBaseModelNotificationTopicArn) {
+      const etlNotificationQueue = new sqs.Queue(this, "ETLModelNotificationQueue", {
+        encryption: sqs.QueueEncryption.SQS_MANAGED,
+        retentionPeriod: Duration.days(1),
+        visibilityTimeout: Duration.seconds(30),
+      });
+      sns.Topic.fromTopicArn(
+        this,
+        "ETLModelNotificationTopic",
+        props.modelConstructOutputs.knowledgeBaseModelNotificationTopicArn,
+      ).addSubscription(new subscriptions.SqsSubscription(etlNotificationQueue));
+      etlNotificationQueue.grantConsumeMessages(glueRole);
+      etlNotificationQueueUrl = etlNotificationQueue.queueUrl;
+    }
+
     const glueJobDefaultArguments: { [key: string]: string } = {
       "--AOS_ENDPOINT": this.aosDomainEndpoint,
       "--REGION": deployRegion,
       "--ETL_MODEL_ENDPOINT": props.modelConstructOutputs.defaultKnowledgeBaseModelName,
+      "--ETL_NOTIFICATION_QUEUE_URL": etlNotificationQueueUrl,
       "--RES_BUCKET": this.glueResultBucket.bucketName,
       "--ETL_OBJECT_TABLE": this.etlObjTableName || "-",
       "--PORTAL_BUCKET": this.uiPortalBucketName,
@@ -301,6 +321,7 @@ export class KnowledgeBaseStack extends NestedStack implements KnowledgeBaseStac
         "--BATCH_INDICE.$": 'States.Format(\'{}\', $.batchIndices)',
         "--DOCUMENT_LANGUAGE.$": "$.documentLanguage",
         "--ETL_MODEL_ENDPOINT": props.modelConstructOutputs.defaultKnowledgeBaseModelName || "-",
+        "--ETL_NOTIFICATION_QUEUE_URL": etlNotificationQueueUrl,
         "--INDEX_TYPE.$": "$.indexType",
         "--JOB_NAME": glueJob.jobName,
         "--OFFLINE": "true",
@@ -14,6 +14,7 @@
 import { Aws, NestedStack } from "aws-cdk-lib";
 import * as iam from "aws-cdk-lib/aws-iam";
 import * as sagemaker from "aws-cdk-lib/aws-sagemaker";
+import * as sns from "aws-cdk-lib/aws-sns";
 import { Construct } from "constructs";
 import * as dotenv from "dotenv";
 import { SystemConfig } from "../shared/types";
@@ -30,6 +31,7 @@ export interface ModelConstructProps {
 export interface ModelConstructOutputs {
   defaultEmbeddingModelName: string;
   defaultKnowledgeBaseModelName: string;
+  knowledgeBaseModelNotificationTopicArn: string;
 }
 
 interface BuildSagemakerEndpointProps {
@@ -62,6 +64,7 @@ interface DeploySagemakerEndpointResponse {
 export class ModelConstruct extends NestedStack implements ModelConstructOutputs {
   public defaultEmbeddingModelName: string = "";
   public defaultKnowledgeBaseModelName: string = "";
+  public knowledgeBaseModelNotificationTopicArn: string = "";
   modelAccount = Aws.ACCOUNT_ID;
   modelRegion: string;
   modelIamHelper: IAMHelper;
@@ -170,6 +173,16 @@ export class ModelConstruct extends NestedStack implements ModelConstructOutputs
     let knowledgeBaseModelName = "knowledge-base-model" + "-" + knowledgeBaseModelEcrImageTag;
     let knowledgeBaseModelImageUrl = this.modelAccount + ".dkr.ecr." + this.modelRegion + this.modelImageUrlDomain + knowledgeBaseModelEcrRepository + ":" + knowledgeBaseModelEcrImageTag;
 
+    // Async inference success and error notifications, so that the ETL job
+    // does not need to poll S3 for the results
+    const notificationTopic = new sns.Topic(this, "knowledge-base-model-notification-topic", {
+      displayName: "knowledge-base-model-notification-topic",
+    });
+    if (this.modelExecutionRole) {
+      notificationTopic.grantPublish(this.modelExecutionRole);
+    }
+    this.knowledgeBaseModelNotificationTopicArn = notificationTopic.topicArn;
+
     const knowledgeBaseModelResources = this.deploySagemakerEndpoint({
       modelProps: {
         modelName: knowledgeBaseModelName,
@@ -197,6 +210,10 @@ export class ModelConstruct extends NestedStack implements ModelConstructOutputs
           outputConfig: {
             s3OutputPath: `s3://${props.sharedConstructOutputs.resultBucket.bucketName}/${knowledgeBaseModelName}/output`,
             s3FailurePath: `s3://${props.sharedConstructOutputs.resultBucket.bucketName}/${knowledgeBaseModelName}/failure`,
+            notificationConfig: {
+              successTopic: notificationTopic.topicArn,
+              errorTopic: notificationTopic.topicArn,
+            },
           },
         },
       },
@@ -1,6 +1,8 @@
 import json
 import logging
 import os
+import threading
+import time
 import traceback
 from urllib.request import urlopen
 
@@ -14,6 +16,93 @@ verify_exp = os.getenv("mode") != "dev"
 logger = logging.getLogger()
 logger.setLevel(logging.INFO)
 
+
+class JwksCache:
+    """
+    Per-container cache of the parsed public keys of each issuer.
+
+    Keys are refreshed when they are older than JWKS_CACHE_TTL seconds, or
+    when a token carries an unknown kid, e.g. after a key rotation. Kid-miss
+    refreshes of an issuer happen at most once per
+    JWKS_MIN_REFRESH_INTERVAL seconds, and concurrent refreshes of an
+    issuer are coalesced into a single fetch.
+    """
+
+    ttl = int(os.getenv("JWKS_CACHE_TTL", 3600))
+    min_refresh_interval = int(os.getenv("JWKS_MIN_REFRESH_INTERVAL", 30))
+    max_issuers = int(os.getenv("JWKS_CACHE_MAX_ISSUERS", 32))
+    lock = threading.Lock()
+    # issuer -> {"keys": {kid: public key}, "fetch_time": float}
+    entries = {}
+    refresh_locks = {}
+
+    @classmethod
+    def _lookup(cls, issuer, kid):
+        entry = cls.entries.get(issuer)
+        if entry is None or time.time() - entry["fetch_time"] > cls.ttl:
+            return None, None
+        return entry, entry["keys"].get(kid)
+
+    @classmethod
+    def _fetch(cls, issuer, keys_url):
+        response = urlopen(keys_url)
+        keys = json.loads(response.read())["keys"]
+        entry = {
+            # tokens are verified with RS256, other key types are not used
+            "keys": {
+                key["kid"]: jwt.algorithms.RSAAlgorithm.from_jwk(json.dumps(key))
+                for key in keys
+                if key.get("kty") == "RSA"
+            },
+            "fetch_time": time.time(),
+        }
+        with cls.lock:
+            cls.entries[issuer] = entry
+            while len(cls.entries) > cls.max_issuers:
+                oldest = min(
+                    cls.entries, key=lambda k: cls.entries[k]["fetch_time"]
+                )
+                cls.entries.pop(oldest)
+                cls.refresh_locks.pop(oldest, None)
+        logger.info(f"Fetched {len(keys)} public keys from {keys_url}")
+        return entry
+
+    @classmethod
+    def get_public_key(cls, issuer, keys_url, kid):
+        entry, public_key = cls._lookup(issuer, kid)
+        if public_key is not None:
+            return public_key
+
+        with cls.lock:
+            refresh_lock = cls.refresh_locks.setdefault(issuer, threading.Lock())
+        try:
+            with refresh_lock:
+                # another request may have refreshed the keys in the meantime
+                entry, public_key = cls._lookup(issuer, kid)
+                if public_key is not None:
+                    return public_key
+                if (
+                    entry is None
+                    or time.time() - entry["fetch_time"]
+                    >= cls.min_refresh_interval
+                ):
+                    entry = cls._fetch(issuer, keys_url)
+        finally:
+            # only cached issuers keep their lock, e.g. not unknown issuers
+            # whose keys could not be fetched
+            with cls.lock:
+                if issuer not in cls.entries:
+                    cls.refresh_locks.pop(issuer, None)
+
+        public_key = entry["keys"].get(kid)
+        if public_key is None:
+            logger.error("Public key not found in jwks.json")
+            raise Exception(
+                "Custom Authorizer Error: Public key not found in jwks.json"
+            )
+        return public_key
+
+
 def generatePolicy(principalId, effect, resource, claims):
     authResponse = {}
     authResponse["principalId"] = principalId
@@ -72,22 +161,7 @@ def lambda_handler(event, context):
             issuer = f"https://cognito-idp.{REGION}.amazonaws.com/{oidc_info.get('poolId')}"
             keys_url = f"https://cognito-idp.{REGION}.amazonaws.com/{oidc_info.get('poolId')}/.well-known/jwks.json"
         
-        response = urlopen(keys_url)
-        keys = json.loads(response.read())["keys"]
-
-        # Search for the kid in the downloaded public keys
-        key_index = -1
-        for i, key in enumerate(keys):
-            if kid == key["kid"]:
-                key_index = i
-                break
-        if key_index == -1:
-            logger.error("Public key not found in jwks.json")
-            raise Exception(
-                "Custom Authorizer Error: Public key not found in jwks.json"
-            )
-        # # Construct the public key
-        public_key = jwt.algorithms.RSAAlgorithm.from_jwk(json.dumps(keys[key_index]))
+        public_key = JwksCache.get_public_key(issuer, keys_url, kid)
 
         # Verify the signature of the JWT token
         claims = jwt.decode(
@@ -13,6 +13,15 @@ DOWNLOAD_RESOURCE = f"{ROOT_RESOURCE}/download-template"
 SECRET_NAME = "opensearch-master-user"
 AOS_INDEX = "aics_intention_index"
 BULK_SIZE = 100000000
+# actions per bulk request when embeddings are streamed into helpers.bulk
+BULK_CHUNK_SIZE = 500
+EMBEDDING_BATCH_SIZE = 16
+EMBEDDING_CONCURRENCY = 8
+EMBEDDING_MAX_RETRIES = 5
+MGET_BATCH_SIZE = 500
+# max time to wait for the delete tasks of a delete request, in seconds. API
+# Gateway cuts the request at 29 s, the tasks keep running on the cluster
+DELETE_TASK_API_TIMEOUT = 20
 
 
 @unique
@@ -106,11 +106,14 @@ def initiate_chatbot(
                 item["indexIds"][index_type]["count"] = len(
                     item["indexIds"][index_type]["value"]
                 )
+                # updateTime is the version of cached chatbots
+                item["updateTime"] = str(datetime.now(timezone.utc))
                 chatbot_table.put_item(Item=item)
         else:
             # Add a new index type
             item["indexIds"][index_type] = {
                 "count": 1, "value": {tag: index_id}}
+            item["updateTime"] = str(datetime.now(timezone.utc))
             chatbot_table.put_item(Item=item)
 
 
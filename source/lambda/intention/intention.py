@@ -3,7 +3,9 @@ import json
 import logging
 import os
 import re
+import random
 import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
 from io import BytesIO
 from typing import List
 import boto3
@@ -11,13 +13,18 @@ from aos import sm_utils
 from aos.aos_utils import LLMBotOpenSearchClient
 from botocore.paginate import TokenEncoder
 from constant import (
-    BULK_SIZE,
+    BULK_CHUNK_SIZE,
     DEFAULT_CONTENT_TYPE,
     DEFAULT_MAX_ITEMS,
     DEFAULT_SIZE,
+    DELETE_TASK_API_TIMEOUT,
     DOWNLOAD_RESOURCE,
+    EMBEDDING_BATCH_SIZE,
+    EMBEDDING_CONCURRENCY,
+    EMBEDDING_MAX_RETRIES,
     EXECUTION_RESOURCE,
     INDEX_USED_SCAN_RESOURCE,
+    MGET_BATCH_SIZE,
     PRESIGNED_URL_RESOURCE,
     ModelDimensionMap,
 )
@@ -37,6 +44,7 @@ from opensearchpy import (
 )
 from requests_aws4auth import AWS4Auth
 from shared.langchain_integration.models.embedding_models import EmbeddingModel
+from shared.utils.opensearch_utils import delete_documents_by_query
 
 
 logger = logging.getLogger(__name__)
@@ -228,6 +236,7 @@ def __delete_execution(event, group_name):
     input_body = json.loads(event["body"])
     execution_ids = input_body.get("executionIds")
     res = []
+    deadline = time.time() + DELETE_TASK_API_TIMEOUT
     for execution_id in execution_ids:
         index_response = intention_table.get_item(
             Key={
@@ -242,7 +251,9 @@ def __delete_execution(event, group_name):
             questions = [detail.get("question") for detail in details]
             # delete aos data
             for index in indexes:
-                __delete_documents_by_text_set(index, questions)
+                __delete_documents_by_text_set(
+                    index, questions, max(0, deadline - time.time())
+                )
             # delete intention（ddb）
             intention_table.delete_item(
                 Key={
@@ -258,28 +269,16 @@ def __delete_execution(event, group_name):
 #     return False, ""
 
 
-def __delete_documents_by_text_set(index_name, text_values):
-    # Search for the documents based on the "text" field matching any value in text_values set
-    search_body = {
-        "size": 10000,
-        "query": {
-            "terms": {"text.keyword": list(text_values)}  # Convert set to list
-        },
-    }
-
-    # Perform the search
+def __delete_documents_by_text_set(index_name, text_values, timeout):
+    # Delete the documents whose "text" field matches any value in text_values,
+    # waiting at most timeout seconds for the delete task
     try:
-        search_result = aos_client.search(
-            index=index_name, body=search_body
-        )  # Adjust size if needed
-        hits = search_result["hits"]["hits"]
-
-        # If documents exist, delete them
-        if hits:
-            for hit in hits:
-                doc_id = hit["_id"]
-                aos_client.delete(index=index_name, id=doc_id)
-                logger.info("Deleted document with id %s", doc_id)
+        return delete_documents_by_query(
+            aos_client,
+            index_name,
+            {"terms": {"text.keyword": list(text_values)}},
+            timeout=timeout,
+        )
     except NotFoundError:
         logger.info("Index is not existed: %s", index_name)
 
@@ -565,56 +564,158 @@ def __create_index(index: str, modelId: str):
 
 
 def __refresh_index(index: str, modelId: str, qaList):
+    # actions are streamed to bulk as soon as their embeddings are ready
     success, failed = helpers.bulk(
         aos_client,
         __append_embeddings(index, modelId, qaList),
-        chunk_size=BULK_SIZE,
+        chunk_size=BULK_CHUNK_SIZE,
     )
     aos_client.indices.refresh(index=index)
     logger.info("Successfully added: %d ", success)
     logger.info("Failed: %d ", len(failed))
 
 
+def __get_embedding_hash(modelId: str, question: str):
+    return hashlib.sha256(f"{modelId}\n{question}".encode("utf-8")).hexdigest()
+
+
+def __get_indexed_embedding_hashes(index_item: str, doc_ids: list):
+    """Get the embedding hashes of the documents already in the index"""
+    embedding_hashes = {}
+    for i in range(0, len(doc_ids), MGET_BATCH_SIZE):
+        try:
+            response = aos_client.mget(
+                index=index_item,
+                body={"ids": doc_ids[i:i + MGET_BATCH_SIZE]},
+                _source_includes=["embedding_hash"],
+            )
+        except NotFoundError:
+            return {}
+        for doc in response["docs"]:
+            if doc.get("found"):
+                embedding_hashes[doc["_id"]] = doc["_source"].get("embedding_hash")
+    return embedding_hashes
+
+
+def __is_throttling_error(error: Exception):
+    # langchain wraps the bedrock ClientError into a ValueError
+    error_msg = str(error)
+    return any(
+        code in error_msg
+        for code in (
+            "ThrottlingException",
+            "TooManyRequestsException",
+            "ServiceUnavailableException",
+            "ModelNotReadyException",
+        )
+    )
+
+
+def __embed_with_retry(embedding_func, questions: list):
+    for attempt in range(EMBEDDING_MAX_RETRIES + 1):
+        try:
+            return embedding_func.embed_documents(questions)
+        except Exception as e:
+            if attempt == EMBEDDING_MAX_RETRIES or not __is_throttling_error(e):
+                raise
+            # exponential backoff with full jitter
+            backoff = random.uniform(0, min(20, 2 ** attempt))
+            logger.info("Embedding throttled, retry in %.2f s", backoff)
+            time.sleep(backoff)
+
+
+def __iter_embedding_batches(modelId: str, questions: list):
+    """
+    Embed the questions in batches with bounded concurrency, yielding
+    (questions, vectors) as soon as each batch is ready
+    """
+    embedding_func = BedrockEmbeddings(
+        client=bedrock_client, model_id=modelId, normalize=True
+    )
+    batches = iter(
+        [
+            questions[i:i + EMBEDDING_BATCH_SIZE]
+            for i in range(0, len(questions), EMBEDDING_BATCH_SIZE)
+        ]
+    )
+    with ThreadPoolExecutor(max_workers=EMBEDDING_CONCURRENCY) as executor:
+        futures = {}
+
+        def submit_next():
+            batch = next(batches, None)
+            if batch is not None:
+                futures[
+                    executor.submit(__embed_with_retry, embedding_func, batch)
+                ] = batch
+
+        # keep a bounded number of batches in flight
+        for _ in range(2 * EMBEDDING_CONCURRENCY):
+            submit_next()
+        while futures:
+            done, _ = wait(futures, return_when=FIRST_COMPLETED)
+            for future in done:
+                batch = futures.pop(future)
+                submit_next()
+                yield batch, future.result()
+
+
 def __append_embeddings(index, modelId, qaList: list):
-    actions = []
-    documents = []
+    index_list = index.split(",")
+    documents = {}
     for item in qaList:
         question = item["question"]
-        embedding_func = BedrockEmbeddings(
-            client=bedrock_client, model_id=modelId, normalize=True
-        )
+        doc_id = hashlib.md5(str(question).encode("utf-8")).hexdigest()
+        documents[doc_id] = {
+            "text": question,
+            "metadata": {
+                "answer": item["intention"],
+                "source": "portal",
+                **(
+                    {"kwargs": item["kwargs"]} if item.get("kwargs") else {}
+                ),
+                "type": "Intent",
+            },
+            "embedding_hash": __get_embedding_hash(modelId, question),
+        }
 
-        embeddings_vectors = embedding_func.embed_documents([question])
-        documents.append(
-            {
-                "text": question,
-                "metadata": {
-                    "answer": item["intention"],
-                    "source": "portal",
-                    **(
-                        {"kwargs": item["kwargs"]} if item.get("kwargs") else {}
-                    ),
-                    "type": "Intent",
-                },
-                "sentence_vector": embeddings_vectors[0],
-            }
+    # documents whose question and model are unchanged since the last
+    # upload keep their vector, only the metadata is replaced. A partial
+    # `doc` update would merge it with the indexed one and keep stale keys
+    indexes_to_embed = {}
+    for index_item in index_list:
+        embedding_hashes = __get_indexed_embedding_hashes(
+            index_item, list(documents)
         )
+        for doc_id, document in documents.items():
+            if embedding_hashes.get(doc_id) == document["embedding_hash"]:
+                yield {
+                    "_op_type": "update",
+                    "_index": index_item,
+                    "_id": doc_id,
+                    "script": {
+                        "source": "ctx._source.metadata = params.metadata",
+                        "lang": "painless",
+                        "params": {"metadata": document["metadata"]},
+                    },
+                }
+            else:
+                indexes_to_embed.setdefault(doc_id, []).append(index_item)
+    logger.info(
+        "Embedding %d of %d questions", len(indexes_to_embed), len(documents)
+    )
 
-    for document in documents:
-        index_list = index.split(",")
-        for index_item in index_list:
-            doc_id = hashlib.md5(
-                str(document["text"]).encode("utf-8")
-            ).hexdigest()
-            action = {
-                "_op_type": "index",
-                "_index": index_item,
-                "_id": doc_id,
-                "_source": document,
-            }
-            actions.append(action)
-    return actions
-    # yield {"_op_type": "index", "_index": index_item, "_source": document, "_id": hashlib.md5(str(document).encode('utf-8')).hexdigest()}
+    questions = [documents[doc_id]["text"] for doc_id in indexes_to_embed]
+    for batch, embeddings_vectors in __iter_embedding_batches(modelId, questions):
+        for question, vector in zip(batch, embeddings_vectors):
+            doc_id = hashlib.md5(str(question).encode("utf-8")).hexdigest()
+            document = {**documents[doc_id], "sentence_vector": vector}
+            for index_item in indexes_to_embed[doc_id]:
+                yield {
+                    "_op_type": "index",
+                    "_index": index_item,
+                    "_id": doc_id,
+                    "_source": document,
+                }
 
 
 def __get_execution(event, group_name):
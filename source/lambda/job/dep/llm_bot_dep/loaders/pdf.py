@@ -1,11 +1,13 @@
 import json
 import logging
 import os
+import queue
 import tempfile
+import threading
 import time
 import uuid
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from datetime import datetime
-from urllib.parse import urlparse
 
 import boto3
 from langchain.docstore.document import Document
@@ -32,6 +34,18 @@ logging.basicConfig(
 S3_FETCH_MAX_RETRY = 3600
 S3_FETCH_WAIT_TIME = 5
 ETL_INFERENCE_PREFIX = "etl_pdf_inference/"
+# Max time to wait for the async inferences of a PDF, in seconds
+ASYNC_INFERENCE_TIMEOUT = S3_FETCH_MAX_RETRY * S3_FETCH_WAIT_TIME
+# First interval of the S3 polling, doubled up to S3_FETCH_WAIT_TIME while
+# no inference completes
+S3_POLL_MIN_WAIT_TIME = 0.5
+# Max long polling time of the notification queue, in seconds
+SQS_MAX_WAIT_TIME = 20
+# Notifications of inferences not awaited by this process are released back
+# to the queue for other jobs, and dropped after this many receives
+SQS_MAX_RECEIVE_COUNT = 50
+# Number of chunks uploaded and submitted concurrently
+MAX_SUBMIT_WORKERS = 8
 
 # Maximum pages per chunk for PDF splitting
 PDF_CHUNK_SIZE = 50
@@ -39,6 +53,107 @@ PDF_CHUNK_SIZE = 50
 MAX_CHUNK_RETRIES = 3
 
 
+class InferenceNotificationReceiver:
+    """
+    Receive the completion notifications of the ETL endpoint for the whole
+    process and route them to the loads waiting for the inference ids.
+
+    A single receiver per queue avoids concurrent loads of the same process
+    long polling the queue and releasing each other's notifications. The
+    receiving thread only runs while some inference is awaited.
+    """
+
+    lock = threading.Lock()
+    receivers = {}
+
+    @classmethod
+    def get(cls, queue_url):
+        with cls.lock:
+            receiver = cls.receivers.get(queue_url)
+            if receiver is None:
+                receiver = cls(queue_url)
+                cls.receivers[queue_url] = receiver
+            return receiver
+
+    def __init__(self, queue_url):
+        self.queue_url = queue_url
+        self.sqs_client = boto3.client("sqs")
+        self.waiters_lock = threading.Lock()
+        # Completion queue of the waiting load by inference id
+        self.waiters = {}
+        self.thread = None
+
+    def register(self, inference_ids, waiter):
+        """
+        Route the notifications of the inference ids to the waiter queue,
+        as (inference_id, succeeded) tuples.
+        """
+        with self.waiters_lock:
+            for inference_id in inference_ids:
+                self.waiters[inference_id] = waiter
+            if self.thread is None:
+                self.thread = threading.Thread(
+                    target=self._receive_loop, daemon=True
+                )
+                self.thread.start()
+
+    def unregister(self, inference_ids):
+        with self.waiters_lock:
+            for inference_id in inference_ids:
+                self.waiters.pop(inference_id, None)
+
+    def _receive_loop(self):
+        while True:
+            with self.waiters_lock:
+                if not self.waiters:
+                    self.thread = None
+                    return
+            try:
+                self._receive_notifications()
+            except Exception:
+                logger.exception("Failed to receive ETL inference notifications")
+                time.sleep(S3_FETCH_WAIT_TIME)
+
+    def _receive_notifications(self):
+        response = self.sqs_client.receive_message(
+            QueueUrl=self.queue_url,
+            MaxNumberOfMessages=10,
+            WaitTimeSeconds=SQS_MAX_WAIT_TIME,
+            AttributeNames=["ApproximateReceiveCount"],
+        )
+        for message in response.get("Messages", []):
+            body = json.loads(message["Body"])
+            # SNS envelope unless raw message delivery is enabled
+            notification = (
+                json.loads(body["Message"]) if "Message" in body else body
+            )
+            inference_id = notification.get("inferenceId")
+            receive_count = int(
+                message.get("Attributes", {}).get("ApproximateReceiveCount", 1)
+            )
+            with self.waiters_lock:
+                waiter = self.waiters.get(inference_id)
+            if waiter is not None or receive_count >= SQS_MAX_RECEIVE_COUNT:
+                self.sqs_client.delete_message(
+                    QueueUrl=self.queue_url,
+                    ReceiptHandle=message["ReceiptHandle"],
+                )
+            else:
+                # notification of another job, release it immediately
+                self.sqs_client.change_message_visibility(
+                    QueueUrl=self.queue_url,
+                    ReceiptHandle=message["ReceiptHandle"],
+                    VisibilityTimeout=0,
+                )
+            if waiter is not None:
+                waiter.put(
+                    (
+                        inference_id,
+                        notification.get("invocationStatus") == "Completed",
+                    )
+                )
+
+
 class SageMakerPdfLoader:
     """
     A class to handle loading and processing PDFs using SageMaker ETL endpoints.
@@ -60,6 +175,7 @@ class SageMakerPdfLoader:
         language_code="zh",
         chunk_size=PDF_CHUNK_SIZE,
         vllm_params: VLLMParameters = None,
+        notification_queue_url: str = None,
     ):
         """
         Initialize the SageMakerPdfLoader with configuration parameters.
@@ -73,6 +189,9 @@ class SageMakerPdfLoader:
             language_code (str): Language code (default: "zh")
             chunk_size (int): Maximum pages per chunk (default: PDF_CHUNK_SIZE)
             vllm_params: VLLMParameters (optional)
+            notification_queue_url (str): SQS queue subscribed to the success and
+                error SNS topics of the endpoint (optional). Without it the
+                completion is only detected by polling S3
         """
         self.etl_endpoint_name = etl_endpoint_name
         self.source_bucket_name = source_bucket_name
@@ -82,8 +201,14 @@ class SageMakerPdfLoader:
         self.language_code = language_code
         self.chunk_size = chunk_size
         self.vllm_params = vllm_params
+        self.notification_queue_url = notification_queue_url
         # Initialize clients if not provided
         self.sagemaker_runtime_client = boto3.client("sagemaker-runtime")
+        self.notification_receiver = (
+            InferenceNotificationReceiver.get(notification_queue_url)
+            if notification_queue_url
+            else None
+        )
 
     def split_pdf(self, local_pdf_path, temp_dir):
         """
@@ -96,6 +221,16 @@ class SageMakerPdfLoader:
             list: List of tuples containing (temp_file_path, start_page, end_page) for each chunk
             str: Path to temporary directory containing chunks
         """
+        return list(self.iter_split_pdf(local_pdf_path, temp_dir))
+
+    def iter_split_pdf(self, local_pdf_path, temp_dir):
+        """
+        Split a large PDF into smaller chunks, yielding each chunk as soon as
+        it is written.
+
+        Yields:
+            tuple: (temp_file_path, start_page, end_page) of the chunk
+        """
 
         # Open the PDF
         pdf = PdfReader(local_pdf_path)
@@ -104,7 +239,6 @@ class SageMakerPdfLoader:
             f"PDF has {total_pages} pages, splitting into chunks of {self.chunk_size} pages"
         )
 
-        chunks = []
         for i in range(0, total_pages, self.chunk_size):
             start_page = i
             end_page = min(i + self.chunk_size - 1, total_pages - 1)
@@ -120,12 +254,10 @@ class SageMakerPdfLoader:
             with open(chunk_path, "wb") as chunk_file:
                 pdf_writer.write(chunk_file)
 
-            chunks.append((chunk_path, start_page, end_page))
             logger.info(
                 f"Created chunk {chunk_path} with pages {start_page+1}-{end_page+1}"
             )
-
-        return chunks
+            yield chunk_path, start_page, end_page
 
     def upload_pdf_chunk(self, local_path, prefix):
         """
@@ -222,157 +354,171 @@ class SageMakerPdfLoader:
             if os.path.exists(temp_file_path):
                 os.remove(temp_file_path)
 
-    def wait_for_async_inference_results(self, inference_responses):
+    def poll_inference_results(self, pending):
         """
-        Wait for all ETL inference results to complete.
+        Check the output and failure locations of pending inferences in S3.
 
         Args:
-            inference_responses (list): List of dictionaries containing output_location,
-                                     failure_location, and chunk information
+            pending (dict): Pending inferences by inference id
 
         Returns:
-            list: List of successful result prefixes
-            list: List of failed chunk keys
+            list: List of (inference_id, succeeded) tuples
         """
-        successful_chunks = []
-        failed_chunks = []
-        pending_inferences = inference_responses.copy()
 
-        for attempt in range(S3_FETCH_MAX_RETRY):
-            if not pending_inferences:
-                logger.info("All ETL inferences completed")
-                break
+        def _get_status(inference):
+            if s3_object_exists(inference["output_location"]):
+                return True
+            if s3_object_exists(inference["failure_location"]):
+                return False
+            return None
+
+        completed = []
+        with ThreadPoolExecutor(max_workers=MAX_SUBMIT_WORKERS) as executor:
+            statuses = executor.map(_get_status, pending.values())
+            for inference_id, status in zip(list(pending), statuses):
+                if status is not None:
+                    completed.append((inference_id, status))
+        return completed
+
+    def iter_async_inference_results(self, inference_responses):
+        """
+        Yield ETL inference results as soon as they complete.
 
-            remaining_inferences = []
+        Completion is read from the endpoint notifications when a
+        notification queue is configured. S3 is polled with an interval
+        which starts at S3_POLL_MIN_WAIT_TIME and doubles up to
+        S3_FETCH_WAIT_TIME while nothing completes, as the only source
+        without notifications and as a fallback for missed notifications
+        otherwise.
 
-            for inference in pending_inferences:
-                chunk_key = inference["chunk_key"]
-                output_location = inference["output_location"]
-                failure_location = inference["failure_location"]
+        Args:
+            inference_responses (list): List of dictionaries containing output_location,
+                                     failure_location, inference_id and chunk information
 
-                # Check for successful completion
-                if s3_object_exists(output_location):
-                    logger.info(
-                        f"ETL inference for chunk {chunk_key} completed successfully"
-                    )
-                    successful_chunks.append(
-                        {
-                            "chunk_key": chunk_key,
-                            "output_location": output_location,
-                        }
-                    )
-                    continue
+        Yields:
+            tuple: (inference_response, succeeded)
+        """
+        pending = {
+            inference["inference_id"]: inference
+            for inference in inference_responses
+        }
+        notifications = queue.Queue()
+        # The ids stay registered until all results are yielded, so that the
+        # late notifications of inferences found in S3 are deleted as well
+        inference_ids = list(pending)
+        if self.notification_receiver:
+            self.notification_receiver.register(inference_ids, notifications)
+        poll_wait_time = S3_POLL_MIN_WAIT_TIME
+        next_poll_time = time.time() + poll_wait_time
+        deadline = time.time() + ASYNC_INFERENCE_TIMEOUT
 
-                # Check for failure
-                if s3_object_exists(failure_location):
-                    logger.error(f"ETL inference for chunk {chunk_key} failed")
-                    failed_chunks.append(
-                        {
-                            "chunk_key": chunk_key,
-                            "failure_location": failure_location,
-                        }
+        try:
+            while pending and time.time() < deadline:
+                completed = []
+                try:
+                    completed.append(
+                        notifications.get(
+                            timeout=max(0, next_poll_time - time.time())
+                        )
                     )
-                    continue
+                    while True:
+                        completed.append(notifications.get_nowait())
+                except queue.Empty:
+                    pass
+
+                if time.time() >= next_poll_time:
+                    polled = self.poll_inference_results(pending)
+                    completed += polled
+                    # poll again soon after a completion, as other chunks of
+                    # the same PDF are likely to complete around the same time
+                    if polled:
+                        poll_wait_time = S3_POLL_MIN_WAIT_TIME
+                    else:
+                        poll_wait_time = min(
+                            poll_wait_time * 2, S3_FETCH_WAIT_TIME
+                        )
+                    next_poll_time = time.time() + poll_wait_time
+
+                for inference_id, succeeded in completed:
+                    inference = pending.pop(inference_id, None)
+                    if inference is None:
+                        continue
+                    if succeeded:
+                        logger.info(
+                            f"ETL inference for chunk {inference['chunk_key']} completed successfully"
+                        )
+                    else:
+                        logger.error(
+                            f"ETL inference for chunk {inference['chunk_key']} failed"
+                        )
+                    yield inference, succeeded
+        finally:
+            if self.notification_receiver:
+                self.notification_receiver.unregister(inference_ids)
 
-                # Still pending
-                remaining_inferences.append(inference)
+        # Check if any inferences are still pending after the timeout
+        if pending:
+            logger.error(
+                f"{len(pending)} ETL inferences timed out after {ASYNC_INFERENCE_TIMEOUT} seconds"
+            )
+            for inference in pending.values():
+                yield inference, False
 
-            # Update pending inferences
-            pending_inferences = remaining_inferences
+    def wait_for_async_inference_results(self, inference_responses):
+        """
+        Wait for all ETL inference results to complete.
 
-            if pending_inferences:
-                logger.info(
-                    f"Waiting for {len(pending_inferences)} ETL inferences to complete... (attempt {attempt+1}/{S3_FETCH_MAX_RETRY})"
-                )
-                time.sleep(S3_FETCH_WAIT_TIME)
+        Args:
+            inference_responses (list): List of dictionaries containing output_location,
+                                     failure_location, and chunk information
 
-        # Check if any inferences are still pending after max retries
-        if pending_inferences:
-            logger.error(
-                f"{len(pending_inferences)} ETL inferences timed out after maximum retries"
-            )
-            for inference in pending_inferences:
+        Returns:
+            list: List of successful result prefixes
+            list: List of failed chunk keys
+        """
+        successful_chunks = []
+        failed_chunks = []
+        for inference, succeeded in self.iter_async_inference_results(
+            inference_responses
+        ):
+            if succeeded:
+                successful_chunks.append(
+                    {
+                        "chunk_key": inference["chunk_key"],
+                        "output_location": inference["output_location"],
+                    }
+                )
+            else:
                 failed_chunks.append(
                     {
                         "chunk_key": inference["chunk_key"],
                         "failure_location": inference["failure_location"],
                     }
                 )
+        logger.info("All ETL inferences completed")
 
         return successful_chunks, failed_chunks
 
-    def merge_etl_results(self, successful_chunks):
+    def load_inference_content(self, output_location):
         """
-        Merge ETL results from multiple chunks.
+        Load the extracted content of a completed ETL inference.
 
         Args:
-            successful_chunks (list): List of successful chunks with output locations
+            output_location (str): S3 URI of the async inference output
 
         Returns:
-            str: S3 prefix of the merged result
+            str: Extracted content
         """
-        logger.info(f"Merging results from {len(successful_chunks)} chunks")
-
-        # Sort chunks by starting page number
-        sorted_chunks = []
-        for chunk in successful_chunks:
-            chunk_key = chunk["chunk_key"]
-            # Extract page numbers from chunk key (format: prefix/filename_chunk_START_END.pdf)
-            parts = os.path.basename(chunk_key).split("_")
-            if len(parts) >= 3:
-                try:
-                    start_page = int(parts[-2])  # Get the start page number
-                    sorted_chunks.append((start_page, chunk))
-                except ValueError:
-                    logger.warning(
-                        f"Could not parse start page from chunk key: {chunk_key}"
-                    )
-                    sorted_chunks.append(
-                        (float("inf"), chunk)
-                    )  # Put at the end if can't parse
-            else:
-                logger.warning(f"Unexpected chunk key format: {chunk_key}")
-                sorted_chunks.append(
-                    (float("inf"), chunk)
-                )  # Put at the end if can't parse
-
-        # Sort by start page
-        sorted_chunks.sort(key=lambda x: x[0])
-
-        # Concatenate all extracted text
-        all_text = ""
-
-        # Process each chunk in order
-        for _, chunk in sorted_chunks:
-            output_location = chunk["output_location"]
-
-            # Parse the S3 URI
-            inference_output_bucket_name, inference_output_key = parse_s3_uri(
-                output_location
-            )
-
-            try:
-                # Get the content from the output location
-                async_inference_result = load_content_from_s3(
-                    inference_output_bucket_name, inference_output_key
-                )
-                destination_key = json.loads(async_inference_result)[
-                    "destination_prefix"
-                ]
-
-                pdf_chunk_content = load_content_from_s3(
-                    self.result_bucket_name, destination_key
-                )
-
-                # Append the content to our combined text
-                all_text += pdf_chunk_content + "\n\n"
-                logger.info(f"Added content from {output_location}")
-            except Exception as e:
-                logger.error(
-                    f"Error reading content from {output_location}: {str(e)}"
-                )
-
-        return all_text
+        inference_output_bucket_name, inference_output_key = parse_s3_uri(
+            output_location
+        )
+        async_inference_result = load_content_from_s3(
+            inference_output_bucket_name, inference_output_key
+        )
+        destination_key = json.loads(async_inference_result)[
+            "destination_prefix"
+        ]
+        return load_content_from_s3(self.result_bucket_name, destination_key)
 
     def process_small_pdf(self, source_object_key):
         """
@@ -408,20 +554,9 @@ class SageMakerPdfLoader:
             raise Exception("PDF processing failed")
 
         # Get the content from the output location
-        output_location = successful_chunks[0]["output_location"]
-        parsed_uri = urlparse(output_location)
-        bucket_name = parsed_uri.netloc
-        key = parsed_uri.path.lstrip("/")
-
-        async_inference_result = load_content_from_s3(bucket_name, key)
-        destination_key = json.loads(async_inference_result)[
-            "destination_prefix"
-        ]
-
-        all_text = load_content_from_s3(
-            self.result_bucket_name, destination_key
+        return self.load_inference_content(
+            successful_chunks[0]["output_location"]
         )
-        return all_text
 
     def process_large_pdf(self, local_pdf_path, temp_dir):
         """
@@ -440,53 +575,85 @@ class SageMakerPdfLoader:
             Exception: If all chunks fail processing
         """
 
-        # Split the PDF into chunks
-        chunks = self.split_pdf(local_pdf_path, temp_dir)
-
-        # Upload chunks to S3
         chunk_prefix = f"{ETL_INFERENCE_PREFIX}chunks/{os.path.splitext(os.path.basename(local_pdf_path))[0]}/"
-        chunk_keys = []
 
-        for chunk_path, _, _ in chunks:
+        def _submit_chunk(chunk_path):
             chunk_key = self.upload_pdf_chunk(chunk_path, chunk_prefix)
-            chunk_keys.append(chunk_key)
-
-        # Submit all chunks for processing asynchronously
-        inference_responses = []
-
-        for chunk_key in chunk_keys:
             logger.info(f"Submitting chunk {chunk_key} for processing")
             inference_response = self.invoke_etl_model(
                 chunk_key,
                 source_bucket_name=self.result_bucket_name,  # Use destination bucket as source for chunks
             )
-            inference_responses.append(
-                {
-                    "chunk_key": chunk_key,
-                    "output_location": inference_response["output_location"],
-                    "failure_location": inference_response["failure_location"],
-                    "inference_id": inference_response["inference_id"],
-                }
-            )
+            return {
+                "chunk_key": chunk_key,
+                "output_location": inference_response["output_location"],
+                "failure_location": inference_response["failure_location"],
+                "inference_id": inference_response["inference_id"],
+            }
 
-        # Wait for all inferences to complete
-        successful_chunks, failed_chunks = (
-            self.wait_for_async_inference_results(inference_responses)
-        )
+        # Upload and submit the chunks concurrently, while the PDF is split
+        with ThreadPoolExecutor(max_workers=MAX_SUBMIT_WORKERS) as executor:
+            future_indexes = {
+                executor.submit(_submit_chunk, chunk_path): index
+                for index, (chunk_path, _, _) in enumerate(
+                    self.iter_split_pdf(local_pdf_path, temp_dir)
+                )
+            }
+            chunk_count = len(future_indexes)
+            failed_chunk_count = 0
+            # chunk index -> content, None for failed chunks
+            chunk_contents = {}
+            inference_responses = []
+            for future in as_completed(future_indexes):
+                index = future_indexes[future]
+                try:
+                    inference_response = future.result()
+                except Exception as e:
+                    logger.error(f"Error submitting chunk {index}: {str(e)}")
+                    chunk_contents[index] = None
+                    failed_chunk_count += 1
+                    continue
+                inference_response["index"] = index
+                inference_responses.append(inference_response)
+
+        # Merge the results in page order as they arrive
+        all_text = ""
+        next_index = 0
+        for inference, succeeded in self.iter_async_inference_results(
+            inference_responses
+        ):
+            content = None
+            if succeeded:
+                try:
+                    content = self.load_inference_content(
+                        inference["output_location"]
+                    )
+                    logger.info(
+                        f"Added content from {inference['output_location']}"
+                    )
+                except Exception as e:
+                    logger.error(
+                        f"Error reading content from {inference['output_location']}: {str(e)}"
+                    )
+            if content is None:
+                failed_chunk_count += 1
+            chunk_contents[inference["index"]] = content
+            while next_index in chunk_contents:
+                content = chunk_contents.pop(next_index)
+                if content is not None:
+                    all_text += content + "\n\n"
+                next_index += 1
 
         # Check if we have any successful results
-        if not successful_chunks:
+        if failed_chunk_count == chunk_count:
             raise Exception("All PDF chunks failed processing")
 
         # Log any failed chunks
-        if failed_chunks:
+        if failed_chunk_count:
             logger.warning(
-                f"{len(failed_chunks)} out of {len(chunk_keys)} chunks failed processing"
+                f"{failed_chunk_count} out of {chunk_count} chunks failed processing"
             )
 
-        # Merge results from successful chunks
-        all_text = self.merge_etl_results(successful_chunks)
-
         return all_text
 
     def load(self, source_object_key):
@@ -579,6 +746,8 @@ def process_pdf(processing_params: ProcessingParameters):
         processing_mode="ppstructure",
         language_code=language_code,
         vllm_params=vllm_params,
+        notification_queue_url=processing_params.etl_notification_queue_url
+        or None,
     )
 
     content = pdf_loader.load(source_object_key)
@@ -56,9 +56,17 @@ class ProcessingParameters(BaseModel):
     source_object_key: str = Field(
         description="The S3 key of the source document"
     )
+    source_object_etag: Optional[str] = Field(
+        default="",
+        description="The S3 ETag of the source document, used to skip unchanged documents",
+    )
     etl_endpoint_name: str = Field(
         description="The endpoint name for the ETL model service"
     )
+    etl_notification_queue_url: Optional[str] = Field(
+        default="",
+        description="The SQS queue receiving the completion notifications of the ETL model service",
+    )
     result_bucket_name: str = Field(
         description="The S3 bucket where processed results will be stored"
     )
@@ -1,7 +1,7 @@
+import hashlib
 import logging
 import re
 import traceback
-import uuid
 from typing import Any, List
 
 import boto3
@@ -161,10 +161,28 @@ def parse_string_to_xml_node(xml_string):
         return None
 
 
-def extract_headings(md_content: str):
+def get_id_prefix(*parts) -> str:
+    """Build a deterministic id prefix, so that the chunk ids of an
+    unchanged document are the same across ingestions.
+    """
+    key = "\x1f".join(str(part) for part in parts)
+    return hashlib.sha256(key.encode("utf-8")).hexdigest()[:8]
+
+
+HEADING_PATTERN = re.compile(r"\s*(#+)(.*)")
+
+
+def extract_headings(md_content: str, file_path: str = ""):
     """Extract heading hierarchy from Markdown content.
+
+    The hierarchy is built in a single pass: a stack of the open headings
+    with strictly increasing levels gives the parent, and the last heading
+    seen at each level gives the previous and next links.
+
     Args:
         md_content (str): Markdown content.
+        file_path (str): Source file of the content. It is part of the
+            heading ids, so that the chunk ids of different files differ.
     Returns:
         Json object contains the heading hierarchy
     """
@@ -172,35 +190,46 @@ def extract_headings(md_content: str):
     headers = {}
     lines = md_content.split("\n")
     id_index_dict = {}
+    # (level, id) of the headings which can still be a parent
+    parent_stack = []
+    last_id_by_level = {}
     for line in lines:
-        match = re.match(r"\s*(#+)(.*)", line)
+        match = HEADING_PATTERN.match(line)
         if match:
             header_index += 1
-            # print(match.group)
             level = len(match.group(1))
             title = match.group(2).strip()
-            id_prefix = str(uuid.uuid4())[:8]
+            id_prefix = get_id_prefix(file_path, header_index, level, title)
             _id = f"${header_index}-{id_prefix}"
-            parent = find_parent(headers, level)
-            previous = find_previous_with_same_level(headers, level)
+
+            # the parent is the last heading with a lower level
+            while parent_stack and parent_stack[-1][0] >= level:
+                parent_stack.pop()
+            parent = parent_stack[-1][1] if parent_stack else None
+            parent_stack.append((level, _id))
+
+            previous = last_id_by_level.get(level)
+            last_id_by_level[level] = _id
+
             headers[_id] = {
                 "title": title,
                 "level": level,
                 "parent": parent,
                 "previous": previous,
+                "child": [],
+                "next": None,
             }
+            if parent is not None and headers[parent]["level"] == level - 1:
+                headers[parent]["child"].append(_id)
+            if previous is not None:
+                headers[previous]["next"] = _id
+
             # Use list in case multiple heading have the same title
             if title not in id_index_dict:
                 id_index_dict[title] = [_id]
             else:
                 id_index_dict[title].append(_id)
 
-    for header_obj in headers:
-        headers[header_obj]["child"] = find_child(headers, header_obj)
-        headers[header_obj]["next"] = find_next_with_same_level(
-            headers, header_obj
-        )
-
     return headers, id_index_dict
 
 
@@ -225,6 +254,7 @@ class MarkdownHeaderTextSplitter:
         current_heading: str,
         metadata: dict,
         same_heading_dict: dict,
+        file_path: str = "",
     ):
         """Set chunk id when there are multiple headings are the same.
         Eg.
@@ -238,6 +268,7 @@ class MarkdownHeaderTextSplitter:
             current_heading (str): Current heading
             metadata (dict): Metadata
             same_heading_dict (dict): Same heading mapping
+            file_path (str): Source file, part of the generated chunk ids
         """
         if 1 == len(id_index_dict[current_heading]):
             metadata["chunk_id"] = id_index_dict[current_heading][0]
@@ -258,7 +289,11 @@ class MarkdownHeaderTextSplitter:
                         same_heading_dict[current_heading]
                     ]
                 else:
-                    id_prefix = str(uuid.uuid4())[:8]
+                    id_prefix = get_id_prefix(
+                        file_path,
+                        current_heading,
+                        same_heading_dict[current_heading],
+                    )
                     metadata["chunk_id"] = f"$0-{id_prefix}"
 
     def _get_current_heading_list(
@@ -302,8 +337,10 @@ class MarkdownHeaderTextSplitter:
         inside_figure = False
         have_figure = False
         figure_metadata = []
+        # chunk ids are looked up index wide, so they include the file path
+        file_path = text.metadata.get("file_path", "")
         heading_hierarchy, id_index_dict = extract_headings(
-            text.page_content.strip()
+            text.page_content.strip(), file_path
         )
         if len(lines) > 0:
             current_heading = lines[0]
@@ -332,12 +369,15 @@ class MarkdownHeaderTextSplitter:
                             current_heading,
                             metadata,
                             same_heading_dict,
+                            file_path,
                         )
                     except KeyError:
                         logger.info(
                             f"No standard heading found, check your document with {current_chunk_content}"
                         )
-                        id_prefix = str(uuid.uuid4())[:8]
+                        id_prefix = get_id_prefix(
+                            file_path, current_heading, len(chunks)
+                        )
                         metadata["chunk_id"] = f"$0-{id_prefix}"
                     if metadata["chunk_id"] in heading_hierarchy:
                         metadata["heading_hierarchy"] = heading_hierarchy[
@@ -405,11 +445,17 @@ class MarkdownHeaderTextSplitter:
             current_heading = current_heading.replace("#", "").strip()
             try:
                 self._set_chunk_id(
-                    id_index_dict, current_heading, metadata, same_heading_dict
+                    id_index_dict,
+                    current_heading,
+                    metadata,
+                    same_heading_dict,
+                    file_path,
                 )
             except KeyError:
                 logger.info(f"No standard heading found")
-                id_prefix = str(uuid.uuid4())[:8]
+                id_prefix = get_id_prefix(
+                    file_path, current_heading, len(chunks)
+                )
                 metadata["chunk_id"] = f"$0-{id_prefix}"
             if metadata["chunk_id"] in heading_hierarchy:
                 metadata["heading_hierarchy"] = heading_hierarchy[
@@ -5,6 +5,9 @@ Helper functions for storage intermediate content or log
 import datetime
 import json
 import logging
+import threading
+from contextvars import ContextVar
+from typing import Union
 from urllib.parse import urlparse
 from botocore.exceptions import ClientError
 
@@ -60,19 +63,153 @@ def upload_chunk_to_s3(
         logger.error(f"Error uploading logger file to S3: {e}")
 
 
+def get_artifact_prefix(document: Document) -> str:
+    # Extract the filename from the file_path in the metadata
+    file_path = document.metadata.get("file_path", "")
+    # filename = file_path.split('/')[-1].split('.')[0]
+    return file_path.replace("s3://", "").replace("/", "-").replace(".", "-")
+
+
+class S3ArtifactWriter:
+    """Pack the intermediate contents of a file into one JSONL object per
+    prefix and splitting type, instead of one object per document.
+
+    Each JSONL object is written with a lookup index next to it,
+    `<object key>.index.json`, listing the chunk id, byte offset and length
+    of every line, so that readers can fetch a single chunk with a ranged
+    GET, see `load_artifact_chunks`.
+
+    Used as a context manager, the writer is also picked up by
+    `save_content_to_s3` calls in the same context, and flushed on exit.
+    """
+
+    # flush a buffer early once it reaches this size
+    max_buffer_bytes = 64 * 1024 * 1024
+
+    def __init__(self, s3):
+        self.s3 = s3
+        self.lock = threading.Lock()
+        # (bucket, prefix, splitting type) -> list of encoded lines
+        self.buffers = {}
+        self.buffer_bytes = {}
+        self.part_numbers = {}
+        self._token = None
+
+    def __enter__(self):
+        self._token = _current_artifact_writer.set(self)
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        _current_artifact_writer.reset(self._token)
+        self.flush()
+
+    def add(self, document: Document, bucket: str, splitting_type: str):
+        key = (bucket, get_artifact_prefix(document), splitting_type)
+        line = json.dumps(
+            {
+                "page_content": document.page_content,
+                "metadata": document.metadata,
+            },
+            ensure_ascii=False,
+            default=str,
+        ).encode("utf-8")
+        with self.lock:
+            buffer = self.buffers.setdefault(key, [])
+            buffer.append((document.metadata.get("chunk_id"), line))
+            self.buffer_bytes[key] = self.buffer_bytes.get(key, 0) + len(line) + 1
+            if self.buffer_bytes[key] < self.max_buffer_bytes:
+                return
+            self.buffers.pop(key)
+            self.buffer_bytes.pop(key)
+        self._upload(key, buffer)
+
+    def flush(self):
+        with self.lock:
+            buffers, self.buffers = self.buffers, {}
+            self.buffer_bytes = {}
+        for key, buffer in buffers.items():
+            self._upload(key, buffer)
+
+    def _upload(self, key: tuple, buffer: list):
+        bucket, prefix, splitting_type = key
+        with self.lock:
+            part_number = self.part_numbers.get(key, 0)
+            self.part_numbers[key] = part_number + 1
+        now = datetime.datetime.now()
+        # same hierarchy as upload_chunk_to_s3
+        object_key = (
+            f"{prefix}/{splitting_type}/{now.strftime('%Y-%m-%d-%H')}/"
+            f"{now.strftime('%Y-%m-%d-%H-%M-%S-%f')}-{part_number:04d}.jsonl"
+        )
+        index = []
+        offset = 0
+        for chunk_id, line in buffer:
+            index.append({"chunk_id": chunk_id, "offset": offset, "length": len(line)})
+            offset += len(line) + 1
+        try:
+            self.s3.put_object(
+                Bucket=bucket,
+                Key=object_key,
+                Body=b"\n".join(line for _, line in buffer) + b"\n",
+            )
+            self.s3.put_object(
+                Bucket=bucket,
+                Key=f"{object_key}.index.json",
+                Body=json.dumps({"object_key": object_key, "chunks": index}),
+            )
+            logger.debug(f"Upload {len(buffer)} artifacts to s3://{bucket}/{object_key}")
+        except Exception as e:
+            logger.error(f"Error uploading artifacts to S3: {e}")
+
+
+_current_artifact_writer: ContextVar[Union[S3ArtifactWriter, None]] = ContextVar(
+    "current_artifact_writer", default=None
+)
+
+
+def load_artifact_chunks(s3, bucket: str, index_key: str, chunk_id: str) -> list:
+    """Load the documents of a chunk id from a JSONL artifact object
+
+    Args:
+        s3 (_type_): S3 client
+        bucket (str): S3 bucket of the artifact
+        index_key (str): Key of the `.index.json` lookup index of the artifact
+        chunk_id (str): Chunk id to load
+
+    Returns:
+        list: The matching documents as dicts with page_content and metadata
+    """
+    index = json.loads(s3.get_object(Bucket=bucket, Key=index_key)["Body"].read())
+    documents = []
+    for entry in index["chunks"]:
+        if entry["chunk_id"] != chunk_id:
+            continue
+        start = entry["offset"]
+        end = start + entry["length"] - 1
+        body = s3.get_object(
+            Bucket=bucket, Key=index["object_key"], Range=f"bytes={start}-{end}"
+        )["Body"].read()
+        documents.append(json.loads(body))
+    return documents
+
+
 def save_content_to_s3(s3, document: Document, res_bucket: str, splitting_type: str):
     """Save content to S3 bucket
 
+    When an S3ArtifactWriter is active in the current context, the content
+    is buffered into the JSONL artifact of the file instead.
+
     Args:
         document (Document): The page document to be saved
         res_bucket (str): Target S3 bucket
         s3 (_type_): S3 client
     """
+    artifact_writer = _current_artifact_writer.get()
+    if artifact_writer is not None:
+        artifact_writer.add(document, res_bucket, splitting_type)
+        return
     logger_file = convert_to_logger(document)
-    # Extract the filename from the file_path in the metadata
-    file_path = document.metadata.get("file_path", "")
-    # filename = file_path.split('/')[-1].split('.')[0]
-    filename = file_path.replace("s3://", "").replace("/", "-").replace(".", "-")
+    filename = get_artifact_prefix(document)
     # RecursiveCharacterTextSplitter have been rewrite to split based on chunk size & overlap, use separate folder to store the logger file
     upload_chunk_to_s3(s3, logger_file, res_bucket, filename, splitting_type)
 
@@ -0,0 +1,148 @@
+"""
+Staged pipeline with bounded worker pools connected by bounded queues.
+
+Each task, e.g. an S3 object, enters the first stage and fans out into
+items, e.g. chunk batches, which flow through the following stages. Every
+stage has its own thread pool, and the bounded queues between the stages
+apply back pressure, so a slow stage throttles the stages before it instead
+of buffering the whole corpus in memory. When all items of a task have left
+the pipeline, or one of them failed, `on_task_done` is called once for the
+task.
+"""
+import logging
+import queue
+import threading
+from typing import Any, Callable, Iterable, List
+
+logger = logging.getLogger(__name__)
+
+# marks the end of the input of a stage
+_STOP = object()
+
+
+class PipelineTask:
+    """A unit of work whose items flow through the pipeline"""
+
+    def __init__(self, payload: Any):
+        self.payload = payload
+        self.error = None
+        self.item_count = 0
+        self._pending = 0
+        self._lock = threading.Lock()
+
+    def _add_pending(self, delta: int) -> int:
+        with self._lock:
+            self._pending += delta
+            return self._pending
+
+
+class PipelineStage:
+    """
+    A stage of the pipeline.
+
+    Args:
+        name (str): name of the stage, used in logs.
+        func (Callable): called with each item of the stage. Except for the
+            last stage it returns an iterable of the items of the next stage.
+        workers (int): number of threads running the stage.
+    """
+
+    def __init__(self, name: str, func: Callable, workers: int = 1):
+        self.name = name
+        self.func = func
+        self.workers = workers
+
+
+class StagedPipeline:
+    """
+    Run tasks through stages, each stage in its own pool of threads.
+
+    Args:
+        stages (List[PipelineStage]): the stages, in order.
+        on_task_done (Callable): called with each finished task. task.error
+            is set if any item of the task failed.
+        queue_size (int): max number of items waiting for each stage.
+    """
+
+    def __init__(
+        self,
+        stages: List[PipelineStage],
+        on_task_done: Callable[[PipelineTask], None],
+        queue_size: int = 16,
+    ):
+        self.stages = stages
+        self.on_task_done = on_task_done
+        self.queues = [queue.Queue(maxsize=queue_size) for _ in stages]
+        self.callback_lock = threading.Lock()
+        self.stats = {stage.name: 0 for stage in stages}
+        self.stats_lock = threading.Lock()
+
+    def _release(self, task: PipelineTask):
+        if task._add_pending(-1) == 0:
+            try:
+                with self.callback_lock:
+                    self.on_task_done(task)
+            except Exception:
+                logger.exception("Error finishing task %s", task.payload)
+
+    def _run_worker(self, stage_index: int):
+        stage = self.stages[stage_index]
+        in_queue = self.queues[stage_index]
+        is_last_stage = stage_index == len(self.stages) - 1
+        while True:
+            entry = in_queue.get()
+            if entry is _STOP:
+                return
+            task, item = entry
+            try:
+                # skip the remaining items of a failed task
+                if task.error is not None:
+                    continue
+                outputs = stage.func(item)
+                if not is_last_stage:
+                    for output in outputs:
+                        # hold the task until the output is processed
+                        task._add_pending(1)
+                        self.queues[stage_index + 1].put((task, output))
+                with self.stats_lock:
+                    self.stats[stage.name] += 1
+                    if is_last_stage:
+                        task.item_count += 1
+            except Exception as e:
+                logger.exception(
+                    "Error in stage %s for task %s", stage.name, task.payload
+                )
+                if task.error is None:
+                    task.error = e
+            finally:
+                self._release(task)
+
+    def run(self, payloads: Iterable):
+        """Run all payloads through the pipeline and wait for them"""
+        stage_threads = []
+        for stage_index, stage in enumerate(self.stages):
+            threads = [
+                threading.Thread(
+                    target=self._run_worker,
+                    args=(stage_index,),
+                    name=f"{stage.name}-{i}",
+                    daemon=True,
+                )
+                for i in range(stage.workers)
+            ]
+            for thread in threads:
+                thread.start()
+            stage_threads.append(threads)
+
+        try:
+            for payload in payloads:
+                task = PipelineTask(payload)
+                task._add_pending(1)
+                self.queues[0].put((task, payload))
+        finally:
+            # a stage is drained once all workers of the previous stage exit
+            for stage_queue, threads in zip(self.queues, stage_threads):
+                for _ in threads:
+                    stage_queue.put(_STOP)
+                for thread in threads:
+                    thread.join()
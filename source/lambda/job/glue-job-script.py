@@ -1,13 +1,16 @@
+import hashlib
 import itertools
 import json
 import logging
 import os
 import sys
+import threading
 import traceback
 from datetime import datetime, timezone
 from typing import Generator, Iterable, List
 
 import boto3
+from boto3.dynamodb.conditions import Key
 from langchain.docstore.document import Document
 from langchain.text_splitter import RecursiveCharacterTextSplitter
 from langchain_community.vectorstores import OpenSearchVectorSearch
@@ -15,6 +18,7 @@ from langchain_community.vectorstores.opensearch_vector_search import (
     OpenSearchVectorSearch,
 )
 from opensearchpy import RequestsHttpConnection
+from opensearchpy.helpers import scan
 from requests_aws4auth import AWS4Auth
 from tenacity import retry, stop_after_attempt, wait_exponential
 
@@ -32,6 +36,7 @@ args = getResolvedOptions(
         "BATCH_INDICE",
         "DOCUMENT_LANGUAGE",
         "ETL_MODEL_ENDPOINT",
+        "ETL_NOTIFICATION_QUEUE_URL",
         "JOB_NAME",
         "OFFLINE",
         "ETL_OBJECT_TABLE",
@@ -60,7 +65,13 @@ from llm_bot_dep.schemas.processing_parameters import (
     ProcessingParameters,
     VLLMParameters,
 )
-from llm_bot_dep.storage_utils import save_content_to_s3
+from llm_bot_dep.storage_utils import S3ArtifactWriter, save_content_to_s3
+from llm_bot_dep.utils.opensearch_utils import delete_documents_by_query
+from llm_bot_dep.utils.pipeline_utils import (
+    PipelineStage,
+    PipelineTask,
+    StagedPipeline,
+)
 
 # Adaption to allow nougat to run in AWS Glue with writable /tmp
 os.environ["TRANSFORMERS_CACHE"] = "/tmp/transformers_cache"
@@ -75,6 +86,10 @@ batchFileNumber = args["BATCH_FILE_NUMBER"]
 batchIndice = args["BATCH_INDICE"]
 document_language = args["DOCUMENT_LANGUAGE"]
 etlModelEndpoint = args["ETL_MODEL_ENDPOINT"]
+etl_notification_queue_url = args["ETL_NOTIFICATION_QUEUE_URL"]
+# "-" when the ETL model endpoint has no completion notifications
+if etl_notification_queue_url == "-":
+    etl_notification_queue_url = ""
 offline = args["OFFLINE"]
 etl_object_table_name = args["ETL_OBJECT_TABLE"]
 portal_bucket_name = args["PORTAL_BUCKET"]
@@ -108,6 +123,18 @@ OBJECT_EXPIRY_TIME = 3600
 credentials = boto3.Session().get_credentials()
 MAX_OS_DOCS_PER_PUT = 8
 
+# worker pool size of each ingestion pipeline stage
+LOAD_WORKERS = 4
+CHUNK_WORKERS = 2
+EMBEDDING_WORKERS = 4
+INDEX_WORKERS = 2
+PIPELINE_QUEUE_SIZE = 16
+MAX_BULK_DELETE_SIZE = 500
+# vector field written by OpenSearchVectorSearch
+VECTOR_FIELD = "vector_field"
+# unit of the chunk size, "character" or "token"
+CHUNK_LENGTH_UNIT = "character"
+
 
 def get_model_info():
     # Get Embedding Model Parameters
@@ -172,10 +199,35 @@ def update_etl_object_table(
         "createTime": str(datetime.now(timezone.utc)),
         "status": status,
         "detail": detail,
+        "etag": processing_params.source_object_etag,
     }
     etl_object_table.put_item(Item=input_body)
 
 
+def is_etag_completed(s3_path: str, etag: str) -> bool:
+    """
+    Whether the latest previous execution which processed this version of
+    the object completed, i.e. did not leave it partially indexed.
+    """
+    items = []
+    query_kwargs = {"KeyConditionExpression": Key("s3Path").eq(s3_path)}
+    while True:
+        response = etl_object_table.query(**query_kwargs)
+        items.extend(response.get("Items", []))
+        if "LastEvaluatedKey" not in response:
+            break
+        query_kwargs["ExclusiveStartKey"] = response["LastEvaluatedKey"]
+    items = [
+        item
+        for item in items
+        if item.get("etag") == etag and item.get("executionId") != table_item_id
+    ]
+    if not items:
+        return False
+    latest_item = max(items, key=lambda item: item.get("createTime", ""))
+    return latest_item.get("status") == "COMPLETED"
+
+
 class S3FileIterator:
     def __init__(
         self, bucket: str, prefix: str, supported_file_types: List[str] = []
@@ -227,7 +279,9 @@ class S3FileIterator:
                     processing_params = ProcessingParameters(
                         source_bucket_name=self.bucket,
                         source_object_key=key,
+                        source_object_etag=obj.get("ETag", "").strip('"'),
                         etl_endpoint_name=etlModelEndpoint,
+                        etl_notification_queue_url=etl_notification_queue_url,
                         result_bucket_name=res_bucket,
                         portal_bucket_name=portal_bucket_name,
                         document_language=document_language,
@@ -252,6 +306,7 @@ class BatchChunkDocumentProcessor:
         chunk_size (int): The size of each chunk.
         chunk_overlap (int): The overlap between consecutive chunks.
         batch_size (int): The size of each batch.
+        length_unit (str): The unit of chunk_size and chunk_overlap, "character" or "token".
 
     Methods:
         chunk_generator(content: List[Document]) -> Generator[Document, None, None]:
@@ -262,15 +317,47 @@ class BatchChunkDocumentProcessor:
 
     """
 
+    # text splitters are stateless, share one per configuration
+    text_splitters = {}
+    text_splitters_lock = threading.Lock()
+
     def __init__(
         self,
         chunk_size: int,
         chunk_overlap: int,
         batch_size: int,
+        length_unit: str = "character",
     ):
         self.chunk_size = chunk_size
         self.chunk_overlap = chunk_overlap
         self.batch_size = batch_size
+        self.length_unit = length_unit
+
+    def get_text_splitter(self) -> RecursiveCharacterTextSplitter:
+        key = (self.chunk_size, self.chunk_overlap, self.length_unit)
+        with self.text_splitters_lock:
+            if key not in self.text_splitters:
+                if self.length_unit == "token":
+                    # tiktoken encodes natively, so measuring tokens costs
+                    # about the same as measuring characters in python
+                    text_splitter = (
+                        RecursiveCharacterTextSplitter.from_tiktoken_encoder(
+                            encoding_name="cl100k_base",
+                            chunk_size=self.chunk_size,
+                            chunk_overlap=self.chunk_overlap,
+                        )
+                    )
+                elif self.length_unit == "character":
+                    text_splitter = RecursiveCharacterTextSplitter(
+                        chunk_size=self.chunk_size,
+                        chunk_overlap=self.chunk_overlap,
+                    )
+                else:
+                    raise ValueError(
+                        f"Invalid length unit {self.length_unit}. Valid units: character, token"
+                    )
+                self.text_splitters[key] = text_splitter
+            return self.text_splitters[key]
 
     def chunk_generator(
         self, content: List[Document]
@@ -285,40 +372,22 @@ class BatchChunkDocumentProcessor:
             Document: A chunk of a document.
 
         """
-        temp_text_splitter = RecursiveCharacterTextSplitter(
-            chunk_size=self.chunk_size, chunk_overlap=self.chunk_overlap
-        )
-        temp_content = content
-        text_splitter = RecursiveCharacterTextSplitter(
-            chunk_size=self.chunk_size, chunk_overlap=self.chunk_overlap
-        )
-        updated_heading_hierarchy = {}
-        for temp_document in temp_content:
-            temp_chunk_id = temp_document.metadata["chunk_id"]
-            temp_split_size = len(
-                temp_text_splitter.split_documents([temp_document])
-            )
-            # Add size in heading_hierarchy
-            if "heading_hierarchy" in temp_document.metadata:
-                temp_hierarchy = temp_document.metadata["heading_hierarchy"]
-                temp_hierarchy["size"] = temp_split_size
-                updated_heading_hierarchy[temp_chunk_id] = temp_hierarchy
-
+        text_splitter = self.get_text_splitter()
         for document in content:
+            # Each document is split once, the number of splits is the
+            # size in heading_hierarchy
             splits = text_splitter.split_documents([document])
-            # List of Document objects
-            index = 1
-            for split in splits:
-                chunk_id = split.metadata["chunk_id"]
-                logger.info(chunk_id)
+            chunk_id = document.metadata["chunk_id"]
+            heading_hierarchy = document.metadata.get("heading_hierarchy")
+            if heading_hierarchy is not None:
+                heading_hierarchy["size"] = len(splits)
+
+            for index, split in enumerate(splits, start=1):
                 split.metadata["chunk_id"] = f"{chunk_id}-{index}"
-                if chunk_id in updated_heading_hierarchy:
-                    split.metadata["heading_hierarchy"] = (
-                        updated_heading_hierarchy[chunk_id]
-                    )
-                    logger.info(split.metadata["heading_hierarchy"])
-                index += 1
+                if heading_hierarchy is not None:
+                    split.metadata["heading_hierarchy"] = heading_hierarchy
                 yield split
+            logger.debug("Split %s into %d chunks", chunk_id, len(splits))
 
     def batch_generator(
         self, content: List[Document], gen_chunk_flag: bool = True
@@ -355,6 +424,7 @@ class BatchQueryDocumentProcessor:
         batch_size (int): The size of each batch.
 
     Methods:
+        build_query(s3_path): Builds the query of the documents of the given S3 path.
         query_documents(s3_path): Queries documents based on the given S3 path.
         batch_generator(s3_path): Generates batches of document IDs based on the given S3 path.
     """
@@ -367,6 +437,19 @@ class BatchQueryDocumentProcessor:
         self.docsearch = docsearch
         self.batch_size = batch_size
 
+    def build_query(self, s3_path) -> dict:
+        """
+        Builds the query of the documents of the given S3 path.
+
+        Args:
+            s3_path (str): The S3 path to query documents from.
+
+        Returns:
+            dict: The OpenSearch query.
+        """
+        # use term-level queries only for fields mapped as keyword
+        return {"prefix": {"metadata.file_path.keyword": {"value": s3_path}}}
+
     def query_documents(self, s3_path) -> Iterable:
         """
         Queries documents based on the given S3 path.
@@ -378,13 +461,8 @@ class BatchQueryDocumentProcessor:
             Iterable: An iterable of document IDs.
         """
         search_body = {
-            "query": {
-                # use term-level queries only for fields mapped as keyword
-                "prefix": {"metadata.file_path.keyword": {"value": s3_path}},
-            },
-            "size": 10000,
-            "sort": [{"_score": {"order": "desc"}}],
-            "_source": {"excludes": ["vector_field"]},
+            "query": self.build_query(s3_path),
+            "_source": False,
         }
 
         if self.docsearch.client.indices.exists(
@@ -394,13 +472,15 @@ class BatchQueryDocumentProcessor:
                 "BatchQueryDocumentProcessor: Querying documents for %s",
                 s3_path,
             )
-            query_documents = self.docsearch.client.search(
-                index=self.docsearch.index_name, body=search_body
+            # scroll through all matching documents instead of the first 10000
+            return (
+                doc["_id"]
+                for doc in scan(
+                    self.docsearch.client,
+                    index=self.docsearch.index_name,
+                    query=search_body,
+                )
             )
-            document_ids = [
-                doc["_id"] for doc in query_documents["hits"]["hits"]
-            ]
-            return document_ids
         else:
             logger.info(
                 "BatchQueryDocumentProcessor: Index %s does not exist, skipping deletion",
@@ -440,7 +520,7 @@ class OpenSearchIngestionWorker:
         stop=stop_after_attempt(3),
         wait=wait_exponential(multiplier=1, min=4, max=10),
     )
-    def aos_ingestion(self, documents: List[Document]) -> None:
+    def embed_documents(self, documents: List[Document]) -> tuple:
         texts = [doc.page_content for doc in documents]
         metadatas = [doc.metadata for doc in documents]
         embeddings_vectors = self.docsearch.embedding_function.embed_documents(
@@ -458,10 +538,125 @@ class OpenSearchIngestionWorker:
                 metadata_list.append(metadata)
             embeddings_vectors = embeddings_vectors_list
             metadatas = metadata_list
+        return texts, embeddings_vectors, metadatas
+
+    @retry(
+        stop=stop_after_attempt(3),
+        wait=wait_exponential(multiplier=1, min=4, max=10),
+    )
+    def index_documents(
+        self, texts, embeddings_vectors, metadatas, ids=None
+    ) -> None:
         self.docsearch._OpenSearchVectorSearch__add(
-            texts, embeddings_vectors, metadatas=metadatas
+            texts, embeddings_vectors, metadatas=metadatas, ids=ids
+        )
+
+    def get_indexed_chunks(self, s3_path: str) -> dict:
+        """
+        Get the content hash, the file ETag and the embedding model of the
+        indexed chunks of a file.
+
+        Args:
+            s3_path (str): The S3 path of the file.
+
+        Returns:
+            dict: document id -> chunk metadata
+        """
+        client = self.docsearch.client
+        if not client.indices.exists(index=self.docsearch.index_name):
+            return {}
+        return {
+            hit["_id"]: hit["_source"].get("metadata", {})
+            for hit in scan(
+                client,
+                index=self.docsearch.index_name,
+                query={
+                    "query": {
+                        "term": {"metadata.file_path.keyword": s3_path}
+                    },
+                    "_source": [
+                        "metadata.content_hash",
+                        "metadata.file_etag",
+                        "metadata.embedding_model_id",
+                    ],
+                },
+            )
+        }
+
+    @retry(
+        stop=stop_after_attempt(3),
+        wait=wait_exponential(multiplier=1, min=4, max=10),
+    )
+    def get_chunk_vectors(self, doc_ids: List[str]) -> dict:
+        """
+        Get the vectors of indexed chunks.
+
+        Returns:
+            dict: document id -> vector, for the chunks still in the index
+        """
+        response = self.docsearch.client.mget(
+            index=self.docsearch.index_name,
+            body={"ids": doc_ids},
+            _source_includes=[VECTOR_FIELD],
+        )
+        return {
+            doc["_id"]: doc["_source"][VECTOR_FIELD]
+            for doc in response["docs"]
+            if doc.get("found") and VECTOR_FIELD in doc.get("_source", {})
+        }
+
+    @retry(
+        stop=stop_after_attempt(3),
+        wait=wait_exponential(multiplier=1, min=4, max=10),
+    )
+    def bulk(self, bulk_requests: List[dict]) -> None:
+        response = self.docsearch.client.bulk(body=bulk_requests)
+        if response.get("errors"):
+            failed_items = [
+                item
+                for item in response["items"]
+                if any("error" in result for result in item.values())
+            ]
+            raise RuntimeError(
+                f"{len(failed_items)} bulk operations on "
+                f"{self.docsearch.index_name} failed, e.g. {failed_items[0]}"
+            )
+
+    def update_documents_metadata(self, documents: List[tuple]) -> None:
+        """
+        Write the current metadata of chunks whose text is unchanged. Besides
+        the file version and ETag, the heading hierarchy links of a chunk
+        change when headings are inserted or removed around it. The whole
+        metadata object is replaced, as a partial `doc` update would be merged
+        with the indexed one and keep the keys which disappeared.
+        """
+        bulk_requests = []
+        for doc_id, document in documents:
+            bulk_requests.append(
+                {"update": {"_id": doc_id, "_index": self.docsearch.index_name}}
+            )
+            bulk_requests.append(
+                {
+                    "script": {
+                        "source": "ctx._source.metadata = params.metadata",
+                        "lang": "painless",
+                        "params": {"metadata": document.metadata},
+                    }
+                }
+            )
+        self.bulk(bulk_requests)
+
+    def delete_documents(self, doc_ids: List[str]) -> None:
+        self.bulk(
+            [
+                {"delete": {"_id": doc_id, "_index": self.docsearch.index_name}}
+                for doc_id in doc_ids
+            ]
         )
 
+    def aos_ingestion(self, documents: List[Document]) -> None:
+        self.index_documents(*self.embed_documents(documents))
+
 
 class OpenSearchDeleteWorker:
     def __init__(self, docsearch: OpenSearchVectorSearch):
@@ -487,66 +682,282 @@ class OpenSearchDeleteWorker:
             logger.info("Deleted %d documents", len(document_ids))
             return
 
+    def aos_deletion_by_query(self, query: dict) -> dict:
+        return delete_documents_by_query(
+            self.docsearch.client, self.index_name, query
+        )
+
 
-def ingestion_pipeline(
-    s3_files_iterator,
-    batch_chunk_processor,
-    ingestion_worker,
-    extract_only=False,
-):
-    for processing_params in s3_files_iterator:
-        try:
-            # The res is list[Document] type
-            documents = process_object(processing_params)
-            for document in documents:
-                save_content_to_s3(
-                    s3_client,
-                    document,
-                    processing_params.result_bucket_name,
-                    SplittingType.SEMANTIC.value,
-                )
+def get_s3_path(processing_params: ProcessingParameters) -> str:
+    return f"s3://{processing_params.source_bucket_name}/{processing_params.source_object_key}"
 
-            gen_chunk_flag = (
-                False
-                if processing_params.file_type in ["csv", "xlsx", "xls"]
-                else True
+
+def get_chunk_doc_id(s3_path: str, chunk_id: str, seq: int) -> str:
+    """
+    Deterministic OpenSearch document id of a chunk. seq tells apart the
+    chunks sharing the same chunk id, e.g. the rows of a csv file.
+    """
+    key = f"{s3_path}|{chunk_id}|{seq}"
+    return hashlib.sha256(key.encode("utf-8")).hexdigest()
+
+
+def get_content_hash(text: str) -> str:
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+
+def load_documents(
+    processing_params: ProcessingParameters,
+    ingestion_worker: OpenSearchIngestionWorker,
+    incremental: bool,
+) -> list:
+    indexed_chunks = {}
+    if incremental:
+        s3_path = get_s3_path(processing_params)
+        indexed_chunks = ingestion_worker.get_indexed_chunks(s3_path)
+        etag = processing_params.source_object_etag
+        # a failed run leaves some chunks stamped with the new ETag and
+        # others missing, so also require a completed run of this ETag
+        if (
+            etag
+            and indexed_chunks
+            and all(
+                chunk.get("file_etag") == etag
+                for chunk in indexed_chunks.values()
             )
-            batches = batch_chunk_processor.batch_generator(
-                documents, gen_chunk_flag
+            and is_etag_completed(s3_path, etag)
+        ):
+            logger.info("Object %s is unchanged, skipping", s3_path)
+            return []
+
+    # pack the intermediate contents of the file into one S3 object per
+    # splitting type
+    with S3ArtifactWriter(s3_client):
+        # The res is list[Document] type
+        documents = process_object(processing_params)
+        for document in documents:
+            save_content_to_s3(
+                s3_client,
+                document,
+                processing_params.result_bucket_name,
+                SplittingType.SEMANTIC.value,
             )
+    return [(processing_params, documents, indexed_chunks)]
 
-            for batch in batches:
-                if len(batch) == 0:
-                    continue
 
-                for document in batch:
-                    if "complete_heading" in document.metadata:
-                        document.page_content = (
-                            document.metadata["complete_heading"]
-                            + " "
-                            + document.page_content
-                        )
-                    else:
-                        document.page_content = document.page_content
-
-                    save_content_to_s3(
-                        s3_client,
-                        document,
-                        processing_params.result_bucket_name,
-                        SplittingType.CHUNK.value,
+def chunk_documents(
+    item, batch_chunk_processor, ingestion_worker=None
+) -> Generator:
+    """
+    Chunk the documents of a file and yield the write operations of the
+    chunks: ("index", chunks) for new or changed chunks, ("update", chunks)
+    for chunks with unchanged text, which only need their metadata
+    rewritten, ("reuse", chunks) for chunks whose text is indexed under
+    another id, e.g. after headings were inserted above them, which are
+    indexed with the vector of that chunk, and
+    ("delete", doc_ids) for the indexed chunks which vanished.
+    """
+    processing_params, documents, indexed_chunks = item
+    s3_path = get_s3_path(processing_params)
+    indexed_doc_ids_by_hash = {}
+    for doc_id, indexed_chunk in indexed_chunks.items():
+        if indexed_chunk.get("content_hash"):
+            indexed_doc_ids_by_hash.setdefault(
+                indexed_chunk["content_hash"], doc_id
+            )
+    gen_chunk_flag = (
+        False if processing_params.file_type in ["csv", "xlsx", "xls"] else True
+    )
+    batches = batch_chunk_processor.batch_generator(documents, gen_chunk_flag)
+    chunk_id_counts = {}
+    chunk_doc_ids = set()
+    artifact_writer = S3ArtifactWriter(s3_client)
+
+    # not used as a context manager, since the generator is resumed from
+    # the caller's context; flushed as well when indexing fails or stops
+    try:
+        for batch in batches:
+            if len(batch) == 0:
+                continue
+
+            changed_chunks = []
+            unchanged_chunks = []
+            reusable_chunks = []
+            for document in batch:
+                # version stamp used by the online whole doc cache to
+                # detect re-ingested files
+                document.metadata["file_version"] = table_item_id
+                document.metadata["file_etag"] = processing_params.source_object_etag
+                if "complete_heading" in document.metadata:
+                    document.page_content = (
+                        document.metadata["complete_heading"]
+                        + " "
+                        + document.page_content
                     )
+                else:
+                    document.page_content = document.page_content
 
-                if not extract_only:
-                    ingestion_worker.aos_ingestion(batch)
-            update_etl_object_table(processing_params, "COMPLETED")
-        except Exception as e:
-            logger.error(
-                "Error processing object %s: %s",
-                f"{processing_params.source_bucket_name}/{processing_params.source_object_key}",
-                e,
+                chunk_id = document.metadata.get("chunk_id", "")
+                seq = chunk_id_counts.get(chunk_id, 0)
+                chunk_id_counts[chunk_id] = seq + 1
+                doc_id = get_chunk_doc_id(s3_path, chunk_id, seq)
+                chunk_doc_ids.add(doc_id)
+                content_hash = get_content_hash(document.page_content)
+                document.metadata["content_hash"] = content_hash
+
+                artifact_writer.add(
+                    document,
+                    processing_params.result_bucket_name,
+                    SplittingType.CHUNK.value,
+                )
+
+                indexed_chunk = indexed_chunks.get(doc_id)
+                if indexed_chunk and indexed_chunk.get("content_hash") == content_hash:
+                    if "embedding_model_id" in indexed_chunk:
+                        document.metadata["embedding_model_id"] = indexed_chunk[
+                            "embedding_model_id"
+                        ]
+                    unchanged_chunks.append((doc_id, document))
+                elif content_hash in indexed_doc_ids_by_hash and ingestion_worker:
+                    reusable_chunks.append(
+                        (doc_id, document, indexed_doc_ids_by_hash[content_hash])
+                    )
+                else:
+                    changed_chunks.append((doc_id, document))
+
+            if reusable_chunks:
+                # read the vectors now, before the vanished source chunks
+                # are deleted at the end of the file
+                vectors = ingestion_worker.get_chunk_vectors(
+                    list({source_id for _, _, source_id in reusable_chunks})
+                )
+                reused_chunks = []
+                for doc_id, document, source_id in reusable_chunks:
+                    if source_id not in vectors:
+                        changed_chunks.append((doc_id, document))
+                        continue
+                    source_chunk = indexed_chunks[source_id]
+                    if "embedding_model_id" in source_chunk:
+                        document.metadata["embedding_model_id"] = source_chunk[
+                            "embedding_model_id"
+                        ]
+                    reused_chunks.append((doc_id, document, vectors[source_id]))
+                if reused_chunks:
+                    yield ("reuse", reused_chunks)
+            if changed_chunks:
+                yield ("index", changed_chunks)
+            if unchanged_chunks:
+                yield ("update", unchanged_chunks)
+    finally:
+        artifact_writer.flush()
+
+    vanished_doc_ids = [
+        doc_id for doc_id in indexed_chunks if doc_id not in chunk_doc_ids
+    ]
+    for i in range(0, len(vanished_doc_ids), MAX_BULK_DELETE_SIZE):
+        yield ("delete", vanished_doc_ids[i : i + MAX_BULK_DELETE_SIZE])
+
+
+def embed_chunks(item, ingestion_worker: OpenSearchIngestionWorker) -> list:
+    operation, chunks = item
+    if operation == "reuse":
+        return [
+            (
+                "index",
+                (
+                    [document.page_content for _, document, _ in chunks],
+                    [vector for _, _, vector in chunks],
+                    [document.metadata for _, document, _ in chunks],
+                    [doc_id for doc_id, _, _ in chunks],
+                ),
             )
-            update_etl_object_table(processing_params, "FAILED", str(e))
-            traceback.print_exc()
+        ]
+    if operation != "index":
+        return [item]
+    texts, embeddings_vectors, metadatas = ingestion_worker.embed_documents(
+        [document for _, document in chunks]
+    )
+    ids = [doc_id for doc_id, _ in chunks]
+    return [(operation, (texts, embeddings_vectors, metadatas, ids))]
+
+
+def write_chunks(item, ingestion_worker: OpenSearchIngestionWorker) -> None:
+    operation, payload = item
+    if operation == "index":
+        ingestion_worker.index_documents(*payload)
+    elif operation == "update":
+        ingestion_worker.update_documents_metadata(payload)
+    elif operation == "delete":
+        ingestion_worker.delete_documents(payload)
+
+
+def finish_ingestion_task(task: PipelineTask):
+    processing_params = task.payload
+    if task.error is None:
+        update_etl_object_table(processing_params, "COMPLETED")
+    else:
+        logger.error(
+            "Error processing object %s: %s",
+            f"{processing_params.source_bucket_name}/{processing_params.source_object_key}",
+            task.error,
+        )
+        update_etl_object_table(processing_params, "FAILED", str(task.error))
+
+
+def ingestion_pipeline(
+    s3_files_iterator,
+    batch_chunk_processor,
+    ingestion_worker,
+    extract_only=False,
+):
+    """
+    Load, chunk, embed and index the files in separate worker pools, so
+    the network I/O of different files and batches overlaps.
+
+    Unless extract_only is set, the ingestion is incremental: files whose
+    ETag is unchanged are skipped, only the chunks of the other files whose
+    text is not indexed yet are embedded, and the chunks which vanished are
+    deleted.
+    """
+    stages = [
+        PipelineStage(
+            "load",
+            lambda processing_params: load_documents(
+                processing_params, ingestion_worker, not extract_only
+            ),
+            LOAD_WORKERS,
+        ),
+        PipelineStage(
+            "chunk",
+            lambda item: chunk_documents(
+                item,
+                batch_chunk_processor,
+                None if extract_only else ingestion_worker,
+            ),
+            CHUNK_WORKERS,
+        ),
+    ]
+    if not extract_only:
+        stages += [
+            PipelineStage(
+                "embed",
+                lambda item: embed_chunks(item, ingestion_worker),
+                EMBEDDING_WORKERS,
+            ),
+            PipelineStage(
+                "index",
+                lambda item: write_chunks(item, ingestion_worker),
+                INDEX_WORKERS,
+            ),
+        ]
+    else:
+        # chunks are saved to S3 by the chunk stage
+        stages.append(PipelineStage("extract", lambda batch: None, 1))
+
+    pipeline = StagedPipeline(
+        stages, finish_ingestion_task, queue_size=PIPELINE_QUEUE_SIZE
+    )
+    pipeline.run(s3_files_iterator)
+    logger.info("Ingestion pipeline stats: %s", pipeline.stats)
 
 
 def delete_pipeline(s3_files_iterator, document_generator, delete_worker):
@@ -554,11 +965,9 @@ def delete_pipeline(s3_files_iterator, document_generator, delete_worker):
         try:
             s3_path = f"s3://{processing_params.source_bucket_name}/{processing_params.source_object_key}"
 
-            batches = document_generator.batch_generator(s3_path)
-            for batch in batches:
-                if len(batch) == 0:
-                    continue
-                delete_worker.aos_deletion(batch)
+            delete_worker.aos_deletion_by_query(
+                document_generator.build_query(s3_path)
+            )
 
         except Exception as e:
             logger.error(
@@ -588,13 +997,16 @@ def create_processors_and_workers(
             - worker: The worker responsible for performing the operation.
     """
 
-    if operation_type in ["create", "extract_only"]:
+    if operation_type in ["create", "update", "extract_only"]:
         s3_files_iterator = file_iterator.iterate_s3_files(extract_content=True)
         batch_processor = BatchChunkDocumentProcessor(
-            chunk_size=1024, chunk_overlap=30, batch_size=10
+            chunk_size=1024,
+            chunk_overlap=30,
+            batch_size=10,
+            length_unit=CHUNK_LENGTH_UNIT,
         )
         worker = OpenSearchIngestionWorker(docsearch, embedding_model_id)
-    elif operation_type in ["delete", "update"]:
+    elif operation_type == "delete":
         s3_files_iterator = file_iterator.iterate_s3_files(
             extract_content=False
         )
@@ -673,15 +1085,8 @@ def main():
     elif operation_type == "delete":
         delete_pipeline(s3_files_iterator, batch_processor, worker)
     elif operation_type == "update":
-        # Delete the documents first
-        delete_pipeline(s3_files_iterator, batch_processor, worker)
-
-        # Then ingest the documents
-        s3_files_iterator, batch_processor, worker = (
-            create_processors_and_workers(
-                "create", docsearch, embedding_model_id, file_iterator
-            )
-        )
+        # The ingestion only re-embeds the changed chunks and deletes the
+        # vanished ones
         ingestion_pipeline(s3_files_iterator, batch_processor, worker)
     else:
         raise ValueError(
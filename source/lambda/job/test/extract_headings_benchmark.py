@@ -0,0 +1,113 @@
+"""
+Regression check and benchmark of splitter_utils.extract_headings.
+
+The output of the single pass implementation is compared with the previous
+implementation built on find_parent, find_previous_with_same_level,
+find_child and find_next_with_same_level, then both are timed on synthetic
+documents. The previous implementation is quadratic, so it is only timed
+up to 5k headings.
+
+Run from source/lambda/job:
+    python test/extract_headings_benchmark.py
+"""
+import os
+import random
+import re
+import sys
+import time
+
+sys.path.insert(
+    0, os.path.abspath(os.path.join(os.path.dirname(__file__), "../dep"))
+)
+
+from llm_bot_dep.splitter_utils import (
+    extract_headings,
+    find_child,
+    find_next_with_same_level,
+    find_parent,
+    find_previous_with_same_level,
+    get_id_prefix,
+)
+
+SAMPLE_MARKDOWN = """# Guide
+Intro text
+## Install
+### Linux
+### Windows
+## Usage
+#### Deep heading without level 3 parent
+### Commands
+## Usage
+# API
+  ## Indented heading
+##NoSpace
+### Orphan level 3
+# FAQ
+"""
+
+
+def legacy_extract_headings(md_content: str):
+    header_index = 0
+    headers = {}
+    id_index_dict = {}
+    for line in md_content.split("\n"):
+        match = re.match(r"\s*(#+)(.*)", line)
+        if match:
+            header_index += 1
+            level = len(match.group(1))
+            title = match.group(2).strip()
+            _id = f"${header_index}-{get_id_prefix('', header_index, level, title)}"
+            parent = find_parent(headers, level)
+            previous = find_previous_with_same_level(headers, level)
+            headers[_id] = {
+                "title": title,
+                "level": level,
+                "parent": parent,
+                "previous": previous,
+            }
+            id_index_dict.setdefault(title, []).append(_id)
+
+    for header_obj in headers:
+        headers[header_obj]["child"] = find_child(headers, header_obj)
+        headers[header_obj]["next"] = find_next_with_same_level(
+            headers, header_obj
+        )
+
+    return headers, id_index_dict
+
+
+def get_synthetic_markdown(n_headings: int, seed: int = 0) -> str:
+    rng = random.Random(seed)
+    lines = []
+    level = 1
+    for i in range(n_headings):
+        level = max(1, min(6, level + rng.choice([-2, -1, 0, 0, 1, 1])))
+        lines.append(f"{'#' * level} Section {i % 500}")
+        lines.append("Some body text.")
+    return "\n".join(lines)
+
+
+def timed(fn, md_content: str) -> float:
+    start = time.perf_counter()
+    fn(md_content)
+    return time.perf_counter() - start
+
+
+if __name__ == "__main__":
+    documents = [SAMPLE_MARKDOWN] + [
+        get_synthetic_markdown(300, seed) for seed in range(20)
+    ]
+    for md_content in documents:
+        assert extract_headings(md_content) == legacy_extract_headings(
+            md_content
+        )
+    print(f"same hierarchy as the previous implementation on {len(documents)} documents")
+
+    for n_headings in (1000, 5000):
+        md_content = get_synthetic_markdown(n_headings)
+        print(
+            f"{n_headings} headings: previous {timed(legacy_extract_headings, md_content):.2f} s, "
+            f"single pass {timed(extract_headings, md_content):.3f} s"
+        )
+    md_content = get_synthetic_markdown(50000)
+    print(f"50000 headings: single pass {timed(extract_headings, md_content):.3f} s")
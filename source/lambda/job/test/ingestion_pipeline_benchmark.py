@@ -0,0 +1,118 @@
+"""
+Benchmark of the Glue ingestion pipeline against local stubs.
+
+The loader, embedding model and OpenSearch are replaced by stubs which
+sleep for a fixed latency per call, so the benchmark measures how well the
+pipeline overlaps I/O. It compares the sequential per-file loop with the
+staged pipeline used by glue-job-script.py and reports files/min and
+chunks/sec.
+
+Run from source/lambda/job:
+    python test/ingestion_pipeline_benchmark.py
+"""
+import itertools
+import os
+import sys
+import time
+
+sys.path.insert(
+    0, os.path.abspath(os.path.join(os.path.dirname(__file__), "../dep"))
+)
+
+from llm_bot_dep.utils.pipeline_utils import PipelineStage, StagedPipeline
+
+N_FILES = 20
+CHUNKS_PER_FILE = 50
+BATCH_SIZE = 10
+
+# stub latencies, in seconds
+LOAD_LATENCY = 0.2
+S3_PUT_LATENCY = 0.005
+EMBEDDING_LATENCY = 0.05
+BULK_LATENCY = 0.03
+
+
+class StubEmbeddings:
+    def embed_documents(self, texts):
+        time.sleep(EMBEDDING_LATENCY)
+        return [[0.0] * 8 for _ in texts]
+
+
+class StubOpenSearch:
+    def __init__(self):
+        self.indexed = 0
+
+    def bulk(self, texts, embeddings, metadatas):
+        time.sleep(BULK_LATENCY)
+        self.indexed += len(texts)
+
+
+def load_documents(file_name):
+    time.sleep(LOAD_LATENCY)
+    return [(file_name, [f"{file_name}-{i}" for i in range(CHUNKS_PER_FILE)])]
+
+
+def chunk_documents(item):
+    _, chunks = item
+    iterator = iter(chunks)
+    while True:
+        batch = list(itertools.islice(iterator, BATCH_SIZE))
+        if not batch:
+            break
+        for _ in batch:
+            time.sleep(S3_PUT_LATENCY)
+        yield batch
+
+
+def run_sequential(files, embeddings, opensearch):
+    for file_name in files:
+        for item in load_documents(file_name):
+            for batch in chunk_documents(item):
+                vectors = embeddings.embed_documents(batch)
+                opensearch.bulk(batch, vectors, [{}] * len(batch))
+
+
+def run_staged(files, embeddings, opensearch):
+    stages = [
+        PipelineStage("load", load_documents, 4),
+        PipelineStage("chunk", chunk_documents, 2),
+        PipelineStage(
+            "embed",
+            lambda batch: [(batch, embeddings.embed_documents(batch))],
+            4,
+        ),
+        PipelineStage(
+            "index",
+            lambda item: opensearch.bulk(item[0], item[1], [{}] * len(item[0])),
+            2,
+        ),
+    ]
+    failed = []
+    pipeline = StagedPipeline(
+        stages,
+        lambda task: task.error is not None and failed.append(task.payload),
+    )
+    pipeline.run(files)
+    assert not failed, failed
+
+
+def bench(name, fn):
+    files = [f"file-{i}" for i in range(N_FILES)]
+    opensearch = StubOpenSearch()
+    start = time.perf_counter()
+    fn(files, StubEmbeddings(), opensearch)
+    elapsed = time.perf_counter() - start
+    assert opensearch.indexed == N_FILES * CHUNKS_PER_FILE
+    print(
+        f"{name}: {elapsed:.2f} s, {N_FILES / elapsed * 60:.1f} files/min, "
+        f"{opensearch.indexed / elapsed:.1f} chunks/sec"
+    )
+
+
+if __name__ == "__main__":
+    print(
+        f"{N_FILES} files, {CHUNKS_PER_FILE} chunks per file, "
+        f"batch size {BATCH_SIZE}"
+    )
+    bench("sequential", run_sequential)
+    bench("staged    ", run_staged)
@@ -1,5 +1,8 @@
+import copy
 import logging
 import os
+import threading
+import time
 from datetime import datetime
 from typing import List
 
@@ -7,26 +10,88 @@ import boto3
 
 from .chatbot import Chatbot
 
+# BatchGetItem accepts at most 100 keys per request
+BATCH_GET_MAX_KEYS = 100
+
+
+_dynamodb_resource = None
+
+
+def get_dynamodb_resource():
+    global _dynamodb_resource
+    if _dynamodb_resource is None:
+        _dynamodb_resource = boto3.resource("dynamodb")
+    return _dynamodb_resource
+
+
+class ChatbotCache:
+    """
+    Per-container cache of resolved chatbot items, i.e. chatbot items with
+    index and model items filled in.
+
+    Entries are stamped with the chatbot `updateTime`, which the chatbot
+    management API bumps on every write. After CHATBOT_CACHE_TTL seconds an
+    entry is revalidated with a single chatbot `get_item`, and is only
+    resolved again when the version has changed.
+    """
+
+    lock = threading.Lock()
+    ttl = int(os.environ.get("CHATBOT_CACHE_TTL", 60))
+    entries = {}
+    stats = {"hits": 0, "revalidations": 0, "misses": 0}
+
+    @classmethod
+    def get(cls, key: tuple):
+        with cls.lock:
+            return cls.entries.get(key)
+
+    @classmethod
+    def put(cls, key: tuple, version, chatbot_content: dict):
+        with cls.lock:
+            cls.entries[key] = {
+                "version": version,
+                "chatbot_content": chatbot_content,
+                "load_time": time.time(),
+            }
+
+    @classmethod
+    def touch(cls, key: tuple):
+        with cls.lock:
+            if key in cls.entries:
+                cls.entries[key]["load_time"] = time.time()
+
+    @classmethod
+    def invalidate(cls, group_name: str = None, chatbot_id: str = None):
+        """Drop the cached chatbots of a group, or a single chatbot"""
+        with cls.lock:
+            for key in list(cls.entries):
+                if group_name is not None and key[0] != group_name:
+                    continue
+                if chatbot_id is not None and key[1] != chatbot_id:
+                    continue
+                cls.entries.pop(key)
+
 
 class ChatbotManager:
-    def __init__(self, chatbot_table, index_table, model_table):
+    def __init__(self, chatbot_table, index_table, model_table, dynamodb=None):
         self.chatbot_table = chatbot_table
         self.index_table = index_table
         self.model_table = model_table
+        self.dynamodb = dynamodb or boto3.resource("dynamodb")
 
     @classmethod
     def from_environ(cls):
         chatbot_table_name = os.environ.get("CHATBOT_TABLE_NAME", "")
         model_table_name = os.environ.get("MODEL_TABLE_NAME", "")
         index_table_name = os.environ.get("INDEX_TABLE_NAME", "")
-        dynamodb = boto3.resource("dynamodb")
+        dynamodb = get_dynamodb_resource()
         chatbot_table = dynamodb.Table(chatbot_table_name)
         model_table = dynamodb.Table(model_table_name)
         index_table = dynamodb.Table(index_table_name)
-        chatbot_manager = cls(chatbot_table, index_table, model_table)
+        chatbot_manager = cls(chatbot_table, index_table, model_table, dynamodb)
         return chatbot_manager
 
-    
+
     def get_model_config(self,group_name, model_id_in_ddb:str):
         model_content = self.model_table.get_item(
                         Key={"groupName": group_name,
@@ -34,67 +99,158 @@ class ChatbotManager:
         ).get("Item")
         return model_content
 
-
-    def get_chatbot(self, group_name: str, chatbot_id: str):
-        """Get chatbot from chatbot id and add index, model, etc. data
+    def batch_get_items(self, request_keys: dict) -> dict:
+        """Load items of several tables with BatchGetItem
 
         Args:
-            group_name (str): group name
-            chatbot_id (str): chatbot id
+            request_keys (dict): table -> list of keys
 
         Returns:
-            Chatbot instance
+            dict: table name -> list of items
         """
-        chatbot_response = self.chatbot_table.get_item(
-            Key={"groupName": group_name, "chatbotId": chatbot_id}
+        items = {}
+        pending = [
+            (table.name, key)
+            for table, keys in request_keys.items()
+            for key in keys
+        ]
+        while pending:
+            batch, pending = (
+                pending[:BATCH_GET_MAX_KEYS],
+                pending[BATCH_GET_MAX_KEYS:],
+            )
+            request_items = {}
+            for table_name, key in batch:
+                request_items.setdefault(table_name, {"Keys": []})[
+                    "Keys"
+                ].append(key)
+            while request_items:
+                response = self.dynamodb.batch_get_item(
+                    RequestItems=request_items
+                )
+                for table_name, table_items in response.get(
+                    "Responses", {}
+                ).items():
+                    items.setdefault(table_name, []).extend(table_items)
+                request_items = response.get("UnprocessedKeys")
+        return items
+
+    def _resolve_chatbot(self, group_name: str, chatbot_content: dict) -> dict:
+        """Fill index and model items into the chatbot item"""
+        chatbot_content = copy.deepcopy(chatbot_content)
+        index_ids = {
+            index_id
+            for index_item in chatbot_content.get("indexIds").values()
+            for index_id in index_item.get("value").values()
+        }
+        # the chatbot level models are usually the ones referenced by the
+        # indexes, so they are loaded together with the indexes
+        model_ids = {
+            chatbot_content.get(model_key)
+            for model_key in ("embeddingModelId", "rerankModelId")
+            if chatbot_content.get(model_key)
+        }
+        items = self.batch_get_items(
+            {
+                self.index_table: [
+                    {"groupName": group_name, "indexId": index_id}
+                    for index_id in sorted(index_ids)
+                ],
+                self.model_table: [
+                    {"groupName": group_name, "modelId": model_id}
+                    for model_id in sorted(model_ids)
+                ],
+            }
         )
-        chatbot_content = chatbot_response.get("Item")
-        if not chatbot_content:
-            return Chatbot.from_dynamodb_item({})
+        index_contents = {
+            item["indexId"]: item
+            for item in items.get(self.index_table.name, [])
+        }
+        model_contents = {
+            item["modelId"]: item
+            for item in items.get(self.model_table.name, [])
+        }
+
+        missing_model_ids = {
+            model_id
+            for index_content in index_contents.values()
+            for model_id in (
+                index_content.get("modelIds").get("embedding"),
+                index_content.get("modelIds").get("rerank"),
+            )
+            if model_id and model_id not in model_contents
+        }
+        if missing_model_ids:
+            items = self.batch_get_items(
+                {
+                    self.model_table: [
+                        {"groupName": group_name, "modelId": model_id}
+                        for model_id in sorted(missing_model_ids)
+                    ]
+                }
+            )
+            for item in items.get(self.model_table.name, []):
+                model_contents[item["modelId"]] = item
+
         for index_type, index_item in chatbot_content.get("indexIds").items():
             for tag, index_id in index_item.get("value").items():
-                index_content = self.index_table.get_item(
-                    Key={"groupName": group_name, "indexId": index_id}
-                ).get("Item")
+                index_content = copy.deepcopy(index_contents.get(index_id))
 
                 # get embedding model config from ddb
                 embedding_model_id = index_content.get(
                     "modelIds").get("embedding")
                 if embedding_model_id:
-                    # model_content = self.model_table.get_item(
-                    #     Key={"groupName": group_name,
-                    #          "modelId": embedding_model_id}
-                    # ).get("Item")
-                    index_content["modelIds"]["embedding"] = self.get_model_config(
-                        group_name,
-                        embedding_model_id
+                    index_content["modelIds"]["embedding"] = copy.deepcopy(
+                        model_contents.get(embedding_model_id)
                     )
-                
+
                 # get rerank model config from ddb
                 rerank_model_id = index_content.get(
                     "modelIds").get("rerank")
                 if rerank_model_id:
-                    # model_content = self.model_table.get_item(
-                    #     Key={"groupName": group_name,
-                    #          "modelId": rerank_model_id}
-                    # ).get("Item")
-                    index_content["modelIds"]["rerank"] = self.get_model_config(
-                        group_name,
-                        rerank_model_id
+                    index_content["modelIds"]["rerank"] = copy.deepcopy(
+                        model_contents.get(rerank_model_id)
                     )
-            
-                    # parse to model_content to EmbeddingModelConfig format
-                    # index_content["modelIds"]["embedding"] = {
-                    #     "provider": model_content['parameter']['ModelProvider'],
-                    #     "model_id": model_content['parameter']['ModelEndpoint'],
-                    #     "base_url": model_content['parameter'].get('BaseUrl'),
-                    #     "api_key_arn": model_content['parameter'].get('ApiKeyArn'),
-                    #     "api_key": model_content['parameter'].get('ApiKey'),
-                    #     "dimension": model_content['parameter'].get('ModelDimension'),
-                    #     "endpoint_kwargs": model_content['parameter'].get('EndpointKwargs')
-                    # }
                 chatbot_content["indexIds"][index_type]["value"][tag] = index_content
 
-        chatbot = Chatbot.from_dynamodb_item(chatbot_content)
+        return chatbot_content
+
+    def get_chatbot(self, group_name: str, chatbot_id: str):
+        """Get chatbot from chatbot id and add index, model, etc. data
+
+        Args:
+            group_name (str): group name
+            chatbot_id (str): chatbot id
+
+        Returns:
+            Chatbot instance
+        """
+        key = (group_name, chatbot_id)
+        entry = ChatbotCache.get(key)
+        if entry is not None and time.time() - entry["load_time"] <= ChatbotCache.ttl:
+            ChatbotCache.stats["hits"] += 1
+            return Chatbot.from_dynamodb_item(
+                copy.deepcopy(entry["chatbot_content"])
+            )
+
+        chatbot_response = self.chatbot_table.get_item(
+            Key={"groupName": group_name, "chatbotId": chatbot_id}
+        )
+        chatbot_content = chatbot_response.get("Item")
+        if not chatbot_content:
+            ChatbotCache.invalidate(group_name, chatbot_id)
+            return Chatbot.from_dynamodb_item({})
+
+        version = chatbot_content.get("updateTime")
+        if entry is not None and version is not None and entry["version"] == version:
+            ChatbotCache.stats["revalidations"] += 1
+            ChatbotCache.touch(key)
+            resolved_content = entry["chatbot_content"]
+        else:
+            ChatbotCache.stats["misses"] += 1
+            resolved_content = self._resolve_chatbot(group_name, chatbot_content)
+            ChatbotCache.put(key, version, resolved_content)
+
+        chatbot = Chatbot.from_dynamodb_item(copy.deepcopy(resolved_content))
 
         return chatbot
@@ -1,7 +1,14 @@
+import atexit
 import json
 import math
-from datetime import datetime
-from typing import List
+import os
+import threading
+import time
+import traceback
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+from typing import List, Union
 
 import boto3
 from botocore.exceptions import ClientError
@@ -13,6 +20,142 @@ from shared.constant import MessageType, IndexType, INDEX_DESC
 client = boto3.resource("dynamodb")
 
 
+class SessionHistoryCache:
+    """
+    Per-container cache of the latest messages of each session.
+
+    Entries hold raw message items in chronological order and are appended
+    to by `add_message`, so the next turn of a session served by the same
+    warm container needs no read. `complete` marks entries which hold the
+    whole session. A session may be served by another container in between,
+    so entries expire after SESSION_HISTORY_CACHE_TTL seconds.
+    """
+
+    lock = threading.Lock()
+    ttl = int(os.environ.get("SESSION_HISTORY_CACHE_TTL", 300))
+    max_sessions = int(os.environ.get("SESSION_HISTORY_CACHE_MAX_SESSIONS", 1000))
+    max_messages = int(os.environ.get("SESSION_HISTORY_CACHE_MAX_MESSAGES", 100))
+    entries = OrderedDict()
+    stats = {"hits": 0, "misses": 0}
+
+    @classmethod
+    def get(cls, key: tuple, limit: int) -> Union[List[dict], None]:
+        with cls.lock:
+            entry = cls.entries.get(key)
+            if entry is not None and time.time() - entry["load_time"] > cls.ttl:
+                cls.entries.pop(key)
+                entry = None
+            if entry is None or (
+                len(entry["items"]) < limit and not entry["complete"]
+            ):
+                cls.stats["misses"] += 1
+                return None
+            cls.entries.move_to_end(key)
+            cls.stats["hits"] += 1
+            return entry["items"][-limit:] if limit > 0 else []
+
+    @classmethod
+    def put(cls, key: tuple, items: List[dict], complete: bool):
+        with cls.lock:
+            cls.entries[key] = {
+                "items": list(items),
+                "complete": complete,
+                "load_time": time.time(),
+            }
+            cls._trim(key)
+
+    @classmethod
+    def append(cls, key: tuple, item: dict):
+        """Append a new message to the session, if the session is cached"""
+        with cls.lock:
+            entry = cls.entries.get(key)
+            if entry is None:
+                return
+            entry["items"].append(item)
+            cls._trim(key)
+
+    @classmethod
+    def _trim(cls, key: tuple):
+        entry = cls.entries[key]
+        if len(entry["items"]) > cls.max_messages:
+            entry["items"] = entry["items"][-cls.max_messages:]
+            entry["complete"] = False
+        cls.entries.move_to_end(key)
+        while len(cls.entries) > cls.max_sessions:
+            cls.entries.popitem(last=False)
+
+    @classmethod
+    def invalidate(cls, key: tuple):
+        with cls.lock:
+            cls.entries.pop(key, None)
+
+    @classmethod
+    def clear(cls):
+        with cls.lock:
+            cls.entries.clear()
+
+
+class ChatHistoryWriter:
+    """
+    Write-behind writer of chat history.
+
+    Writes run on a single background thread, so the response frames are
+    sent without waiting on DynamoDB. `flush` must be called before the
+    handler returns since the container may be frozen afterwards; pending
+    writes are also flushed when the process exits.
+    """
+
+    lock = threading.Lock()
+    executor = None
+    pending = []
+
+    @classmethod
+    def submit(cls, fn, *args, **kwargs):
+        with cls.lock:
+            if cls.executor is None:
+                cls.executor = ThreadPoolExecutor(
+                    max_workers=1, thread_name_prefix="chat-history-writer"
+                )
+            cls.pending.append(cls.executor.submit(fn, *args, **kwargs))
+
+    @classmethod
+    def flush(cls):
+        """Wait for all pending writes"""
+        with cls.lock:
+            pending = cls.pending
+            cls.pending = []
+        for future in pending:
+            try:
+                future.result()
+            except Exception:
+                print(f"Error writing chat history: {traceback.format_exc()}")
+
+
+atexit.register(ChatHistoryWriter.flush)
+
+
+def message_item_to_langchain(item: dict) -> dict:
+    assert item["role"] in [
+        MessageType.AI_MESSAGE_TYPE,
+        MessageType.HUMAN_MESSAGE_TYPE,
+    ]
+    additional_kwargs = item["additional_kwargs"]
+    # additional_kwargs are decoded only for the messages actually returned
+    if isinstance(additional_kwargs, str):
+        additional_kwargs = json.loads(additional_kwargs)
+    return {
+        "role": item["role"],
+        "content": item["content"],
+        "additional_kwargs": {
+            "message_id": item["messageId"],
+            "create_time": item["createTimestamp"],
+            "entry_type": item["entryType"],
+            "custom_message_id": item["customMessageId"],
+            **additional_kwargs,
+        },
+    }
+
+
 class DynamoDBChatMessageHistory(BaseChatMessageHistory):
     def __init__(
         self,
@@ -32,6 +175,10 @@ class DynamoDBChatMessageHistory(BaseChatMessageHistory):
         self.group_name = group_name
         self.chatbot_id = chatbot_id
         self.MESSAGE_BY_SESSION_ID_INDEX_NAME = "bySessionId"
+        self.MESSAGE_BY_SESSION_ID_TIMESTAMP_INDEX_NAME = os.environ.get(
+            "MESSAGES_BY_SESSION_ID_TIMESTAMP_INDEX_NAME", "bySessionIdTimestamp"
+        )
+        self.cache_key = (messages_table_name, session_id)
 
     @property
     def session(self):
@@ -41,65 +188,105 @@ class DynamoDBChatMessageHistory(BaseChatMessageHistory):
         item = response.get("Item")
         return item
 
-    @property
-    def messages(self):
-        """Retrieve the messages from DynamoDB"""
-        response = {}
+    def _print_query_error(self, error: ClientError):
+        if error.response["Error"]["Code"] == "ResourceNotFoundException":
+            print("No record found for session id: %s", self.session_id)
+        else:
+            print(error)
+
+    def _query_all_items(self) -> List[dict]:
+        """
+        Query all messages of the session, following pagination. Raise
+        ClientError if any page fails.
+        """
+        items = []
+        query_kwargs = {
+            "KeyConditionExpression": "sessionId = :session_id",
+            "ExpressionAttributeValues": {":session_id": self.session_id},
+            "IndexName": self.MESSAGE_BY_SESSION_ID_INDEX_NAME,
+        }
+        while True:
+            response = self.messages_table.query(**query_kwargs)
+            items.extend(response.get("Items", []))
+            if "LastEvaluatedKey" not in response:
+                break
+            query_kwargs["ExclusiveStartKey"] = response["LastEvaluatedKey"]
+        return sorted(items, key=lambda x: x["createTimestamp"])
+
+    def _query_recent_items(self, limit: int) -> Union[List[dict], None]:
+        """
+        Query the latest `limit` messages of the session in descending
+        createTimestamp order. Return None if the index is not available,
+        raise ClientError on any other failure.
+        """
+        items = []
+        query_kwargs = {
+            "KeyConditionExpression": "sessionId = :session_id",
+            "ExpressionAttributeValues": {":session_id": self.session_id},
+            "IndexName": self.MESSAGE_BY_SESSION_ID_TIMESTAMP_INDEX_NAME,
+            "ScanIndexForward": False,
+        }
         try:
-            response = self.messages_table.query(
-                KeyConditionExpression="sessionId = :session_id",
-                ExpressionAttributeValues={":session_id": self.session_id},
-                IndexName=self.MESSAGE_BY_SESSION_ID_INDEX_NAME,
-            )
+            while len(items) < limit:
+                query_kwargs["Limit"] = limit - len(items)
+                response = self.messages_table.query(**query_kwargs)
+                items.extend(response.get("Items", []))
+                if "LastEvaluatedKey" not in response:
+                    break
+                query_kwargs["ExclusiveStartKey"] = response["LastEvaluatedKey"]
         except ClientError as error:
-            if error.response["Error"]["Code"] == "ResourceNotFoundException":
-                print("No record found for session id: %s", self.session_id)
-            else:
+            if error.response["Error"]["Code"] == "ValidationException":
+                # the index has not been deployed yet
                 print(error)
+                return None
+            raise
+        return items[::-1]
 
-        items = response.get("Items", [])
-        items = sorted(items, key=lambda x: x["createTimestamp"])
+    def get_recent_messages(self, max_rounds: int) -> List[dict]:
+        """
+        Retrieve the latest `max_rounds` rounds of messages from DynamoDB,
+        in chronological order. Only the results of queries which finished
+        without errors are cached.
+        """
+        limit = max(2 * max_rounds, 0)
+        items = SessionHistoryCache.get(self.cache_key, limit)
+        if items is not None:
+            return items
+        if limit == 0:
+            return []
 
+        try:
+            items = self._query_recent_items(limit)
+            if items is None:
+                items = self._query_all_items()
+                SessionHistoryCache.put(self.cache_key, items, complete=True)
+                return items[-limit:]
+        except ClientError as error:
+            self._print_query_error(error)
+            return []
+        SessionHistoryCache.put(
+            self.cache_key, items, complete=len(items) < limit
+        )
         return items
 
+    def get_recent_messages_as_langchain(self, max_rounds: int) -> List[dict]:
+        return [
+            message_item_to_langchain(item)
+            for item in self.get_recent_messages(max_rounds)
+        ]
+
     @property
-    def messages_as_langchain(self):
-        response = {}
+    def messages(self):
+        """Retrieve the messages from DynamoDB"""
         try:
-            response = self.messages_table.query(
-                KeyConditionExpression="sessionId = :session_id",
-                ExpressionAttributeValues={":session_id": self.session_id},
-                IndexName=self.MESSAGE_BY_SESSION_ID_INDEX_NAME,
-            )
+            return self._query_all_items()
         except ClientError as error:
-            if error.response["Error"]["Code"] == "ResourceNotFoundException":
-                print("No record found for session id: %s", self.session_id)
-            else:
-                print(error)
-        items = response.get("Items", [])
-        items = sorted(items, key=lambda x: x["createTimestamp"])
-        ret = []
+            self._print_query_error(error)
+            return []
 
-        for item in items:
-            assert item["role"] in [
-                MessageType.AI_MESSAGE_TYPE,
-                MessageType.HUMAN_MESSAGE_TYPE,
-            ]
-            role = item["role"]
-            additional_kwargs = json.loads(item["additional_kwargs"])
-            langchain_message_template = {
-                "role": role,
-                "content": item["content"],
-                "additional_kwargs": {
-                    "message_id": item["messageId"],
-                    "create_time": item["createTimestamp"],
-                    "entry_type": item["entryType"],
-                    "custom_message_id": item["customMessageId"],
-                    **additional_kwargs,
-                },
-            }
-            ret.append(langchain_message_template)
-        return ret
+    @property
+    def messages_as_langchain(self):
+        return [message_item_to_langchain(item) for item in self.messages]
 
     def update_session(self, latest_question=""):
         """Add the session to the record in DynamoDB"""
@@ -136,6 +323,61 @@ class DynamoDBChatMessageHistory(BaseChatMessageHistory):
                 }
             )
 
+    def _build_message_item(
+        self,
+        message_id,
+        message_type,
+        custom_message_id,
+        entry_type,
+        message_content,
+        input_message_id="",
+        additional_kwargs=None,
+        current_timestamp=None,
+    ) -> dict:
+        current_timestamp = current_timestamp or datetime.utcnow().isoformat() + "Z"
+        additional_kwargs = additional_kwargs or {}
+        return {
+            "messageId": message_id,
+            "sessionId": self.session_id,
+            "chatbotId": self.chatbot_id,
+            "role": message_type,
+            "customMessageId": custom_message_id,
+            "inputMessageId": input_message_id,
+            "entryType": entry_type,
+            "content": message_content,
+            "createTimestamp": current_timestamp,
+            "lastModifiedTimestamp": current_timestamp,
+            "additional_kwargs": json.dumps(additional_kwargs),
+        }
+
+    def upsert_session(self, latest_question="", current_timestamp=None):
+        """Create or update the session record in one request"""
+        current_timestamp = current_timestamp or datetime.utcnow().isoformat() + "Z"
+        update_expression = (
+            "SET lastModifiedTimestamp = :t"
+            ", chatbotId = if_not_exists(chatbotId, :c)"
+            ", clientType = if_not_exists(clientType, :ct)"
+            ", startTime = if_not_exists(startTime, :t)"
+            ", createTimestamp = if_not_exists(createTimestamp, :t)"
+        )
+        expression_attribute_values = {
+            ":t": current_timestamp,
+            ":c": self.chatbot_id,
+            ":ct": self.client_type,
+        }
+        if latest_question:
+            update_expression += ", latestQuestion = :q"
+            expression_attribute_values[":q"] = latest_question
+        else:
+            update_expression += ", latestQuestion = if_not_exists(latestQuestion, :q)"
+            expression_attribute_values[":q"] = ""
+
+        self.sessions_table.update_item(
+            Key={"sessionId": self.session_id, "userId": self.user_id},
+            UpdateExpression=update_expression,
+            ExpressionAttributeValues=expression_attribute_values,
+        )
+
     def add_message(
         self,
         message_id,
@@ -147,27 +389,81 @@ class DynamoDBChatMessageHistory(BaseChatMessageHistory):
         additional_kwargs=None,
     ) -> None:
         """Append the message to the record in DynamoDB"""
-        current_timestamp = datetime.utcnow().isoformat() + "Z"
-        additional_kwargs = additional_kwargs or {}
+        item = self._build_message_item(
+            message_id,
+            message_type,
+            custom_message_id,
+            entry_type,
+            message_content,
+            input_message_id,
+            additional_kwargs,
+        )
 
         try:
-            self.messages_table.put_item(
-                Item={
-                    "messageId": message_id,
-                    "sessionId": self.session_id,
-                    "chatbotId": self.chatbot_id,
-                    "role": message_type,
-                    "customMessageId": custom_message_id,
-                    "inputMessageId": input_message_id,
-                    "entryType": entry_type,
-                    "content": message_content,
-                    "createTimestamp": current_timestamp,
-                    "lastModifiedTimestamp": current_timestamp,
-                    "additional_kwargs": json.dumps(additional_kwargs),
-                }
-            )
+            self.messages_table.put_item(Item=item)
         except ClientError as err:
             print(f"Error adding message: {err}")
+            return
+        SessionHistoryCache.append(self.cache_key, item)
+
+    def add_chat_round(
+        self,
+        message_id,
+        custom_message_id,
+        entry_type,
+        query,
+        answer,
+        additional_kwargs=None,
+    ) -> None:
+        """
+        Append the user and ai messages of one round with a single
+        BatchWriteItem, and upsert the session with a single update_item
+        """
+        now = datetime.utcnow()
+        # keep the ai message strictly after the user message
+        user_timestamp = now.isoformat(timespec="microseconds") + "Z"
+        ai_timestamp = (now + timedelta(microseconds=1)).isoformat(
+            timespec="microseconds"
+        ) + "Z"
+        items = [
+            self._build_message_item(
+                f"user_{message_id}",
+                MessageType.HUMAN_MESSAGE_TYPE,
+                custom_message_id,
+                entry_type,
+                query,
+                additional_kwargs=additional_kwargs,
+                current_timestamp=user_timestamp,
+            ),
+            self._build_message_item(
+                f"ai_{message_id}",
+                MessageType.AI_MESSAGE_TYPE,
+                custom_message_id,
+                entry_type,
+                answer,
+                input_message_id=f"user_{message_id}",
+                additional_kwargs=additional_kwargs,
+                current_timestamp=ai_timestamp,
+            ),
+        ]
+
+        try:
+            # batch_writer retries unprocessed items
+            with self.messages_table.batch_writer() as batch:
+                for item in items:
+                    batch.put_item(Item=item)
+        except ClientError as err:
+            print(f"Error adding messages: {err}")
+        else:
+            for item in items:
+                SessionHistoryCache.append(self.cache_key, item)
+
+        try:
+            self.upsert_session(
+                latest_question=query, current_timestamp=ai_timestamp
+            )
+        except ClientError as err:
+            print(f"Error updating session: {err}")
 
     def add_user_message(
         self,
@@ -211,6 +507,7 @@ class DynamoDBChatMessageHistory(BaseChatMessageHistory):
 
     def clear(self) -> None:
         """Clear session memory from DynamoDB"""
+        SessionHistoryCache.invalidate(self.cache_key)
         try:
             self.messages_table.delete_item(
                 Key={"sessionId": self.session_id,
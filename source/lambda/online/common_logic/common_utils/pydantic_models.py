@@ -177,6 +177,9 @@ class ChatbotConfig(AllowBaseModel):
     chatbot_mode: ChatbotMode = ChatbotMode.chat
     use_history: bool = True
     enable_trace: bool = True
+    # run qq match, intention and knowledge retrieval concurrently and
+    # reuse the prefetched knowledge in the rag tool
+    enable_parallel_retrieval: bool = False
     scene: SceneType = SceneType.COMMON
     agent_repeated_call_limit: int = 5
     query_process_config: QueryProcessConfig = Field(
@@ -2,11 +2,14 @@ import json
 import time
 import traceback
 
-from common_logic.common_utils.ddb_utils import DynamoDBChatMessageHistory
+from common_logic.common_utils.ddb_utils import (
+    ChatHistoryWriter,
+    DynamoDBChatMessageHistory,
+)
 from shared.constant import StreamMessageType
 from shared.utils.logger_utils import get_logger
 from shared.utils.websocket_utils import (
-    check_stop_signal,
+    WebSocketChunkSender,
     clear_stop_signal,
     send_to_ws_client,
 )
@@ -27,20 +30,15 @@ def write_chat_history_to_ddb(
     entry_type,
     additional_kwargs=None,
 ):
-    ddb_obj.add_user_message(
-        f"user_{message_id}",
+    # written in the background, flushed before the lambda handler returns
+    ChatHistoryWriter.submit(
+        ddb_obj.add_chat_round,
+        message_id,
         custom_message_id,
         entry_type,
         query,
-        additional_kwargs,
-    )
-    ddb_obj.add_ai_message(
-        f"ai_{message_id}",
-        custom_message_id,
-        entry_type,
         answer,
-        input_message_id=f"user_{message_id}",
-        additional_kwargs=additional_kwargs,
+        additional_kwargs,
     )
 
 
@@ -94,44 +92,55 @@ def stream_response(event_body: dict, response: dict):
             ws_connection_id=ws_connection_id,
         )
 
-        for i, chunk in enumerate(answer):
-            # Check for stop signal before sending each chunk
-            if check_stop_signal(ws_connection_id):
-                logger.info(
-                    f"Stop signal detected for connection {ws_connection_id}"
-                )
-                # Send END message to notify frontend and stop the session
-                send_to_ws_client(
-                    {
-                        "message_type": StreamMessageType.END,
-                        "message_id": f"ai_{message_id}",
-                        "custom_message_id": custom_message_id,
-                    },
-                    ws_connection_id=ws_connection_id,
-                )
-                clear_stop_signal(ws_connection_id)
-                return answer_str
+        # chunks are coalesced into frames and posted by a background thread
+        chunk_sender = WebSocketChunkSender(
+            ws_connection_id=ws_connection_id,
+            message_id=f"ai_{message_id}",
+            custom_message_id=custom_message_id,
+            message_type=StreamMessageType.CHUNK,
+        )
 
-            if i == 0 and log_first_token_time:
-                first_token_time = time.time()
-                logger.info(
-                    f"{custom_message_id} running time of first token whole {entry_type} entry: {first_token_time-request_timestamp}s"
+        def close_chunk_sender():
+            # a failure to send the last chunks must neither replace an
+            # exception raised by the answer stream nor prevent the END message
+            try:
+                chunk_sender.close()
+            except Exception:
+                logger.error(
+                    f"Failed to send chunks to {ws_connection_id}:\n{traceback.format_exc()}"
                 )
 
-            send_to_ws_client(
-                message={
-                    "message_type": StreamMessageType.CHUNK,
-                    "message_id": f"ai_{message_id}",
-                    "custom_message_id": custom_message_id,
-                    "message": {
-                        "role": "assistant",
-                        "content": chunk,
-                    },
-                    "chunk_id": i,
-                },
-                ws_connection_id=ws_connection_id,
-            )
-            answer_str += chunk
+        try:
+            for i, chunk in enumerate(answer):
+                # Check for stop signal, read from ddb on a fixed interval
+                if chunk_sender.is_stopped():
+                    logger.info(
+                        f"Stop signal detected for connection {ws_connection_id}"
+                    )
+                    close_chunk_sender()
+                    # Send END message to notify frontend and stop the session
+                    send_to_ws_client(
+                        {
+                            "message_type": StreamMessageType.END,
+                            "message_id": f"ai_{message_id}",
+                            "custom_message_id": custom_message_id,
+                        },
+                        ws_connection_id=ws_connection_id,
+                    )
+                    clear_stop_signal(ws_connection_id)
+                    return answer_str
+
+                if i == 0 and log_first_token_time:
+                    first_token_time = time.time()
+                    logger.info(
+                        f"{custom_message_id} running time of first token whole {entry_type} entry: {first_token_time-request_timestamp}s"
+                    )
+
+                chunk_sender.add_chunk(chunk)
+                answer_str += chunk
+        finally:
+            # flush remaining frames before CONTEXT/END messages
+            close_chunk_sender()
 
         # if isinstance(answer, ReasonModelStreamResult):
         #     for i, chunk in enumerate(answer.think_stream):
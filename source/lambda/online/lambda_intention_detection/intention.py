@@ -18,6 +18,22 @@ intelli_agent_kb_enabled = kb_type.get(
 def get_intention_results(query: str, intention_config: dict, intent_threshold: float):
     """get intention few shots results according embedding similarity
 
+    Args:
+        query (str): input query from human
+        intention_config (dict): intention config information
+
+    Returns:
+        intent_fewshot_examples (dict): retrieved few shot examples
+    """
+    return asyncio.run(
+        aget_intention_results(query, intention_config, intent_threshold)
+    )
+
+
+async def aget_intention_results(query: str, intention_config: dict, intent_threshold: float):
+    """async version of get_intention_results, so that it can run together
+    with other retrievals on one event loop
+
     Args:
         query (str): input query from human
         intention_config (dict): intention config information
@@ -45,7 +61,7 @@ def get_intention_results(query: str, intention_config: dict, intent_threshold:
         **retriver_config
     ) for retriver_config in intention_config['retrievers']
     ])
-    intention_retrievered:List[Document] = asyncio.run(intention_retriever.ainvoke(event_body['query']))
+    intention_retrievered:List[Document] = await intention_retriever.ainvoke(event_body['query'])
     # res = retrieve_fn(event_body)
 
     if not intention_retrievered:
@@ -6,7 +6,7 @@ from datetime import datetime, timezone
 import boto3
 from botocore.exceptions import ClientError
 from shared.constant import EntryType, ParamType, Threshold,WSConnectionSignal
-from common_logic.common_utils.ddb_utils import DynamoDBChatMessageHistory
+from common_logic.common_utils.ddb_utils import ChatHistoryWriter, DynamoDBChatMessageHistory
 from shared.utils.lambda_invoke_utils import (
     chatbot_lambda_call_wrapper,
     is_running_local,
@@ -68,6 +68,14 @@ def create_ddb_history_obj(session_id: str, user_id: str, client_type: str, grou
     )
 
 
+def get_max_rounds_in_memory(chatbot_config: dict) -> int:
+    """Number of history rounds to load for the chatbot config"""
+    try:
+        return int(chatbot_config.get("max_rounds_in_memory"))
+    except (TypeError, ValueError):
+        return Threshold.MAX_DIAG_ROUNDS_IN_MEMORY
+
+
 def compose_connect_body(event_body: dict, context: dict):
     """
     Compose the body for the Amazon Connect API request based on the event and context.
@@ -122,7 +130,9 @@ def compose_connect_body(event_body: dict, context: dict):
         group_name=group_name,
         chatbot_id=chatbot_id
     )
-    chat_history = ddb_history_obj.messages_as_langchain
+    chat_history = ddb_history_obj.get_recent_messages_as_langchain(
+        Threshold.MAX_DIAG_ROUNDS_IN_MEMORY
+    )
 
     agent_flow_body = {}
     agent_flow_body["query"] = query
@@ -254,7 +264,9 @@ def restapi_event_handler(event_body: dict, context: dict, entry_executor):
 
     ddb_history_obj = create_ddb_history_obj(
         assembled_body["session_id"], assembled_body["user_id"], assembled_body["client_type"], assembled_body["group_name"], assembled_body["chatbot_id"])
-    chat_history = ddb_history_obj.messages_as_langchain
+    chat_history = ddb_history_obj.get_recent_messages_as_langchain(
+        get_max_rounds_in_memory(event_body.get("chatbot_config", {}))
+    )
 
     standard_event_body = {
         "query": event_body["query"],
@@ -308,7 +320,9 @@ def default_event_handler(event_body: dict, context: dict, entry_executor):
 
     ddb_history_obj = create_ddb_history_obj(
         assembled_body["session_id"], assembled_body["user_id"], assembled_body["client_type"], assembled_body["group_name"], assembled_body["chatbot_id"])
-    chat_history = ddb_history_obj.messages_as_langchain
+    chat_history = ddb_history_obj.get_recent_messages_as_langchain(
+        get_max_rounds_in_memory(event_body.get("chatbot_config", {}))
+    )
 
     event_body["stream"] = context["stream"]
     event_body["chat_history"] = chat_history
@@ -373,6 +387,10 @@ def lambda_handler(event_body: dict, context: dict):
         clear_stop_signal(context["ws_connection_id"])
         logger.error(f"{traceback.format_exc()}\nAn error occurred: {error_info}")
         return {"error": error_info}
+    finally:
+        # chat history is written behind the response, make sure it is
+        # persisted before the container can be frozen
+        ChatHistoryWriter.flush()
 
 
 def __convert_flat_param_to_dict(event_body: dict):
@@ -12,7 +12,10 @@ from common_logic.common_utils.response_utils import (
     process_response,
 )
 from common_logic.common_utils.serialization_utils import JSONEncoder
-from lambda_intention_detection.intention import get_intention_results
+from lambda_intention_detection.intention import (
+    aget_intention_results,
+    get_intention_results,
+)
 from lambda_main.main_utils.parse_config import CommonConfigParser
 from lambda_query_preprocess.query_preprocess import conversation_query_rewrite
 from langchain.retrievers.merger_retriever import MergerRetriever
@@ -31,6 +34,11 @@ from shared.langchain_integration.chains import LLMChain
 from shared.langchain_integration.retrievers import (
     OpensearchHybridQueryDocumentRetriever,
     OpensearchHybridQueryQuestionRetriever,
+    aprefetch_documents,
+    get_doc_expansion_cache,
+    get_prefetched_documents,
+    start_doc_expansion_cache,
+    start_embedding_service,
 )
 from shared.langchain_integration.tools import ToolManager
 from shared.utils.lambda_invoke_utils import (
@@ -93,6 +101,9 @@ class ChatbotState(TypedDict):
     # tools of retrieved intention samples in search engine, e.g. OpenSearch
     intent_fewshot_tools: list
     all_knowledge_retrieved_list: list
+    # knowledge retrieved speculatively when enable_parallel_retrieval is set,
+    # reused by the rag tool
+    prefetched_knowledge: dict
 
     ########### retriever states ###########
     # contexts information retrieved in search engine, e.g. OpenSearch
@@ -161,6 +172,54 @@ def query_preprocess(state: ChatbotState):
     return {"query_rewrite": output}
 
 
+async def aparallel_retrieve(
+    state: ChatbotState,
+    qq_retriever: MergerRetriever,
+    qd_retrievers: List[OpensearchHybridQueryDocumentRetriever],
+):
+    """
+    Run qq match, intention few-shot and all knowledge retrieval together
+    on one event loop.
+    """
+    intention_config = state["chatbot_config"].get("intention_config", {})
+    query_key = intention_config.get("retriever_config", {}).get(
+        "query_key", "query"
+    )
+    qq_task = asyncio.create_task(qq_retriever.ainvoke(state["query"]))
+    intention_task = None
+    if not state["chatbot_config"]["agent_config"]["only_use_rag_tool"]:
+        intention_task = asyncio.create_task(
+            aget_intention_results(
+                state[query_key],
+                {
+                    **intention_config,
+                },
+                intent_threshold=intention_config["intent_threshold"],
+            )
+        )
+    prefetch_task = asyncio.create_task(
+        aprefetch_documents(qd_retrievers, state["query"])
+    )
+    try:
+        qq_retrievered = await qq_task
+        intention_results = None
+        if intention_task is not None:
+            intention_results = await intention_task
+        try:
+            prefetched_knowledge = await prefetch_task
+        except Exception:
+            # the knowledge is retrieved again by the normal path
+            logger.warning(
+                f"Knowledge prefetch failed:\n{traceback.format_exc()}"
+            )
+            prefetched_knowledge = None
+    finally:
+        for task in (qq_task, intention_task, prefetch_task):
+            if task is not None:
+                task.cancel()
+    return qq_retrievered, intention_results, prefetched_knowledge
+
+
 @node_monitor_wrapper
 def intention_detection(state: ChatbotState):
     qq_match_config = state["chatbot_config"]["qq_match_config"]
@@ -177,9 +236,25 @@ def intention_detection(state: ChatbotState):
     # qq_retriever = OpensearchHybridQueryQuestionRetriever.from_config(
     #     **retriever_params
     # )
-    qq_retrievered: List[Document] = asyncio.run(
-        qq_retriever.ainvoke(state["query"])
-    )
+    private_knowledge_config = state["chatbot_config"][
+        "private_knowledge_config"
+    ]
+    prefetched_knowledge = None
+    intention_results = None
+    if state["chatbot_config"].get("enable_parallel_retrieval", False):
+        qd_retrievers = [
+            OpensearchHybridQueryDocumentRetriever.from_config(
+                **retriver_config
+            )
+            for retriver_config in private_knowledge_config["retrievers"]
+        ]
+        qq_retrievered, intention_results, prefetched_knowledge = asyncio.run(
+            aparallel_retrieve(state, qq_retriever, qd_retrievers)
+        )
+    else:
+        qq_retrievered: List[Document] = asyncio.run(
+            qq_retriever.ainvoke(state["query"])
+        )
 
     # output = retrieve_fn(retriever_params)
     # context_list = []
@@ -245,6 +320,7 @@ def intention_detection(state: ChatbotState):
         return {
             "qq_match_results": qq_match_results,
             "intent_type": "intention detected",
+            "prefetched_knowledge": prefetched_knowledge,
         }
 
     # get intention results from aos
@@ -257,13 +333,16 @@ def intention_detection(state: ChatbotState):
     all_knowledge_in_agent_threshold = intention_config[
         "all_knowledge_in_agent_threshold"
     ]
-    intent_fewshot_examples, intention_ready = get_intention_results(
-        query,
-        {
-            **intention_config,
-        },
-        intent_threshold=intent_threshold,
-    )
+    if intention_results is not None:
+        intent_fewshot_examples, intention_ready = intention_results
+    else:
+        intent_fewshot_examples, intention_ready = get_intention_results(
+            query,
+            {
+                **intention_config,
+            },
+            intent_threshold=intent_threshold,
+        )
 
     intent_fewshot_tools: list[str] = list(
         set([e["intent"] for e in intent_fewshot_examples])
@@ -287,24 +366,29 @@ def intention_detection(state: ChatbotState):
         #         "query_key", "query")
         # ]
 
-        private_knowledge_config = state["chatbot_config"][
-            "private_knowledge_config"
-        ]
-
-        qd_retrievers = [
-            OpensearchHybridQueryDocumentRetriever.from_config(
-                **retriver_config
-            )
-            for retriver_config in private_knowledge_config["retrievers"]
-        ]
-
-        qd_retriever = MergerRetriever(retrievers=qd_retrievers)
-        # qd_retriever = OpensearchHybridQueryDocumentRetriever.from_config(
-        #     **retriever_params
-        # )
-        qd_retrievered: List[Document] = asyncio.run(
-            qd_retriever.ainvoke(state["query"])
+        qd_retrievered = get_prefetched_documents(
+            prefetched_knowledge,
+            state["query"],
+            [
+                retriver_config["index_name"]
+                for retriver_config in private_knowledge_config["retrievers"]
+            ],
         )
+        if qd_retrievered is None:
+            qd_retrievers = [
+                OpensearchHybridQueryDocumentRetriever.from_config(
+                    **retriver_config
+                )
+                for retriver_config in private_knowledge_config["retrievers"]
+            ]
+
+            qd_retriever = MergerRetriever(retrievers=qd_retrievers)
+            # qd_retriever = OpensearchHybridQueryDocumentRetriever.from_config(
+            #     **retriever_params
+            # )
+            qd_retrievered: List[Document] = asyncio.run(
+                qd_retriever.ainvoke(state["query"])
+            )
         # output = retrieve_fn(retriever_params)
 
         info_to_log = []
@@ -332,6 +416,14 @@ def intention_detection(state: ChatbotState):
             state["ws_connection_id"],
             state["enable_trace"],
         )
+        doc_expansion_cache = get_doc_expansion_cache()
+        if doc_expansion_cache is not None:
+            send_trace(
+                f"whole doc cache: {doc_expansion_cache.stats}",
+                state["stream"],
+                state["ws_connection_id"],
+                state["enable_trace"],
+            )
     send_trace(
         f"{markdown_table}",
         state["stream"],
@@ -357,6 +449,7 @@ def intention_detection(state: ChatbotState):
         "qq_match_results": qq_match_results,
         # "qq_match_contexts": qq_match_contexts,
         "intent_type": "intention detected",
+        "prefetched_knowledge": prefetched_knowledge,
     }
 
 
@@ -794,6 +887,9 @@ def common_entry(event_body):
     agent_config = event_body["chatbot_config"]["agent_config"]
     # rag_config = event_body["chatbot_config"]["rag_config"]
 
+    # tools registered from the chatbot config are scoped to this request
+    ToolManager.start_request_scope()
+
     # register as rag tool for each aos index
     # print('private_knowledge_config',event_body["chatbot_config"]["private_knowledge_config"])
     registered_tool_names = register_rag_tool_from_config(event_body)
@@ -820,6 +916,11 @@ def common_entry(event_body):
         return_direct=True,
     )
 
+    # dedupe whole doc expansions and query embeddings across all retrievers
+    # of this request
+    start_doc_expansion_cache()
+    embedding_service = start_embedding_service()
+
     # invoke graph and get results
     response = app.invoke(
         {
@@ -836,6 +937,7 @@ def common_entry(event_body):
             "debug_infos": {},
             "extra_response": {},
             "qq_match_results": [],
+            "prefetched_knowledge": None,
             "last_tool_messages": None,
             "all_knowledge_rag_tool": all_knowledge_rag_tool,
             "tools": None,
@@ -843,6 +945,7 @@ def common_entry(event_body):
         },
         config={"recursion_limit": 20},
     )
+    logger.info(f"query embedding stats: {embedding_service.stats}")
     clear_stop_signal(ws_connection_id)
     return response["app_response"]
 
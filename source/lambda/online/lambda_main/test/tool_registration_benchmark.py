@@ -0,0 +1,82 @@
+"""
+Micro-benchmark of per-request custom tool registration.
+
+Compares the uncached path, i.e. code generation of the pydantic model and
+a new StructuredTool for every request, with the cached path used by
+ToolManager.
+
+Run from source/lambda:
+    python online/lambda_main/test/tool_registration_benchmark.py
+"""
+import os
+import sys
+import time
+import types
+
+sys.path.insert(
+    0, os.path.abspath(os.path.join(os.path.dirname(__file__), "../../.."))
+)
+
+from shared.constant import SceneType
+from shared.langchain_integration.tools import (
+    StructuredTool,
+    ToolManager,
+    ToolSchemaCache,
+)
+
+N_REQUESTS = 50
+N_TOOLS = 5
+
+
+def get_tool_def(i: int):
+    return {
+        "description": f"query the status of order type {i}",
+        "properties": {
+            "order_id": {"type": "string", "description": "order id"},
+            "limit": {"type": "integer", "description": "max records"},
+            "detail": {"type": "boolean", "description": "with detail"},
+        },
+        "required": ["order_id"],
+    }
+
+
+def convert_uncached(tool_id: str, tool_def: dict):
+    """The conversion without the schema cache"""
+    new_tool_module = types.ModuleType(tool_id)
+    exec(ToolManager.generate_pydantic_source(tool_def), new_tool_module.__dict__)
+    return new_tool_module.Model
+
+
+def register_uncached():
+    for i in range(N_TOOLS):
+        StructuredTool.from_function(
+            func=lambda **kwargs: kwargs,
+            name=f"bench_tool_{i}",
+            args_schema=convert_uncached(f"bench_tool_{i}", get_tool_def(i)),
+        )
+
+
+def register_cached():
+    for i in range(N_TOOLS):
+        ToolManager.register_aws_lambda_as_tool(
+            lambda_name="bench_lambda",
+            tool_def=get_tool_def(i),
+            name=f"bench_tool_{i}",
+            scene=SceneType.COMMON,
+        )
+
+
+def bench(fn) -> float:
+    start = time.perf_counter()
+    for _ in range(N_REQUESTS):
+        fn()
+    return (time.perf_counter() - start) / N_REQUESTS * 1000
+
+
+if __name__ == "__main__":
+    before = bench(register_uncached)
+    after = bench(register_cached)
+    print(f"{N_TOOLS} tools per request, {N_REQUESTS} requests")
+    print(f"uncached registration: {before:.2f} ms/request")
+    print(f"cached registration:   {after:.2f} ms/request")
+    print(f"schema cache stats: {ToolSchemaCache.stats}")
@@ -1,4 +1,18 @@
 from .opensearch_retrievers import (
     OpensearchHybridQueryDocumentRetriever,
     OpensearchHybridQueryQuestionRetriever
+)
+from .doc_expansion_cache import (
+    DocExpansionLRU,
+    get_doc_expansion_cache,
+    start_doc_expansion_cache
+)
+from .embedding_service import (
+    get_embedding_service,
+    start_embedding_service
+)
+from .prefetch_utils import (
+    aprefetch_documents,
+    get_prefetched_documents,
+    merge_retrieved_documents
 )
\ No newline at end of file
@@ -1,5 +1,5 @@
-
 from .opensearch import (
     OpenSearchBM25Search,
+    OpenSearchConnectionPool,
     OpenSearchHybridSearch
 )
\ No newline at end of file
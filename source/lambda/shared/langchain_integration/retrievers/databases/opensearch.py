@@ -1,6 +1,9 @@
+import asyncio
 import hashlib
 import json
 import os
+import threading
+import time
 import traceback
 import uuid
 from typing import Any, Iterable, List, Optional, Tuple, Union
@@ -18,6 +21,7 @@ from shared.utils.logger_utils import get_logger
 
 aosEndpoint = os.environ.get("AOS_ENDPOINT")
 aos_secret = os.environ.get("AOS_SECRET_NAME", "opensearch-master-user")
+aos_credential_ttl = int(os.environ.get("AOS_CREDENTIAL_TTL", 900))
 region = os.environ["AWS_REGION"]
 logger = get_logger(__name__)
 
@@ -48,6 +52,166 @@ def get_client_kwargs():
     return {}
 
 
+class OpenSearchConnectionPool:
+    """
+    Process-wide registry of OpenSearch clients shared by all retrievers.
+
+    Clients are keyed by (opensearch_url, auth_mode). Credentials from
+    Secrets Manager are cached for `aos_credential_ttl` seconds, and indexes
+    which have already been checked/created are remembered, so a warm
+    container does not pay any setup round trip before its first search.
+    Async clients are bound to the event loop they run in, hence they are
+    cached per running loop and closed when the loop shuts down.
+    """
+
+    lock = threading.RLock()
+    credential_ttl = aos_credential_ttl
+    credentials = {}
+    clients = {}
+    async_clients = {}
+    known_indexes = set()
+    stats = {
+        "credential_hit": 0,
+        "credential_miss": 0,
+        "client_hit": 0,
+        "client_miss": 0,
+        "async_client_hit": 0,
+        "async_client_miss": 0,
+        "index_hit": 0,
+        "index_miss": 0,
+    }
+
+    @staticmethod
+    def get_auth_mode(client_kwargs: dict) -> str:
+        return "basic" if client_kwargs.get("http_auth") else "iam"
+
+    @classmethod
+    def _record(cls, name: str, hit: bool):
+        cls.stats[f"{name}_{'hit' if hit else 'miss'}"] += 1
+
+    @classmethod
+    def get_client_kwargs(cls, secret_name: str = None) -> dict:
+        secret_name = secret_name or aos_secret
+        with cls.lock:
+            cached = cls.credentials.get(secret_name)
+            if cached is not None and cached[1] > time.time():
+                cls._record("credential", True)
+                return cached[0]
+            cls._record("credential", False)
+            client_kwargs = get_client_kwargs()
+            cls.credentials[secret_name] = (
+                client_kwargs,
+                time.time() + cls.credential_ttl,
+            )
+            return client_kwargs
+
+    @classmethod
+    def get_client(cls, opensearch_url: str, client_kwargs: dict):
+        key = (opensearch_url, cls.get_auth_mode(client_kwargs))
+        with cls.lock:
+            cached = cls.clients.get(key)
+            # rebuild the client when the credential has been rotated
+            if cached is not None and cached[1] == client_kwargs:
+                cls._record("client", True)
+                return cached[0]
+            cls._record("client", False)
+            client = _get_opensearch_client(opensearch_url, **client_kwargs)
+            cls.clients[key] = (client, client_kwargs)
+            return client
+
+    @classmethod
+    def get_async_client(cls, opensearch_url: str, client_kwargs: dict):
+        key = (opensearch_url, cls.get_auth_mode(client_kwargs))
+        try:
+            loop = asyncio.get_running_loop()
+        except RuntimeError:
+            loop = None
+        with cls.lock:
+            loop_clients = (
+                cls._get_loop_clients(loop) if loop is not None else None
+            )
+            cached = (
+                loop_clients["clients"].get(key) if loop_clients is not None else None
+            )
+            if cached is not None and cached[1] == client_kwargs:
+                cls._record("async_client", True)
+                return cached[0]
+            cls._record("async_client", False)
+            async_client = _get_async_opensearch_client(
+                opensearch_url, **client_kwargs
+            )
+            if loop_clients is not None:
+                if cached is not None:
+                    loop_clients["retired"].append(cached[0])
+                loop_clients["clients"][key] = (async_client, client_kwargs)
+            return async_client
+
+    @classmethod
+    def _get_loop_clients(cls, loop) -> dict:
+        """
+        The async clients of a running loop. They are closed and dropped when
+        the loop shuts down its async generators, which asyncio.run does
+        before closing the loop, so every asyncio.run step starts with new
+        clients and does not leak them.
+        """
+        loop_clients = cls.async_clients.get(loop)
+        if loop_clients is not None:
+            return loop_clients
+
+        async def close_on_shutdown():
+            try:
+                yield
+            finally:
+                with cls.lock:
+                    cls.async_clients.pop(loop, None)
+                clients = [client for client, _ in loop_clients["clients"].values()]
+                for client in clients + loop_clients["retired"]:
+                    try:
+                        await client.close()
+                    except Exception:
+                        logger.warning("Failed to close opensearch async client")
+
+        lifetime = close_on_shutdown()
+        # the loop only keeps a weak reference to its async generators
+        loop_clients = {"clients": {}, "retired": [], "lifetime": lifetime}
+        cls.async_clients[loop] = loop_clients
+        # run the generator up to its yield, which registers it in the loop
+        loop.create_task(lifetime.__anext__())
+        return loop_clients
+
+    @classmethod
+    def is_index_known(cls, opensearch_url: str, index_name: str) -> bool:
+        with cls.lock:
+            hit = (opensearch_url, index_name) in cls.known_indexes
+            cls._record("index", hit)
+            return hit
+
+    @classmethod
+    def add_known_index(cls, opensearch_url: str, index_name: str):
+        with cls.lock:
+            cls.known_indexes.add((opensearch_url, index_name))
+
+    @classmethod
+    def remove_known_index(cls, opensearch_url: str, index_name: str):
+        with cls.lock:
+            cls.known_indexes.discard((opensearch_url, index_name))
+
+    @classmethod
+    def get_stats(cls) -> dict:
+        with cls.lock:
+            return dict(cls.stats)
+
+    @classmethod
+    def clear(cls):
+        with cls.lock:
+            cls.credentials.clear()
+            cls.clients.clear()
+            cls.async_clients.clear()
+            cls.known_indexes.clear()
+            for k in cls.stats:
+                cls.stats[k] = 0
+
+
 class OpenSearchBase(BaseModel):
     opensearch_url: Union[str, None] = None
     index_name: str
@@ -75,15 +239,32 @@ class OpenSearchBase(BaseModel):
                 self.client,
                 self.async_client,
             )
-            self.client_kwargs = get_client_kwargs()
-            self.client = _get_opensearch_client(
-                self.opensearch_url, **self.client_kwargs
-            )
-            self.async_client = _get_async_opensearch_client(
-                self.opensearch_url, **self.client_kwargs
+            self.client_kwargs = OpenSearchConnectionPool.get_client_kwargs()
+            self.client = OpenSearchConnectionPool.get_client(
+                self.opensearch_url, self.client_kwargs
             )
+            # async client is resolved lazily in the running event loop,
+            # see `get_async_client`
         self.is_aoss = _is_aoss_enabled(http_auth=self.http_auth)
-        self.create_index()
+        if self.opensearch_url is None:
+            self.create_index()
+        elif not OpenSearchConnectionPool.is_index_known(
+            self.opensearch_url, self.index_name
+        ):
+            self.create_index()
+            OpenSearchConnectionPool.add_known_index(
+                self.opensearch_url, self.index_name
+            )
+        logger.info(
+            f"opensearch connection pool stats: {OpenSearchConnectionPool.get_stats()}"
+        )
+
+    def get_async_client(self):
+        if self.async_client is not None:
+            return self.async_client
+        return OpenSearchConnectionPool.get_async_client(
+            self.opensearch_url, self.client_kwargs
+        )
 
     def create_index(self):
         raise NotImplemented
@@ -96,6 +277,10 @@ class OpenSearchBase(BaseModel):
             index_name = self.index_name
         try:
             self.client.indices.delete(index=index_name)
+            if self.opensearch_url is not None:
+                OpenSearchConnectionPool.remove_known_index(
+                    self.opensearch_url, index_name
+                )
             return True
         except Exception as e:
             raise e
@@ -158,7 +343,7 @@ class OpenSearchBase(BaseModel):
         actions = [
             {"delete": {"_index": self.index_name, "_id": id_}} for id_ in ids
         ]
-        response = await self.async_client.bulk(body=actions, **kwargs)
+        response = await self.get_async_client().bulk(body=actions, **kwargs)
         return not any(
             item.get("delete", {}).get("error") for item in response["items"]
         )
@@ -219,10 +404,21 @@ class OpenSearchBase(BaseModel):
         return res
 
     async def asearch(self, query_dict: dict):
-        return await self.async_client.search(
+        return await self.get_async_client().search(
             index=self.index_name, body=query_dict
         )
 
+    async def amsearch(self, query_dicts: List[dict]) -> List[dict]:
+        """Run several searches against the index in one _msearch round trip."""
+        if not query_dicts:
+            return []
+        body = []
+        for query_dict in query_dicts:
+            body.append({"index": self.index_name})
+            body.append(query_dict)
+        res = await self.get_async_client().msearch(body=body)
+        return res["responses"]
+
 
 class OpenSearchBM25Search(OpenSearchBase):
     k1: float = 1.2
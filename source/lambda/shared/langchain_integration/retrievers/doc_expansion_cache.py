@@ -0,0 +1,151 @@
+"""
+Cache of whole document expansions used by ContextExtendMethod.WHOLE_DOC.
+
+A request scoped cache dedupes `aget_doc` calls keyed by
+(index_name, file_path, size) and coalesces concurrent in-flight fetches,
+so that BM25 and vector hits of the same file, and retrievers inside the
+same MergerRetriever, download the document only once.
+
+Optionally, documents are kept across requests in a process-wide LRU.
+Each entry is stamped with the `file_version` written by the ETL job into
+the chunk metadata; when a search hit carries a different version the
+file has been re-ingested and the entry is dropped.
+"""
+import asyncio
+import os
+import threading
+from collections import OrderedDict
+from contextvars import ContextVar
+from typing import Awaitable, Callable, List, Tuple, Union
+
+from langchain.docstore.document import Document
+from shared.utils.logger_utils import get_logger
+
+logger = get_logger(__name__)
+
+DocCacheKey = Tuple[str, str, int]
+
+
+def get_docs_bytes(docs: List[Document]) -> int:
+    return sum(len(doc.page_content.encode("utf-8")) for doc in docs)
+
+
+class DocExpansionLRU:
+    """
+    Process-wide LRU of whole document expansions, disabled when
+    WHOLE_DOC_CACHE_MAX_ENTRIES is 0.
+    """
+
+    lock = threading.Lock()
+    max_entries = int(os.environ.get("WHOLE_DOC_CACHE_MAX_ENTRIES", 0))
+    entries = OrderedDict()
+
+    @classmethod
+    def get(
+        cls, key: DocCacheKey, version: Union[str, None]
+    ) -> Union[List[Document], None]:
+        if cls.max_entries <= 0 or version is None:
+            return None
+        with cls.lock:
+            entry = cls.entries.get(key)
+            if entry is None:
+                return None
+            entry_version, docs = entry
+            if entry_version != version:
+                # the file has been re-ingested by the ETL pipeline
+                cls.entries.pop(key)
+                return None
+            cls.entries.move_to_end(key)
+            return docs
+
+    @classmethod
+    def put(
+        cls, key: DocCacheKey, version: Union[str, None], docs: List[Document]
+    ):
+        if cls.max_entries <= 0 or version is None:
+            return
+        with cls.lock:
+            cls.entries[key] = (version, docs)
+            cls.entries.move_to_end(key)
+            while len(cls.entries) > cls.max_entries:
+                cls.entries.popitem(last=False)
+
+    @classmethod
+    def invalidate(cls, index_name: str, file_path: str):
+        with cls.lock:
+            for key in [
+                k for k in cls.entries if k[0] == index_name and k[1] == file_path
+            ]:
+                cls.entries.pop(key)
+
+    @classmethod
+    def clear(cls):
+        with cls.lock:
+            cls.entries.clear()
+
+
+class DocExpansionCache:
+    """
+    Request scoped cache of whole document expansions.
+    """
+
+    def __init__(self):
+        self.docs = {}
+        self.inflight = {}
+        self.stats = {"hits": 0, "misses": 0, "bytes_saved": 0}
+
+    def _hit(self, docs: List[Document]) -> List[Document]:
+        self.stats["hits"] += 1
+        self.stats["bytes_saved"] += get_docs_bytes(docs)
+        return list(docs)
+
+    async def aget(
+        self,
+        key: DocCacheKey,
+        fetch_fn: Callable[[], Awaitable[List[Document]]],
+        version: Union[str, None] = None,
+    ) -> List[Document]:
+        if key in self.docs:
+            return self._hit(self.docs[key])
+
+        docs = DocExpansionLRU.get(key, version)
+        if docs is not None:
+            self.docs[key] = docs
+            return self._hit(docs)
+
+        loop = asyncio.get_running_loop()
+        inflight = self.inflight.get(key)
+        # in-flight tasks are bound to the event loop which created them
+        if inflight is not None and inflight[0] is loop:
+            docs = await asyncio.shield(inflight[1])
+            return self._hit(docs)
+
+        self.stats["misses"] += 1
+        task = asyncio.ensure_future(fetch_fn())
+        self.inflight[key] = (loop, task)
+        try:
+            docs = await task
+        finally:
+            if self.inflight.get(key, (None, None))[1] is task:
+                self.inflight.pop(key)
+        self.docs[key] = docs
+        DocExpansionLRU.put(key, version, docs)
+        return list(docs)
+
+
+_current_doc_expansion_cache: ContextVar[Union[DocExpansionCache, None]] = (
+    ContextVar("current_doc_expansion_cache", default=None)
+)
+
+
+def start_doc_expansion_cache() -> DocExpansionCache:
+    """
+    Start a new request scoped cache in current context
+    """
+    cache = DocExpansionCache()
+    _current_doc_expansion_cache.set(cache)
+    return cache
+
+
+def get_doc_expansion_cache() -> Union[DocExpansionCache, None]:
+    return _current_doc_expansion_cache.get()
@@ -0,0 +1,149 @@
+"""
+Request scoped query embedding service shared by all retrievers.
+
+QQ match, intention and RAG retrievers usually embed the same query with
+the same model. The service keys embeddings by (model key, text), so each
+distinct text is embedded once per request. Concurrent requests for the
+same text are coalesced, and distinct texts for the same model arriving
+within a short window are sent in one `aembed_documents` call when the
+provider embeds queries and documents symmetrically in a single request.
+"""
+import asyncio
+import json
+from contextvars import ContextVar
+from typing import List, Union
+
+from langchain_core.embeddings import Embeddings
+from shared.constant import ModelProvider
+from shared.utils.logger_utils import get_logger
+
+logger = get_logger(__name__)
+
+# time to wait for other retrievers before sending a batch, in seconds
+EMBEDDING_BATCH_WINDOW = 0.002
+
+# providers whose embed_documents is one request and equals embed_query
+BATCH_EMBEDDING_PROVIDERS = (
+    ModelProvider.SAGEMAKER,
+    ModelProvider.OPENAI,
+    ModelProvider.BRCONNECTOR_BEDROCK,
+)
+
+EMBEDDING_MODEL_KEY_FIELDS = (
+    "provider",
+    "model_id",
+    "sagemaker_endpoint_name",
+    "sagemaker_target_model",
+    "base_url",
+    "model_kwargs",
+)
+
+
+def get_embedding_model_key(embedding_config: dict) -> str:
+    return json.dumps(
+        {k: embedding_config.get(k) for k in EMBEDDING_MODEL_KEY_FIELDS},
+        sort_keys=True,
+        default=str,
+    )
+
+
+class EmbeddingService:
+    """
+    Request scoped cache and batcher of query embeddings.
+    """
+
+    def __init__(self):
+        self.embeddings = {}
+        self.pending = {}
+        # (model key, text) -> future of a text waiting in a batch or in flight
+        self.futures = {}
+        # the loop only keeps weak references to its tasks
+        self.tasks = set()
+        self.stats = {"calls": 0, "texts": 0, "hits": 0}
+
+    async def aembed_query(
+        self, model_key: str, embeddings: Embeddings, text: str
+    ) -> List[float]:
+        key = (model_key, text)
+        if key in self.embeddings:
+            self.stats["hits"] += 1
+            return self.embeddings[key]
+
+        loop = asyncio.get_running_loop()
+        future = self.futures.get(key)
+        # futures and batches are bound to the event loop which created them
+        if future is not None and future.get_loop() is loop:
+            self.stats["hits"] += 1
+            return await asyncio.shield(future)
+
+        batch = self.pending.get(model_key)
+        if batch is None or batch["loop"] is not loop:
+            batch = {"loop": loop, "embeddings": embeddings, "futures": {}}
+            self.pending[model_key] = batch
+            loop.call_later(
+                EMBEDDING_BATCH_WINDOW, self._start_flush, model_key, batch
+            )
+
+        future = loop.create_future()
+        batch["futures"][text] = future
+        self.futures[key] = future
+        return await asyncio.shield(future)
+
+    def _start_flush(self, model_key: str, batch: dict):
+        task = asyncio.ensure_future(self._aflush(model_key, batch))
+        self.tasks.add(task)
+        task.add_done_callback(self.tasks.discard)
+
+    async def _aflush(self, model_key: str, batch: dict):
+        if self.pending.get(model_key) is batch:
+            self.pending.pop(model_key)
+        embeddings: Embeddings = batch["embeddings"]
+        texts = list(batch["futures"])
+        provider = json.loads(model_key).get("provider")
+        try:
+            if len(texts) == 1:
+                vectors = [await embeddings.aembed_query(texts[0])]
+                self.stats["calls"] += 1
+            elif provider in BATCH_EMBEDDING_PROVIDERS:
+                vectors = await embeddings.aembed_documents(texts)
+                self.stats["calls"] += 1
+            else:
+                vectors = await asyncio.gather(
+                    *[embeddings.aembed_query(text) for text in texts]
+                )
+                self.stats["calls"] += len(texts)
+        except Exception as e:
+            for text, future in batch["futures"].items():
+                self._pop_future(model_key, text, future)
+                if not future.done():
+                    future.set_exception(e)
+            return
+        self.stats["texts"] += len(texts)
+        for text, vector in zip(texts, vectors):
+            self.embeddings[(model_key, text)] = vector
+            future = batch["futures"][text]
+            self._pop_future(model_key, text, future)
+            if not future.done():
+                future.set_result(vector)
+
+    def _pop_future(self, model_key: str, text: str, future: asyncio.Future):
+        if self.futures.get((model_key, text)) is future:
+            self.futures.pop((model_key, text))
+
+
+_current_embedding_service: ContextVar[Union[EmbeddingService, None]] = (
+    ContextVar("current_embedding_service", default=None)
+)
+
+
+def start_embedding_service() -> EmbeddingService:
+    """
+    Start a new request scoped embedding service in current context
+    """
+    service = EmbeddingService()
+    _current_embedding_service.set(service)
+    return service
+
+
+def get_embedding_service() -> Union[EmbeddingService, None]:
+    return _current_embedding_service.get()
@@ -5,7 +5,7 @@ from langchain_core.documents import BaseDocumentCompressor
 from ..models.embedding_models import EmbeddingModel
 from typing import Any, Dict, List, Union,Tuple
 from ..models.rerank_models import RerankModel
-from pydantic import Field  
+from pydantic import Field, PrivateAttr
 from langchain.docstore.document import Document
 from langchain.callbacks.manager import (
     CallbackManagerForRetrieverRun,
@@ -14,6 +14,8 @@ from langchain.callbacks.manager import (
 import traceback
 from shared.utils.logger_utils import get_logger
 from shared.constant import ContextExtendMethod,Threshold
+from .doc_expansion_cache import DocExpansionCache, get_doc_expansion_cache
+from .embedding_service import get_embedding_model_key, get_embedding_service
 import asyncio
 
 logger = get_logger(__name__)
@@ -39,6 +41,10 @@ class OpensearchHybridRetrieverBase(BaseRetriever):
     enable_vector_search:bool = True
 
     rerank_top_k:Union[int,None] = None
+    # identify the embedding model in the request scoped embedding service
+    embedding_model_key:Union[str,None] = None
+    # fetch neighbor chunks with one msearch in ContextExtendMethod.NEIGHBOR
+    neighbor_batch_fetch:bool = True
     # search_params: dict = Field(default=dict)
 
     @classmethod
@@ -64,6 +70,7 @@ class OpensearchHybridRetrieverBase(BaseRetriever):
             database=database,
             embeddings=embeddings,
             reranker=reranker,
+            embedding_model_key=get_embedding_model_key(embedding_config),
             **kwargs
             # search_params=search_params
         )
@@ -182,7 +189,14 @@ class OpensearchHybridRetrieverBase(BaseRetriever):
         return results
 
     async def _aget_embedding(self,query:str):
-        return await self.embeddings.aembed_query(query)
+        embedding_service = get_embedding_service()
+        if embedding_service is None or self.embedding_model_key is None:
+            return await self.embeddings.aembed_query(query)
+        return await embedding_service.aembed_query(
+            self.embedding_model_key,
+            self.embeddings,
+            query
+        )
 
 
     async def acompress_documents(self,query,output_docs:list[Document],**kwargs):
@@ -298,81 +312,129 @@ class OpensearchHybridRetrieverBase(BaseRetriever):
         
 
 class OpensearchHybridQueryDocumentRetriever(OpensearchHybridRetrieverBase):
-    
-    async def aget_sibling_context(self, chunk_id, window_size)-> Tuple[List[Document],List[Document]]:
-        next_content_list:List[Document] = []
-        previous_content_list:List[Document] = []
-        previous_pos = 0
-        next_pos = 0
-        chunk_id_prefix = "-".join(chunk_id.split("-")[:-1])
-        section_id = int(chunk_id.split("-")[-1])
-        previous_section_id = section_id
-        next_section_id = section_id
-        while previous_pos < window_size:
-            previous_section_id -= 1
-            if previous_section_id < 1:
-                break
-            previous_chunk_id = f"{chunk_id_prefix}-{previous_section_id}"
-            opensearch_query_response = await self.database.asearch(
-                self._build_exact_search_query(
-                    query_term=previous_chunk_id,
-                    field="metadata.chunk_id",
-                    size=1
-                )
-                # index_name=index_name,
-                # query_type="basic",
-                # query_term=previous_chunk_id,
-                # field="metadata.chunk_id",
-                # size=1,
+    # used when no request scoped cache is started, e.g. in local tests
+    _local_doc_expansion_cache: DocExpansionCache = PrivateAttr(default_factory=DocExpansionCache)
+
+    async def _aget_chunk_hit(self, chunk_id, chunk_cache:dict=None) -> Union[dict,None]:
+        """
+        get the top hit of chunk_id, lookup chunk_cache first if given
+        """
+        if chunk_cache is not None and chunk_id in chunk_cache:
+            return chunk_cache[chunk_id]
+        opensearch_query_response = await self.database.asearch(
+            self._build_exact_search_query(
+                query_term=chunk_id,
+                field="metadata.chunk_id",
+                size=1
             )
-            if len(opensearch_query_response["hits"]["hits"]) > 0:
-                r = opensearch_query_response["hits"]["hits"][0]
-                previous_content_list.insert(0,Document(
-                    page_content=r["_source"][self.database.text_field],
-                    metadata={
-                        **r["_source"]["metadata"]
-                    },
-                )
-                )
-                # previous_content_list.insert(0, r["_source"]["text"])
-                previous_pos += 1
-            else:
-                break
-        while next_pos < window_size:
-            next_section_id += 1
-            next_chunk_id = f"{chunk_id_prefix}-{next_section_id}"
-            opensearch_query_response = await self.database.asearch(
+        )
+        hits = opensearch_query_response["hits"]["hits"]
+        hit = hits[0] if len(hits) > 0 else None
+        if chunk_cache is not None:
+            chunk_cache[chunk_id] = hit
+        return hit
+
+    async def amget_chunk_hits(self, chunk_ids:List[str]) -> Dict[str,Union[dict,None]]:
+        """
+        fetch the top hit of each chunk_id with a single msearch round trip,
+        chunk ids whose sub query fails are left out and fetched again on demand
+        """
+        chunk_ids = list(dict.fromkeys(chunk_ids))
+        if not chunk_ids:
+            return {}
+        responses = await self.database.amsearch(
+            [
                 self._build_exact_search_query(
-                    query_term=next_chunk_id,
+                    query_term=chunk_id,
                     field="metadata.chunk_id",
                     size=1
                 )
-            
-                # index_name=index_name,
-                # query_type="basic",
-                # query_term=next_chunk_id,
-                # field="metadata.chunk_id",
-                # size=1,
-            )
-            if len(opensearch_query_response["hits"]["hits"]) > 0:
-                r = opensearch_query_response["hits"]["hits"][0]
-                next_content_list.append(Document(
-                    page_content=r["_source"][self.database.text_field],
-                    metadata={
-                        **r["_source"]["metadata"],
-                    },
-                )
+                for chunk_id in chunk_ids
+            ]
+        )
+        chunk_cache = {}
+        for chunk_id, response in zip(chunk_ids, responses):
+            if "error" in response:
+                logger.warning(f"msearch failed for chunk_id {chunk_id}: {response['error']}")
+                continue
+            hits = response["hits"]["hits"]
+            chunk_cache[chunk_id] = hits[0] if len(hits) > 0 else None
+        return chunk_cache
+
+    @staticmethod
+    def get_sibling_chunk_ids(chunk_id, window_size) -> Tuple[List[str],List[str]]:
+        """
+        predict the previous/next sibling chunk ids of chunk_id, nearest first
+        """
+        chunk_id_prefix = "-".join(chunk_id.split("-")[:-1])
+        section_id = int(chunk_id.split("-")[-1])
+        previous_chunk_ids = [
+            f"{chunk_id_prefix}-{previous_section_id}"
+            for previous_section_id in range(section_id - 1, max(section_id - 1 - window_size, 0), -1)
+        ]
+        next_chunk_ids = [
+            f"{chunk_id_prefix}-{next_section_id}"
+            for next_section_id in range(section_id + 1, section_id + 1 + window_size)
+        ]
+        return previous_chunk_ids, next_chunk_ids
+
+    def get_neighbor_candidate_chunk_ids(self, docs:List[Document], window_size) -> List[str]:
+        """
+        collect every chunk id that aget_context can predict for docs,
+        i.e. all sibling chunk ids and the first hop of the heading hierarchy
+        """
+        candidate_chunk_ids = []
+        for doc in docs:
+            chunk_id = doc.metadata.get("chunk_id")
+            if not chunk_id:
+                continue
+            try:
+                previous_chunk_ids, next_chunk_ids = self.get_sibling_chunk_ids(
+                    chunk_id, window_size
                 )
-                next_pos += 1
-            else:
+            except ValueError:
+                continue
+            candidate_chunk_ids.extend(previous_chunk_ids)
+            candidate_chunk_ids.extend(next_chunk_ids)
+            heading_hierarchy = doc.metadata.get("heading_hierarchy") or {}
+            for key in ("previous", "next"):
+                hierarchy_chunk_id = heading_hierarchy.get(key)
+                if hierarchy_chunk_id and hierarchy_chunk_id.startswith("$"):
+                    candidate_chunk_ids.append(hierarchy_chunk_id)
+        return candidate_chunk_ids
+
+    def _hit_to_document(self, hit:dict) -> Document:
+        return Document(
+            page_content=hit["_source"][self.database.text_field],
+            metadata={
+                **hit["_source"]["metadata"],
+            },
+        )
+
+    async def aget_sibling_context(self, chunk_id, window_size, chunk_cache:dict=None)-> Tuple[List[Document],List[Document]]:
+        next_content_list:List[Document] = []
+        previous_content_list:List[Document] = []
+        previous_chunk_ids, next_chunk_ids = self.get_sibling_chunk_ids(
+            chunk_id, window_size
+        )
+        for previous_chunk_id in previous_chunk_ids:
+            r = await self._aget_chunk_hit(previous_chunk_id, chunk_cache)
+            if r is None:
                 break
+            previous_content_list.insert(0, self._hit_to_document(r))
+        for next_chunk_id in next_chunk_ids:
+            r = await self._aget_chunk_hit(next_chunk_id, chunk_cache)
+            if r is None:
+                break
+            next_content_list.append(self._hit_to_document(r))
         return [previous_content_list, next_content_list]
 
 
     async def aget_context(
             self,
             doc:Document, 
-            window_size:int
+            window_size:int,
+            chunk_cache:dict=None
         ) -> Tuple[List[Document],List[Document]]:
         previous_content_list = []
         next_content_list = []
@@ -380,7 +442,7 @@ class OpensearchHybridQueryDocumentRetriever(OpensearchHybridRetrieverBase):
             return previous_content_list, next_content_list
         chunk_id = doc.metadata["chunk_id"]
         inner_previous_content_list, inner_next_content_list = await self.aget_sibling_context(
-            chunk_id, window_size
+            chunk_id, window_size, chunk_cache=chunk_cache
         )
         if (
             len(inner_previous_content_list) == window_size
@@ -400,28 +462,14 @@ class OpensearchHybridQueryDocumentRetriever(OpensearchHybridRetrieverBase):
                 and previous_chunk_id.startswith("$")
                 and previous_pos < window_size
             ):
-                opensearch_query_response = await self.database.asearch(
-                    self._build_exact_search_query(
-                        query_term=previous_chunk_id,
-                        field="metadata.chunk_id",
-                        size=1
-                )
-                )
-                if len(opensearch_query_response["hits"]["hits"]) > 0:
-                    r = opensearch_query_response["hits"]["hits"][0]
-                    previous_chunk_id = r["_source"]["metadata"]["heading_hierarchy"][
-                        "previous"
-                    ]
-                    previous_content_list.insert(0,Document(
-                        page_content=r["_source"][self.database.text_field],
-                        metadata={
-                            **r["_source"]["metadata"],
-                        },
-                    )
-                    )
-                    previous_pos += 1
-                else:
+                r = await self._aget_chunk_hit(previous_chunk_id, chunk_cache)
+                if r is None:
                     break
+                previous_chunk_id = r["_source"]["metadata"]["heading_hierarchy"][
+                    "previous"
+                ]
+                previous_content_list.insert(0, self._hit_to_document(r))
+                previous_pos += 1
         if "next" in doc.metadata["heading_hierarchy"]:
             next_chunk_id = doc.metadata["heading_hierarchy"]["next"]
             next_pos = 0
@@ -429,25 +477,12 @@ class OpensearchHybridQueryDocumentRetriever(OpensearchHybridRetrieverBase):
                 next_chunk_id and next_chunk_id.startswith(
                     "$") and next_pos < window_size
             ):
-                opensearch_query_response = await self.database.asearch(
-                    self._build_exact_search_query(
-                        query_term=next_chunk_id,
-                        field="metadata.chunk_id",
-                        size=1
-                )
-                )
-                if len(opensearch_query_response["hits"]["hits"]) > 0:
-                    r = opensearch_query_response["hits"]["hits"][0]
-                    next_chunk_id = r["_source"]["metadata"]["heading_hierarchy"]["next"]
-                    next_content_list.append(Document(
-                        page_content=r["_source"][self.database.text_field],
-                        metadata={
-                            **r["_source"]["metadata"],
-                        })
-                    )
-                    next_pos += 1
-                else:
+                r = await self._aget_chunk_hit(next_chunk_id, chunk_cache)
+                if r is None:
                     break
+                next_chunk_id = r["_source"]["metadata"]["heading_hierarchy"]["next"]
+                next_content_list.append(self._hit_to_document(r))
+                next_pos += 1
         return [previous_content_list, next_content_list]
 
     
@@ -520,6 +555,17 @@ class OpensearchHybridQueryDocumentRetriever(OpensearchHybridRetrieverBase):
         return sorted_chunk_list
     
     
+    async def aget_doc_cached(self,file_path,size=100,version=None) -> list[Document]:
+        """
+        get whole doc through the request scoped doc expansion cache
+        """
+        doc_expansion_cache = get_doc_expansion_cache() or self._local_doc_expansion_cache
+        return await doc_expansion_cache.aget(
+            (self.database.index_name, file_path, size),
+            lambda: self.aget_doc(file_path, size=size),
+            version=version
+        )
+
     async def _aextend_search_results(
             self,
             search_response:dict,
@@ -551,9 +597,10 @@ class OpensearchHybridQueryDocumentRetriever(OpensearchHybridRetrieverBase):
         if context_extend_method == ContextExtendMethod.WHOLE_DOC:
             extend_chunks_list:list[list[Document]] = await asyncio.gather(
                     *[
-                        self.aget_doc(
+                        self.aget_doc_cached(
                             result.metadata[self.database.source_field], 
-                            size=whole_doc_max_size
+                            size=whole_doc_max_size,
+                            version=result.metadata.get("file_version")
                         )
                         for result in results
                     ]
@@ -568,11 +615,21 @@ class OpensearchHybridQueryDocumentRetriever(OpensearchHybridRetrieverBase):
             return results
         
         if context_extend_method == ContextExtendMethod.NEIGHBOR:
+            chunk_cache = None
+            if kwargs.get("neighbor_batch_fetch", self.neighbor_batch_fetch):
+                # fetch all predictable neighbors in one round trip,
+                # aget_context only walks the ids it cannot predict
+                chunk_cache = await self.amget_chunk_hits(
+                    self.get_neighbor_candidate_chunk_ids(
+                        results, chunk_window_size
+                    )
+                )
             extend_chunks_list:list[list[Document]] = await asyncio.gather(
                     *[
                         self.aget_context(
                             result,
-                            chunk_window_size
+                            chunk_window_size,
+                            chunk_cache=chunk_cache
                         )
                         for result in results
                     ]
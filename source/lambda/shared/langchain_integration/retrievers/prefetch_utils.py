@@ -0,0 +1,69 @@
+"""
+Helpers to prefetch knowledge retrieval speculatively and reuse the
+results later in the same request, e.g. in the rag tool.
+"""
+import asyncio
+from typing import Dict, List, Union
+
+from langchain_core.documents import Document
+from langchain_core.retrievers import BaseRetriever
+
+
+def merge_retrieved_documents(
+    retriever_docs: List[List[Document]],
+) -> List[Document]:
+    """
+    Interleave the documents of several retrievers, the same way as
+    langchain MergerRetriever does.
+    """
+    merged_documents = []
+    max_docs = max(map(len, retriever_docs), default=0)
+    for i in range(max_docs):
+        for docs in retriever_docs:
+            if i < len(docs):
+                merged_documents.append(docs[i])
+    return merged_documents
+
+
+async def aprefetch_documents(
+    retrievers: List[BaseRetriever], query: str
+) -> dict:
+    """
+    Run all retrievers concurrently and keep the documents of each index
+    """
+    tasks = [
+        asyncio.ensure_future(retriever.ainvoke(query))
+        for retriever in retrievers
+    ]
+    try:
+        retriever_docs = await asyncio.gather(*tasks)
+    finally:
+        # stop the other retrievers when one of them fails
+        for task in tasks:
+            task.cancel()
+    return {
+        "query": query,
+        "docs": {
+            retriever.database.index_name: docs
+            for retriever, docs in zip(retrievers, retriever_docs)
+        },
+    }
+
+
+def get_prefetched_documents(
+    prefetched: Union[dict, None], query: str, index_names: List[str]
+) -> Union[List[Document], None]:
+    """
+    Return the merged prefetched documents of index_names, or None if the
+    query or any of the indexes was not prefetched.
+    """
+    if not prefetched or prefetched["query"] != query:
+        return None
+    docs: Dict[str, List[Document]] = prefetched["docs"]
+    if not index_names or any(
+        index_name not in docs for index_name in index_names
+    ):
+        return None
+    return merge_retrieved_documents(
+        [docs[index_name] for index_name in index_names]
+    )
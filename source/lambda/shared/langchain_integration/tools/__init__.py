@@ -1,8 +1,12 @@
 from typing import Optional, Union
 from pydantic import BaseModel
 import platform
+import hashlib
 import json
 import inspect
+import os
+import threading
+from contextvars import ContextVar
 from functools import wraps
 import types
 
@@ -29,14 +33,85 @@ class ToolIdentifier(BaseModel):
         return f"{self.scene}__{self.name}"
 
 
+def get_content_hash(content) -> str:
+    """Hash of the canonical json of content"""
+    canonical = json.dumps(
+        content, sort_keys=True, ensure_ascii=False, separators=(",", ":"),
+        default=str
+    )
+    return hashlib.sha256(canonical.encode("utf-8")).hexdigest()
+
+
+class ToolSchemaCache:
+    """
+    Content addressed cache of the pydantic models generated from tool
+    definitions, keyed by the hash of the canonical json schema.
+
+    When TOOL_SCHEMA_CACHE_DIR is set, e.g. to /tmp/tool_schema_cache, the
+    generated source is also persisted there, so that re-imports skip the
+    code generation.
+    """
+
+    lock = threading.Lock()
+    cache_dir = os.environ.get("TOOL_SCHEMA_CACHE_DIR", "")
+    models = {}
+    stats = {"hits": 0, "disk_hits": 0, "misses": 0}
+
+    @classmethod
+    def _source_path(cls, schema_hash: str) -> str:
+        return os.path.join(cls.cache_dir, f"{schema_hash}.py")
+
+    @classmethod
+    def load_source(cls, schema_hash: str) -> Union[str, None]:
+        if not cls.cache_dir:
+            return None
+        try:
+            with open(cls._source_path(schema_hash), encoding="utf-8") as f:
+                return f.read()
+        except OSError:
+            return None
+
+    @classmethod
+    def save_source(cls, schema_hash: str, source: str):
+        if not cls.cache_dir:
+            return
+        path = cls._source_path(schema_hash)
+        tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        try:
+            os.makedirs(cls.cache_dir, exist_ok=True)
+            with open(tmp_path, "w", encoding="utf-8") as f:
+                f.write(source)
+            os.replace(tmp_path, path)
+        except OSError:
+            pass
+
+
+# tools registered from the chatbot config of the current request
+_request_tool_map: ContextVar[Union[dict, None]] = ContextVar(
+    "request_tool_map", default=None
+)
+
+
 class ToolManager:
     tool_map = {}
+    # tool id -> (fingerprint of the definition, tool) of the tools
+    # registered from chatbot configs, reused across requests
+    registered_tools = {}
+    registered_tools_lock = threading.Lock()
 
     @staticmethod
-    def convert_tool_def_to_pydantic(tool_id, tool_def: Union[dict, BaseModel]):
-        if not isinstance(tool_def, dict):
-            return tool_def
-        # convert tool definition to pydantic model
+    def start_request_scope() -> dict:
+        """
+        Start a new request scoped tool map in current context. Tools
+        registered from the chatbot config are only visible in this scope,
+        so that concurrent requests do not see each other's tools.
+        """
+        request_tool_map = {}
+        _request_tool_map.set(request_tool_map)
+        return request_tool_map
+
+    @staticmethod
+    def generate_pydantic_source(tool_def: dict) -> str:
         current_python_version = ".".join(
             platform.python_version().split(".")[:-1])
         data_model_types = get_data_model_types(
@@ -55,10 +130,60 @@ class ToolManager:
         )
         result = parser.parse()
         result = result.replace("from __future__ import annotations", "")
-        new_tool_module = types.ModuleType(tool_id)
-        exec(result, new_tool_module.__dict__)
-        model_cls = new_tool_module.Model
-        return model_cls
+        return result
+
+    @staticmethod
+    def convert_tool_def_to_pydantic(tool_id, tool_def: Union[dict, BaseModel]):
+        if not isinstance(tool_def, dict):
+            return tool_def
+        # the generated code depends on the python version
+        schema_hash = get_content_hash(
+            {"python_version": platform.python_version(), "tool_def": tool_def}
+        )
+        with ToolSchemaCache.lock:
+            model_cls = ToolSchemaCache.models.get(schema_hash)
+            if model_cls is not None:
+                ToolSchemaCache.stats["hits"] += 1
+                return model_cls
+
+            # convert tool definition to pydantic model
+            result = ToolSchemaCache.load_source(schema_hash)
+            if result is not None:
+                ToolSchemaCache.stats["disk_hits"] += 1
+            else:
+                ToolSchemaCache.stats["misses"] += 1
+                result = ToolManager.generate_pydantic_source(tool_def)
+                ToolSchemaCache.save_source(schema_hash, result)
+            new_tool_module = types.ModuleType(f"tool_schema_{schema_hash}")
+            exec(result, new_tool_module.__dict__)
+            model_cls = new_tool_module.Model
+            ToolSchemaCache.models[schema_hash] = model_cls
+            return model_cls
+
+    @classmethod
+    def get_registered_tool(cls, tool_id: str, fingerprint: str):
+        """Return the registered tool if its definition has not changed"""
+        with cls.registered_tools_lock:
+            registered = cls.registered_tools.get(tool_id)
+        if registered is not None and registered[0] == fingerprint:
+            return registered[1]
+        return None
+
+    @classmethod
+    def register_request_tool(
+        cls, tool_identifier: ToolIdentifier, tool: BaseTool, fingerprint: str
+    ):
+        """
+        Register a tool built from the chatbot config in the current request
+        scope, and keep it for the next requests with the same definition.
+        """
+        with cls.registered_tools_lock:
+            cls.registered_tools[tool_identifier.tool_id] = (fingerprint, tool)
+        request_tool_map = _request_tool_map.get()
+        if request_tool_map is None:
+            return cls.register_lc_tool(tool_identifier=tool_identifier, tool=tool)
+        request_tool_map[tool_identifier.tool_id] = tool
+        return tool
 
     @staticmethod
     def get_tool_identifier(scene=None, name=None, tool_identifier=None):
@@ -132,6 +257,16 @@ class ToolManager:
             name=name,
             tool_identifier=tool_identifier
         )
+        fingerprint = get_content_hash(
+            {
+                "lambda_name": lambda_name,
+                "tool_def": tool_def,
+                "return_direct": return_direct,
+            }
+        )
+        tool = cls.get_registered_tool(tool_identifier.tool_id, fingerprint)
+        if tool is not None:
+            return cls.register_request_tool(tool_identifier, tool, fingerprint)
         tool = StructuredTool.from_function(
             func=_func,
             name=tool_identifier.name,
@@ -141,10 +276,7 @@ class ToolManager:
             ),
             return_direct=return_direct
         )
-        return ToolManager.register_lc_tool(
-            tool_identifier=tool_identifier,
-            tool=tool
-        )
+        return cls.register_request_tool(tool_identifier, tool, fingerprint)
 
     @classmethod
     def register_common_rag_tool(
@@ -164,6 +296,16 @@ class ToolManager:
             name=name,
             tool_identifier=tool_identifier
         )
+        fingerprint = get_content_hash(
+            {
+                "retriever_config": retriever_config,
+                "description": description,
+                "return_direct": return_direct,
+            }
+        )
+        tool = cls.get_registered_tool(tool_identifier.tool_id, fingerprint)
+        if tool is not None:
+            return cls.register_request_tool(tool_identifier, tool, fingerprint)
 
         class RagModel(BaseModel):
             class Config:
@@ -182,17 +324,16 @@ class ToolManager:
             return_direct=return_direct,
             response_format="content_and_artifact"
         )
-
-        return ToolManager.register_lc_tool(
-            tool_identifier=tool_identifier,
-            tool=tool
-        )
+        return cls.register_request_tool(tool_identifier, tool, fingerprint)
 
     @classmethod
     def get_tool(cls, scene, name, **kwargs):
         # dynamic import
         tool_identifier = ToolIdentifier(scene=scene, name=name)
         tool_id = tool_identifier.tool_id
+        request_tool_map = _request_tool_map.get()
+        if request_tool_map is not None and tool_id in request_tool_map:
+            return request_tool_map[tool_id]
         if tool_id not in cls.tool_map:
             TOOL_MOFULE_LOAD_FN_MAP[tool_id](**kwargs)
         return cls.tool_map[tool_id]
@@ -6,7 +6,11 @@ from shared.constant import (
 )
 import asyncio
 from shared.utils.lambda_invoke_utils import send_trace
-from shared.langchain_integration.retrievers import OpensearchHybridQueryDocumentRetriever
+from shared.langchain_integration.retrievers import (
+    OpensearchHybridQueryDocumentRetriever,
+    get_doc_expansion_cache,
+    get_prefetched_documents
+)
 from shared.langchain_integration.chains import LLMChain
 from langchain_core.documents import Document
 from shared.utils.monitor_utils import format_rag_data
@@ -109,9 +113,11 @@ def rag_tool(retriever_config: dict, query=None):
     # Add QQ match results
     context_list.extend(state['qq_match_results'])
     figure_list = []
-    retriever_params = retriever_config
-    retriever_params["query"] = query or state[retriever_config.get(
-        "query_key", "query")]
+    # the config is shared by the requests of the same chatbot, do not mutate it
+    retriever_params = {
+        **retriever_config,
+        "query": query or state[retriever_config.get("query_key", "query")],
+    }
     
     # 
     qd_retrievers = [
@@ -127,9 +133,18 @@ def rag_tool(retriever_config: dict, query=None):
     # qd_retriever = OpensearchHybridQueryDocumentRetriever.from_config(
     #     **retriever_params
     # )
-    retrieved_contexts:List[Document] = asyncio.run(
-        qd_retriever.ainvoke(retriever_params["query"])
+    # reuse the knowledge prefetched in intention detection if any
+    retrieved_contexts = get_prefetched_documents(
+        state.get("prefetched_knowledge"),
+        retriever_params["query"],
+        [retriver_config["index_name"] for retriver_config in retriever_config["retrievers"]]
     )
+    if retrieved_contexts is None:
+        retrieved_contexts:List[Document] = asyncio.run(
+            qd_retriever.ainvoke(retriever_params["query"])
+        )
+    else:
+        send_trace("reuse prefetched knowledge", enable_trace=state["enable_trace"])
 
     # output = retrieve_fn(retriever_params)
     # top_k = retriever_config.get("top_k", Threshold.TOP_K_RETRIEVALS)
@@ -160,6 +175,12 @@ def rag_tool(retriever_config: dict, query=None):
     )
     send_trace(
         f"\n\n{context_md}\n\n", enable_trace=state["enable_trace"])
+    doc_expansion_cache = get_doc_expansion_cache()
+    if doc_expansion_cache is not None:
+        send_trace(
+            f"whole doc cache: {doc_expansion_cache.stats}",
+            enable_trace=state["enable_trace"]
+        )
     # send_trace(
     #     f"\n\n**rag-contexts:**\n\n {context_list}", enable_trace=state["enable_trace"])
 
@@ -1,9 +1,12 @@
+import contextvars
 import enum
 import functools
 import importlib
 import json
 import time
 import os
+import traceback
+from concurrent.futures import ThreadPoolExecutor
 from typing import Any, Dict, Optional, Callable, Union
 import threading
 
@@ -19,7 +22,10 @@ from ..exceptions import LambdaInvokeError
 logger = get_logger("lambda_invoke_utils")
 # thread_local = threading.local()
 thread_local = threading.local()
-CURRENT_STATE = None
+# request scoped, so that records of a SQS batch can run concurrently
+CURRENT_STATE = contextvars.ContextVar("current_state", default=None)
+# max records of a SQS batch processed concurrently
+SQS_BATCH_MAX_CONCURRENCY = int(os.environ.get("SQS_BATCH_MAX_CONCURRENCY", 10))
 
 __FUNC_NAME_MAP = {
     "query_preprocess": "Preprocess for Multi-round Conversation",
@@ -41,20 +47,18 @@ class StateContext:
     def get_current_state(cls):
         # print("thread id",threading.get_ident(),'parent id',threading.)
         # state = getattr(thread_local,'state',None)
-        state = CURRENT_STATE
+        state = CURRENT_STATE.get()
         assert state is not None, "There is not a valid state in current context"
         return state
 
     @classmethod
     def set_current_state(cls, state):
-        global CURRENT_STATE
-        assert CURRENT_STATE is None, "Parallel node executions are not alowed"
-        CURRENT_STATE = state
+        assert CURRENT_STATE.get() is None, "Parallel node executions are not alowed"
+        CURRENT_STATE.set(state)
 
     @classmethod
     def clear_state(cls):
-        global CURRENT_STATE
-        CURRENT_STATE = None
+        CURRENT_STATE.set(None)
 
     def __enter__(self):
         self.set_current_state(self.state)
@@ -81,9 +85,9 @@ _lambda_invoke_mode = LAMBDA_INVOKE_MODE.LOCAL.value
 
 _is_current_invoke_local = False
 _current_stream_use = True
-_ws_connection_id = None
-_enable_trace = True
-_is_main_lambda = True
+_ws_connection_id = contextvars.ContextVar("ws_connection_id", default=None)
+_enable_trace = contextvars.ContextVar("enable_trace", default=True)
+_is_main_lambda = contextvars.ContextVar("is_main_lambda", default=True)
 
 
 class LambdaInvoker(BaseModel):
@@ -207,13 +211,122 @@ invoke_with_apigateway = obj.invoke_with_apigateway
 invoke_lambda = obj.invoke_lambda
 
 
+def _run_event(fn, event: dict, context: dict, current_lambda_invoke_mode: str):
+    global _lambda_invoke_mode
+    context["request_timestamp"] = time.time()
+    stream: bool = is_websocket_request(event)
+    context["stream"] = stream
+    if stream:
+        ws_connection_id = event["requestContext"]["connectionId"]
+        context["ws_connection_id"] = ws_connection_id
+        _ws_connection_id.set(ws_connection_id)
+
+    # apigateway wrap event into body
+    if "body" in event:
+        _lambda_invoke_mode = LAMBDA_INVOKE_MODE.LOCAL.value
+        current_lambda_invoke_mode = LAMBDA_INVOKE_MODE.API_GW.value
+        event = json.loads(event["body"])
+
+    # set _enable_trace
+    _is_main_lambda_inner = False  # local valiable to represent main lambda
+    if _is_main_lambda.get():
+        _enable_trace.set(event.get(
+            'chatbot_config', {}).get("enable_trace", True))
+        _is_main_lambda.set(False)  # context valiable to represent main lambda
+        _is_main_lambda_inner = True
+
+    try:
+        # run
+        ret = fn(event, context=context)
+    finally:
+        if _is_main_lambda_inner:
+            _is_main_lambda.set(True)
+    # save response to body
+    # TODO
+    if current_lambda_invoke_mode == LAMBDA_INVOKE_MODE.API_GW.value:
+        ret = {
+            "statusCode": 200,
+            "body": json.dumps(ret),
+            "headers": {"content-type": "application/json"},
+        }
+    return ret
+
+
+def _get_record_group_name(record: dict):
+    try:
+        event = json.loads(record["body"])
+        if "body" in event:
+            event = json.loads(event["body"])
+        return event.get("chatbot_config", {}).get("group_name", "Admin")
+    except Exception:
+        return None
+
+
+def _run_sqs_records(fn, records: list, context: dict):
+    """
+    Run the records of a SQS batch concurrently, each one in its own
+    context, and report the failed records in batchItemFailures. A record
+    fails when fn raises or returns an "error", as the main lambda handler
+    reports its errors to the client and returns them instead of raising.
+    """
+    def run_record(record):
+        event = json.loads(record["body"])
+        ret = _run_event(
+            fn, event, dict(context), LAMBDA_INVOKE_MODE.API_GW.value
+        )
+        body = json.loads(ret["body"])
+        if isinstance(body, dict) and body.get("error"):
+            raise RuntimeError(body["error"])
+        return ret
+
+    if len(records) == 1:
+        # keep the whole invocation failing, so that the message is retried
+        # even without ReportBatchItemFailures
+        run_record(records[0])
+        return {"batchItemFailures": []}
+
+    # the main lambda exports the group name of a request as GROUP_NAME
+    # environment variable, so only records of the same group run together
+    record_groups = {}
+    for record in records:
+        record_groups.setdefault(
+            _get_record_group_name(record), []).append(record)
+
+    batch_item_failures = []
+    for group_records in record_groups.values():
+        with ThreadPoolExecutor(
+            max_workers=min(len(group_records), SQS_BATCH_MAX_CONCURRENCY)
+        ) as executor:
+            futures = [
+                (
+                    record,
+                    executor.submit(
+                        contextvars.copy_context().run, run_record, record
+                    ),
+                )
+                for record in group_records
+            ]
+            for record, future in futures:
+                try:
+                    future.result()
+                except Exception:
+                    logger.error(
+                        f"Failed to process record {record['messageId']}\n"
+                        f"{traceback.format_exc()}"
+                    )
+                    batch_item_failures.append(
+                        {"itemIdentifier": record["messageId"]}
+                    )
+    return {"batchItemFailures": batch_item_failures}
+
+
 def chatbot_lambda_call_wrapper(fn):
     """
     A decorator to monitor the execution of a lambda function.
     """
     @functools.wraps(fn)
     def inner(event: dict, context=None):
-        global _lambda_invoke_mode, _is_current_invoke_local, _enable_trace, _ws_connection_id, _is_main_lambda
+        global _lambda_invoke_mode, _is_current_invoke_local
         _is_current_invoke_local = True if context is None else False
         current_lambda_invoke_mode = LAMBDA_INVOKE_MODE.LOCAL.value
         # avoid recursive lambda calling
@@ -221,50 +334,12 @@ def chatbot_lambda_call_wrapper(fn):
             context = context.__dict__
             _lambda_invoke_mode = LAMBDA_INVOKE_MODE.LOCAL.value
 
-        if "Records" in event:
-            records = event["Records"]
-            assert len(records) == 1, "Please set sqs batch size to 1"
-            event = json.loads(records[0]["body"])
-            _lambda_invoke_mode = LAMBDA_INVOKE_MODE.LOCAL.value
-            current_lambda_invoke_mode = LAMBDA_INVOKE_MODE.API_GW.value
-
         context = context or {}
-        context["request_timestamp"] = time.time()
-        stream: bool = is_websocket_request(event)
-        context["stream"] = stream
-        if stream:
-            ws_connection_id = event["requestContext"]["connectionId"]
-            context["ws_connection_id"] = ws_connection_id
-            _ws_connection_id = ws_connection_id
-
-        # apigateway wrap event into body
-        if "body" in event:
+        if "Records" in event:
             _lambda_invoke_mode = LAMBDA_INVOKE_MODE.LOCAL.value
-            current_lambda_invoke_mode = LAMBDA_INVOKE_MODE.API_GW.value
-            event = json.loads(event["body"])
-
-        # set _enable_trace
-        _is_main_lambda_inner = False  # local valiable to represent main lambda
-        if _is_main_lambda:
-            _enable_trace = event.get(
-                'chatbot_config', {}).get("enable_trace", True)
-            _is_main_lambda = False  # global valiable to represent main lambda
-            _is_main_lambda_inner = True
+            return _run_sqs_records(fn, event["Records"], context)
 
-        # run
-        ret = fn(event, context=context)
-        # save response to body
-        # TODO
-        if current_lambda_invoke_mode == LAMBDA_INVOKE_MODE.API_GW.value:
-            ret = {
-                "statusCode": 200,
-                "body": json.dumps(ret),
-                "headers": {"content-type": "application/json"},
-            }
-
-        if _is_main_lambda_inner:
-            _is_main_lambda = True
-        return ret
+        return _run_event(fn, event, context, current_lambda_invoke_mode)
     return inner
 
 
@@ -285,10 +360,10 @@ def send_trace(
         current_stream_use = _current_stream_use
 
     if enable_trace is None:
-        enable_trace = _enable_trace
+        enable_trace = _enable_trace.get()
 
     if ws_connection_id is None:
-        ws_connection_id = _ws_connection_id
+        ws_connection_id = _ws_connection_id.get()
 
     if enable_trace:
         if current_stream_use and ws_connection_id is not None:
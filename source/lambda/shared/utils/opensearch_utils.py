@@ -0,0 +1,96 @@
+"""
+Helpers to delete OpenSearch documents in bulk
+"""
+import os
+import time
+
+from shared.utils.logger_utils import get_logger
+
+logger = get_logger(__name__)
+
+# initial and max interval between two polls of a delete_by_query task, in seconds
+DELETE_TASK_POLL_INTERVAL = 0.5
+DELETE_TASK_MAX_POLL_INTERVAL = 10
+# max time to wait for a delete_by_query task, in seconds
+DELETE_TASK_TIMEOUT = int(os.environ.get("AOS_DELETE_TASK_TIMEOUT", 900))
+
+
+def _get_delete_counts(status: dict) -> dict:
+    return {
+        "total": status.get("total", 0),
+        "deleted": status.get("deleted", 0),
+        "version_conflicts": status.get("version_conflicts", 0),
+        "failed": len(status.get("failures", [])),
+    }
+
+
+def delete_documents_by_query(
+    client, index_name: str, query: dict, timeout: int = DELETE_TASK_TIMEOUT
+) -> dict:
+    """
+    Delete all documents of index_name matching query.
+
+    The deletion runs as a delete_by_query task on the cluster, sliced
+    across shards, so there is no limit on the number of matching documents
+    and no round trip per document. The task is polled with a growing
+    interval until it completes or timeout expires.
+
+    Args:
+        client: OpenSearch client
+        index_name (str): index to delete the documents from
+        query (dict): query of the documents to delete
+        timeout (int): max time to wait for the task, in seconds
+
+    Returns:
+        dict: total, deleted, version_conflicts and failed counts, and whether
+            the task completed
+    """
+    if not client.indices.exists(index=index_name):
+        logger.info("Index %s does not exist, skipping deletion", index_name)
+        return {**_get_delete_counts({}), "completed": True}
+
+    response = client.delete_by_query(
+        index=index_name,
+        body={"query": query},
+        conflicts="proceed",
+        refresh=True,
+        slices="auto",
+        wait_for_completion=False,
+    )
+    task_id = response["task"]
+
+    deadline = time.time() + timeout
+    poll_interval = DELETE_TASK_POLL_INTERVAL
+    while True:
+        task = client.tasks.get(task_id=task_id)
+        if task.get("completed"):
+            if task.get("error"):
+                logger.error(
+                    "Delete task %s on %s failed: %s",
+                    task_id,
+                    index_name,
+                    task["error"],
+                )
+            result = {
+                **_get_delete_counts(task.get("response", {})),
+                "completed": True,
+            }
+            break
+        if time.time() >= deadline:
+            logger.warning(
+                "Delete task %s on %s is still running after %d seconds",
+                task_id,
+                index_name,
+                timeout,
+            )
+            result = {
+                **_get_delete_counts(task.get("task", {}).get("status", {})),
+                "completed": False,
+            }
+            break
+        # do not sleep past the deadline
+        time.sleep(min(poll_interval, max(0, deadline - time.time())))
+        poll_interval = min(poll_interval * 2, DELETE_TASK_MAX_POLL_INTERVAL)
+
+    logger.info("Deleted documents from %s: %s", index_name, result)
+    return result
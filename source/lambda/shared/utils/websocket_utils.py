@@ -1,5 +1,6 @@
 import json
 import os
+import threading
 import time
 
 import boto3
@@ -11,6 +12,11 @@ logger = get_logger("websocket_utils")
 
 ws_client = None
 stop_signals_table_name = os.environ.get("STOP_SIGNALS_TABLE_NAME", "")
+ws_frame_max_bytes = int(os.environ.get("WS_FRAME_MAX_BYTES", 4096))
+ws_frame_interval = int(os.environ.get("WS_FRAME_INTERVAL_MS", 30)) / 1000
+stop_signal_check_interval = (
+    int(os.environ.get("STOP_SIGNAL_CHECK_INTERVAL_MS", 500)) / 1000
+)
 
 
 class JSONEncoder(json.JSONEncoder):
@@ -111,3 +117,132 @@ def check_stop_signal(connection_id: str) -> bool:
 
 def clear_stop_signal(connection_id: str) -> None:
     stop_signal_manager.clear_stop_signal(connection_id)
+
+
+class WebSocketChunkSender:
+    """
+    Coalesce streamed chunks into frames and post them from a background
+    thread, so that model decoding is never blocked on API Gateway.
+
+    A frame is posted when its buffered content reaches `max_frame_bytes`,
+    or when `frame_interval` seconds have passed since the previous frame.
+    Frames are numbered with consecutive chunk_id from 0, so the order
+    expected by the frontend is kept. The stop signal is read from DynamoDB
+    at most once every `stop_signal_check_interval` seconds.
+    """
+
+    def __init__(
+        self,
+        ws_connection_id: str,
+        message_id: str,
+        custom_message_id: str,
+        message_type: str = "CHUNK",
+        max_frame_bytes: int = ws_frame_max_bytes,
+        frame_interval: float = ws_frame_interval,
+        stop_signal_check_interval: float = stop_signal_check_interval,
+    ):
+        self.ws_connection_id = ws_connection_id
+        self.message_id = message_id
+        self.custom_message_id = custom_message_id
+        self.message_type = message_type
+        self.max_frame_bytes = max_frame_bytes
+        self.frame_interval = frame_interval
+        self.stop_signal_check_interval = stop_signal_check_interval
+
+        self.buffer = []
+        self.buffer_bytes = 0
+        self.closed = False
+        self.error = None
+        self.condition = threading.Condition()
+        self.last_frame_time = time.time()
+        self.last_stop_signal_check_time = None
+        self.stopped = False
+        self.stats = {
+            "chunks": 0,
+            "frames_sent": 0,
+            "stop_signal_reads": 0,
+            "stop_signal_reads_avoided": 0,
+        }
+        self.thread = threading.Thread(target=self._run, daemon=True)
+        self.thread.start()
+
+    def is_stopped(self) -> bool:
+        """Check the stop signal, reading DynamoDB on a fixed interval"""
+        now = time.time()
+        if (
+            self.last_stop_signal_check_time is None
+            or now - self.last_stop_signal_check_time
+            >= self.stop_signal_check_interval
+        ):
+            self.stopped = check_stop_signal(self.ws_connection_id)
+            self.last_stop_signal_check_time = now
+            self.stats["stop_signal_reads"] += 1
+        else:
+            self.stats["stop_signal_reads_avoided"] += 1
+        return self.stopped
+
+    def add_chunk(self, chunk: str) -> None:
+        if self.error is not None:
+            raise self.error
+        with self.condition:
+            self.buffer.append(chunk)
+            self.buffer_bytes += len(chunk.encode("utf-8"))
+            self.stats["chunks"] += 1
+            if self.buffer_bytes >= self.max_frame_bytes:
+                self.condition.notify()
+
+    def _pop_frame(self):
+        content = "".join(self.buffer)
+        self.buffer = []
+        self.buffer_bytes = 0
+        return content
+
+    def _run(self):
+        while True:
+            with self.condition:
+                while not self.closed and not (
+                    self.buffer
+                    and (
+                        self.buffer_bytes >= self.max_frame_bytes
+                        or time.time() - self.last_frame_time
+                        >= self.frame_interval
+                    )
+                ):
+                    self.condition.wait(timeout=self.frame_interval)
+                if not self.buffer:
+                    # closed with nothing left to send
+                    return
+                content = self._pop_frame()
+                self.last_frame_time = time.time()
+            try:
+                send_to_ws_client(
+                    message={
+                        "message_type": self.message_type,
+                        "message_id": self.message_id,
+                        "custom_message_id": self.custom_message_id,
+                        "message": {
+                            "role": "assistant",
+                            "content": content,
+                        },
+                        "chunk_id": self.stats["frames_sent"],
+                    },
+                    ws_connection_id=self.ws_connection_id,
+                )
+                self.stats["frames_sent"] += 1
+            except Exception as e:
+                self.error = e
+                return
+
+    def close(self) -> dict:
+        """Send the remaining chunks and wait for the sender thread"""
+        with self.condition:
+            if self.closed:
+                return self.stats
+            self.closed = True
+            self.condition.notify()
+        self.thread.join()
+        logger.info(f"websocket chunk sender stats: {self.stats}")
+        if self.error is not None:
+            raise self.error
+        return self.stats
+
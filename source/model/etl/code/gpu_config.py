@@ -1,4 +1,11 @@
+import os
+
 import GPUtil
+import onnxruntime
+
+# Pages of a document predicted in parallel by structure_predict. The
+# workers share the ONNX sessions and split their intra op threads.
+PAGE_WORKERS = max(1, int(os.environ.get("PAGE_WORKERS", 1)))
 
 def get_provider_config():
     if len(GPUtil.getGPUs()):
@@ -7,7 +14,24 @@ def get_provider_config():
         layout_model = 'layout.onnx'
     else:
         provider = ["CPUExecutionProvider"]
-        rec_batch_num = 1
+        # crops are grouped by width ratio on CPU, see TextRecognizer
+        rec_batch_num = 16
         layout_model = 'layout_s.onnx'
     
-    return provider, rec_batch_num, layout_model 
\ No newline at end of file
+    return provider, rec_batch_num, layout_model 
+
+def get_intra_op_num_threads(intra_op_num_threads=0):
+    """
+    Intra op threads of a session shared by the page workers. 0, the
+    onnxruntime default, stands for one thread per core.
+    """
+    if PAGE_WORKERS == 1:
+        return intra_op_num_threads
+    if intra_op_num_threads == 0:
+        intra_op_num_threads = os.cpu_count() or 1
+    return max(1, intra_op_num_threads // PAGE_WORKERS)
+
+def get_shared_session_options():
+    sess_options = onnxruntime.SessionOptions()
+    sess_options.intra_op_num_threads = get_intra_op_num_threads()
+    return sess_options
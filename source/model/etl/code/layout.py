@@ -20,14 +20,14 @@ import time
 from imaug import preprocess
 from postprocess import multiclass_nms, postprocess
 import onnxruntime
-from gpu_config import get_provider_config
+from gpu_config import get_provider_config, get_shared_session_options
 from model_config import LAYOUT_CONFIG
 
 provider, _, layout_model = get_provider_config()
 
 class LayoutPredictor(object):
     def __init__(self):
-        self.ort_session = onnxruntime.InferenceSession(os.path.join(os.environ['MODEL_PATH'], layout_model), providers=provider)
+        self.ort_session = onnxruntime.InferenceSession(os.path.join(os.environ['MODEL_PATH'], layout_model), providers=provider, sess_options=get_shared_session_options())
         self.categorys = LAYOUT_CONFIG['categories']
         self.nms_thr = LAYOUT_CONFIG['nms_threshold']
         self.score_thr = LAYOUT_CONFIG['score_threshold']
@@ -4,6 +4,7 @@ import logging
 import os
 import re
 import time
+from collections import deque
 from concurrent.futures import ThreadPoolExecutor, as_completed
 from pathlib import Path
 
@@ -11,12 +12,13 @@ import boto3
 import cv2
 import numpy as np
 from figure_llm import figureUnderstand
+from gpu_config import PAGE_WORKERS
 from layout import LayoutPredictor
 from markdownify import markdownify as md
 from ocr import TextSystem
 from PIL import Image
 from table import TableSystem
-from utils import check_and_read
+from utils import check_and_read, prefetch
 from xycut import recursive_xy_cut
 
 logging.basicConfig(level=logging.INFO)
@@ -25,6 +27,14 @@ logger = logging.getLogger(__name__)
 MIN_TEXT_COUNT = 2  # 最小文本行数量阈值
 MAX_SCALE = 4.0  # 最大放大倍数
 MAX_PIXELS = 2000 * 3000  # 最大像素数
+# auto_dpi 策略: "single" 只在 AUTO_DPI_SINGLE_SCALE 下检测一次来估计文本行高度,
+# "multi" 在 AUTO_DPI_MULTI_SCALES 的每个尺度下检测并取最大的放大倍数
+AUTO_DPI_MODE = os.environ.get("AUTO_DPI_MODE", "multi")
+AUTO_DPI_SINGLE_SCALE = 0.5
+# "single" 估计的放大倍数超过该值时, 文本行在 AUTO_DPI_SINGLE_SCALE 下只有几个像素高,
+# 检测不可靠, 改用 AUTO_DPI_MULTI_SCALES 重新估计
+AUTO_DPI_SINGLE_FALLBACK_SCALE = 1.5
+AUTO_DPI_MULTI_SCALES = [1, 0.66, 0.33]
 
 class StructureSystem(object):
     def __init__(self):
@@ -38,6 +48,79 @@ class StructureSystem(object):
             self.text_system.text_detector, self.text_system.text_recognizer
         )
 
+    def estimate_scale(self, img, lang, scale_base, scale_floor=True):
+        """
+        Detects text on the image resized by scale_base and returns the scale
+        which brings the short text lines to the height limit, or None if too
+        few text lines are found.
+
+        The text line heights are measured on the resized image, so with
+        scale_floor the height floor, which caps the scale at MAX_SCALE, is
+        resized too. The three-scale search keeps the floor unscaled, as it
+        always did.
+        """
+        height_limit = 18 if lang == "ch" else 15
+        original_h, original_w = img.shape[:2]
+        img_cur_scale = cv2.resize(
+            img, (None, None), fx=scale_base, fy=scale_base
+        )
+        temp_result = self.text_system.text_detector[lang](
+            img_cur_scale, scale=1
+        )
+        # 确保有足够的文本行
+        if len(temp_result) < MIN_TEXT_COUNT:
+            return None
+
+        height_list = [
+            max(text_line[:, 1]) - min(text_line[:, 1])
+            for text_line in temp_result
+        ]
+        height_list.sort()
+        # 使用95%分位数而不是中位数
+        percentile_95_idx = int(len(height_list) * 0.05)
+        # 限制最大缩放比例
+        min_height = height_limit / MAX_SCALE
+        if scale_floor:
+            min_height *= scale_base
+        min_text_line_h = max(
+            height_list[percentile_95_idx],  # 取文本行高度的一半作为下限，避免异常值影响
+            min_height
+        )
+        # 计算初始缩放比例
+        scale = min((height_limit / min_text_line_h) * scale_base, MAX_SCALE)
+
+        # 检查放大后的总像素数是否超过限制
+        scaled_pixels = int(original_h * scale) * int(original_w * scale)
+        if scaled_pixels > MAX_PIXELS:
+            # 如果超过限制，调整缩放比例
+            max_allowed_scale = np.sqrt(MAX_PIXELS / (original_h * original_w))
+            scale = min(scale, max_allowed_scale)
+        return scale
+
+    def get_auto_dpi_scale(self, img, lang, mode=None):
+        """
+        Returns the scale of the text detection of the page, 0 if no scale
+        could be estimated.
+
+        The "single" mode runs one low resolution detection, and falls back
+        to the "multi" mode when it finds too few text lines or text close to
+        the height floor, i.e. the small text which needs upscaling most. The
+        "multi" mode runs a detection at each of AUTO_DPI_MULTI_SCALES and
+        keeps the largest scale.
+        """
+        mode = mode or AUTO_DPI_MODE
+        if mode == "single":
+            scale = self.estimate_scale(img, lang, AUTO_DPI_SINGLE_SCALE)
+            if scale is not None and scale <= AUTO_DPI_SINGLE_FALLBACK_SCALE:
+                return scale
+            return self.get_auto_dpi_scale(img, lang, "multi")
+        final_s = 0
+        for scale_base in AUTO_DPI_MULTI_SCALES:
+            scale = self.estimate_scale(img, lang, scale_base, scale_floor=False)
+            if scale is not None and scale > final_s:
+                final_s = scale
+        return final_s
+
     def __call__(
         self, img, return_ocr_result_in_table=False, lang="ch", auto_dpi=False
     ):
@@ -59,44 +142,7 @@ class StructureSystem(object):
         layout_res, elapse = self.layout_predictor(img)
         final_s = None
         if auto_dpi:
-            final_s = 0
-            height_limit = 18 if lang == "ch" else 15
-            original_h, original_w = img.shape[:2]
-
-            for scale_base in [1, 0.66, 0.33]:
-                img_cur_scale = cv2.resize(
-                    img, (None, None), fx=scale_base, fy=scale_base
-                )
-                temp_result = self.text_system.text_detector[lang](
-                    img_cur_scale, scale=1
-                )
-                # 确保有足够的文本行
-                if len(temp_result) < MIN_TEXT_COUNT:
-                    continue
-                    
-                height_list = [
-                    max(text_line[:, 1]) - min(text_line[:, 1])
-                    for text_line in temp_result
-                ]
-                height_list.sort()
-                # 使用95%分位数而不是中位数
-                percentile_95_idx = int(len(height_list) * 0.05)
-                min_text_line_h = max(
-                    height_list[percentile_95_idx],  # 取文本行高度的一半作为下限，避免异常值影响
-                    height_limit / MAX_SCALE  # 限制最大缩放比例
-                )
-                # 计算初始缩放比例
-                scale = min((height_limit / min_text_line_h) * scale_base, MAX_SCALE)
-                
-                # 检查放大后的总像素数是否超过限制
-                scaled_pixels = int(original_h * scale) * int(original_w * scale)
-                if scaled_pixels > MAX_PIXELS:
-                    # 如果超过限制，调整缩放比例
-                    max_allowed_scale = np.sqrt(MAX_PIXELS / (original_h * original_w))
-                    scale = min(scale, max_allowed_scale)
-                
-                if scale > final_s:
-                    final_s = scale
+            final_s = self.get_auto_dpi_scale(img, lang)
 
         time_dict["layout"] += elapse
         res_list = []
@@ -245,6 +291,45 @@ def process_figure(figure_data, doc, figure_idx, figure_understand):
     )
 
 
+def predict_page(img, lang: str, auto_dpi) -> list:
+    """
+    Runs the structure engine on a page and returns its regions in reading order.
+    """
+    result, _ = structure_engine(img, lang=lang, auto_dpi=auto_dpi)
+    if result == []:
+        return []
+    boxes = [row["bbox"] for row in result]
+    res = []
+    recursive_xy_cut(np.asarray(boxes).astype(int), np.arange(len(boxes)), res)
+    result_sorted = [result[idx] for idx in res]
+    for region in result_sorted:
+        # region images are views of the page, only keep a copy of the figures
+        # so that the page can be freed once it is predicted
+        region["img"] = region["img"].copy() if region["type"] == "figure" else None
+    return result_sorted
+
+
+def iter_page_results(pages, lang: str, auto_dpi):
+    """
+    Predicts the pages with PAGE_WORKERS threads sharing the structure engine
+    and yields the results in page order.
+
+    At most 2 * PAGE_WORKERS pages are read ahead of the page being yielded.
+    """
+    if PAGE_WORKERS == 1:
+        for img in pages:
+            yield predict_page(img, lang, auto_dpi)
+        return
+    with ThreadPoolExecutor(max_workers=PAGE_WORKERS) as executor:
+        futures = deque()
+        for img in pages:
+            futures.append(executor.submit(predict_page, img, lang, auto_dpi))
+            if len(futures) >= 2 * PAGE_WORKERS:
+                yield futures.popleft().result()
+        while futures:
+            yield futures.popleft().result()
+
+
 def structure_predict(
     file_path: Path, lang: str, auto_dpi, figure_rec, figure_understand
 ) -> str:
@@ -259,16 +344,11 @@ def structure_predict(
     """
 
     all_res = []
-    for index, img in enumerate(check_and_read(file_path)):
-        result, _ = structure_engine(img, lang=lang, auto_dpi=auto_dpi)
-        if result != []:
-            boxes = [row["bbox"] for row in result]
-            res = []
-            recursive_xy_cut(
-                np.asarray(boxes).astype(int), np.arange(len(boxes)), res
-            )
-            result_sorted = [result[idx] for idx in res]
-            all_res += result_sorted
+    # pages are rendered in the background while the previous ones are predicted
+    for result_sorted in iter_page_results(
+        prefetch(check_and_read(file_path)), lang, auto_dpi
+    ):
+        all_res += result_sorted
     doc = ""
     prev_region_text = ""
     figure = {}
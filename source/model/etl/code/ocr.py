@@ -9,10 +9,16 @@ from PIL import Image, ImageDraw
 import cv2
 from imaug import create_operators, transform
 from postprocess import build_post_process
-from gpu_config import get_provider_config
+from gpu_config import get_provider_config, get_shared_session_options
 from model_config import MODEL_CONFIGS
 
 provider, rec_batch_num, _ = get_provider_config()
+use_gpu = provider[0] != "CPUExecutionProvider"
+
+# On CPU, a recognition batch is closed before its zero padding exceeds
+# this share of the batch tensor, so that long lines do not widen a batch
+# of short ones. With a GPU the batches keep a fixed size.
+REC_CPU_MAX_PADDING_RATIO = float(os.environ.get("REC_CPU_MAX_PADDING_RATIO", 0.25))
 
 class TextClassifier():
     def __init__(self):
@@ -28,7 +34,7 @@ class TextClassifier():
         }
         self.postprocess_op = build_post_process(postprocess_params)
 
-        self.ort_session = onnxruntime.InferenceSession(self.weights_path, providers=provider)
+        self.ort_session = onnxruntime.InferenceSession(self.weights_path, providers=provider, sess_options=get_shared_session_options())
 
     def resize_norm_img(self, img):
         imgC, imgH, imgW = self.cls_image_shape
@@ -107,7 +113,7 @@ class TextDetector():
         self.preprocess_op = create_operators(pre_process_list)
         self.preprocess_op_identity = create_operators(pre_process_list_identity)
         self.postprocess_op = build_post_process(postprocess_params)
-        self.ort_session = onnxruntime.InferenceSession(self.weights_path, providers=provider)
+        self.ort_session = onnxruntime.InferenceSession(self.weights_path, providers=provider, sess_options=get_shared_session_options())
         _ = self.ort_session.run(None, {"x": np.zeros([1, 3, 64, 64], dtype='float32')})
 
     # load_pytorch_weights
@@ -213,11 +219,12 @@ class TextRecognizer():
 
         self.rec_image_shape = [3, 48, 480]
         self.rec_batch_num = rec_batch_num
+        self.max_padding_ratio = None if use_gpu else REC_CPU_MAX_PADDING_RATIO
         self.rec_algorithm = 'CRNN'
         self.use_zero_copy_run = False
 
         self.postprocess_op = build_post_process(postprocess_params)
-        self.ort_session = onnxruntime.InferenceSession(self.weights_path, providers=provider)
+        self.ort_session = onnxruntime.InferenceSession(self.weights_path, providers=provider, sess_options=get_shared_session_options())
 
     def resize_norm_img(self, img, max_wh_ratio):
         imgC, imgH, imgW = self.rec_image_shape
@@ -245,6 +252,41 @@ class TextRecognizer():
         padding_im[:, :, 0:resized_w] = resized_image
         return padding_im
 
+    def get_batches(self, width_list, indices):
+        """
+        Group the crops, sorted by width ratio, into batches.
+
+        Without a padding cap the batches have rec_batch_num crops. With
+        max_padding_ratio set, a batch is also closed when adding the next,
+        wider crop would make the padding exceed that share of the batch
+        tensor, whose width is set by its widest crop. Each crop is counted
+        with the width it is padded to when run alone, so only the padding
+        added by batching is capped.
+        """
+        img_num = len(indices)
+        if self.max_padding_ratio is None:
+            return [
+                indices[beg_img_no:min(img_num, beg_img_no + self.rec_batch_num)]
+                for beg_img_no in range(0, img_num, self.rec_batch_num)
+            ]
+        batches = []
+        batch = []
+        batch_width = 0
+        for ino in indices:
+            wh_ratio = math.ceil(width_list[ino])
+            if batch:
+                padded_width = wh_ratio * (len(batch) + 1)
+                padding = 1 - (batch_width + wh_ratio) / padded_width
+                if len(batch) >= self.rec_batch_num or padding > self.max_padding_ratio:
+                    batches.append(batch)
+                    batch = []
+                    batch_width = 0
+            batch.append(ino)
+            batch_width += wh_ratio
+        if batch:
+            batches.append(batch)
+        return batches
+
     def __call__(self, img_list):
         img_num = len(img_list)
         # Calculate the aspect ratio of all text bars
@@ -256,21 +298,16 @@ class TextRecognizer():
 
         # rec_res = []
         rec_res = [['', 0.0]] * img_num
-        batch_num = self.rec_batch_num
-        for beg_img_no in range(0, img_num, batch_num):
-            end_img_no = min(img_num, beg_img_no + batch_num)
+        for batch in self.get_batches(width_list, indices):
             norm_img_batch = []
             max_wh_ratio = 0
-            for ino in range(beg_img_no, end_img_no):
-                # h, w = img_list[ino].shape[0:2]
-                h, w = img_list[indices[ino]].shape[0:2]
+            for ino in batch:
+                h, w = img_list[ino].shape[0:2]
                 wh_ratio = w * 1.0 / h
                 max_wh_ratio = max(max_wh_ratio, wh_ratio)
             max_wh_ratio = math.ceil(max_wh_ratio)
-            for ino in range(beg_img_no, end_img_no):
-                # norm_img = self.resize_norm_img(img_list[ino], max_wh_ratio)
-                norm_img = self.resize_norm_img(img_list[indices[ino]],
-                                                max_wh_ratio)
+            for ino in batch:
+                norm_img = self.resize_norm_img(img_list[ino], max_wh_ratio)
                 norm_img = norm_img[np.newaxis, :]
                 norm_img_batch.append(norm_img)
             norm_img_batch = np.concatenate(norm_img_batch)
@@ -281,7 +318,7 @@ class TextRecognizer():
             preds = self.ort_session.run(None, ort_inputs)[0]
             rec_result = self.postprocess_op(preds)
             for rno in range(len(rec_result)):
-                rec_res[indices[beg_img_no + rno]] = rec_result[rno]
+                rec_res[batch[rno]] = rec_result[rno]
         return rec_res
 def sorted_boxes(dt_boxes):
     """
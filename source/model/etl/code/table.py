@@ -7,12 +7,13 @@ from imaug import create_operators, transform
 import numpy as np
 import os
 import onnxruntime as ort
+from gpu_config import get_intra_op_num_threads
 from model_config import TABLE_CONFIG
 
 def get_session_options():
     sess_options = ort.SessionOptions()
     config = TABLE_CONFIG['model']['session_options']
-    sess_options.intra_op_num_threads = config['intra_op_num_threads']
+    sess_options.intra_op_num_threads = get_intra_op_num_threads(config['intra_op_num_threads'])
     sess_options.execution_mode = getattr(ort.ExecutionMode, config['execution_mode'])
     sess_options.graph_optimization_level = getattr(ort.GraphOptimizationLevel, config['optimization_level'])
     return sess_options
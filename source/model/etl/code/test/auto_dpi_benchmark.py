@@ -0,0 +1,83 @@
+"""
+Benchmark of the auto_dpi strategies of StructureSystem.
+
+For every page, the detection scale is estimated with the three-scale search
+("multi") and with a single low resolution detection ("single"), which falls
+back to the three-scale search on small text. Reports the time per page of
+the estimation and of the whole page, the number of fallbacks, the relative
+difference of the chosen scales, and the similarity of the recognized text.
+
+Needs the ETL models. Run from source/model/etl/code:
+    MODEL_PATH=/opt/ml/model python test/auto_dpi_benchmark.py PDF_OR_IMAGE [...]
+"""
+import difflib
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+
+import main
+from utils import check_and_read
+
+LANG = "ch"
+MODES = ("multi", "single")
+
+
+def get_page_text(result) -> str:
+    return "\n".join(
+        line["text"]
+        for region in result
+        if region["type"] != "table"
+        for line in region["res"]
+    )
+
+
+if __name__ == "__main__":
+    pages = [page for file_path in sys.argv[1:] for page in check_and_read(file_path)]
+    if not pages:
+        sys.exit(__doc__)
+    engine = main.structure_engine
+    estimate_time = {mode: 0.0 for mode in MODES}
+    page_time = {mode: 0.0 for mode in MODES}
+    scale_diffs = []
+    similarities = []
+    fallbacks = 0
+    for page in pages:
+        single_scale = engine.estimate_scale(page, LANG, main.AUTO_DPI_SINGLE_SCALE)
+        if single_scale is None or single_scale > main.AUTO_DPI_SINGLE_FALLBACK_SCALE:
+            fallbacks += 1
+        scales = {}
+        texts = {}
+        for mode in MODES:
+            start = time.perf_counter()
+            scales[mode] = engine.get_auto_dpi_scale(page, LANG, mode)
+            estimate_time[mode] += time.perf_counter() - start
+
+            main.AUTO_DPI_MODE = mode
+            start = time.perf_counter()
+            result, _ = engine(page, lang=LANG, auto_dpi=True)
+            page_time[mode] += time.perf_counter() - start
+            texts[mode] = get_page_text(result)
+        if scales["multi"]:
+            scale_diffs.append(abs(scales["single"] - scales["multi"]) / scales["multi"])
+        similarities.append(
+            difflib.SequenceMatcher(None, texts["multi"], texts["single"]).ratio()
+        )
+
+    print(f"{len(pages)} pages, single fell back to multi on {fallbacks}")
+    for mode in MODES:
+        print(
+            f"{mode:>6}: estimation {estimate_time[mode] / len(pages) * 1000:.0f} ms/page, "
+            f"page {page_time[mode] / len(pages) * 1000:.0f} ms/page"
+        )
+    if scale_diffs:
+        print(
+            f"scale difference: mean {sum(scale_diffs) / len(scale_diffs):.1%}, "
+            f"max {max(scale_diffs):.1%}"
+        )
+    print(
+        f"text similarity: mean {sum(similarities) / len(similarities):.3f}, "
+        f"min {min(similarities):.3f}, identical on "
+        f"{sum(s == 1 for s in similarities)}/{len(similarities)} pages"
+    )
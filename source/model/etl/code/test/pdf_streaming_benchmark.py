@@ -0,0 +1,103 @@
+"""
+Benchmark of PDF page rendering feeding the page inference.
+
+Compares rendering all pages into a list before the inference starts, and
+rendering each page between the inferences, with the streaming path used by
+structure_predict, i.e. check_and_read behind a bounded prefetch queue. The
+inference is replaced by a stub which sleeps for a fixed latency per page,
+so the benchmark runs without the models. Each mode runs in its own process
+and reports peak RSS, time to first page and total time.
+
+Needs PyMuPDF. Run from source/model/etl/code:
+    python test/pdf_streaming_benchmark.py [PDF]
+A synthetic 100-page PDF is written when no file is given.
+"""
+import json
+import os
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+
+from utils import check_and_read, prefetch
+
+N_SYNTHETIC_PAGES = 100
+INFERENCE_LATENCY = 0.05
+MODES = ("list", "generator", "streaming")
+
+
+def write_synthetic_pdf(pdf_path: str):
+    import fitz
+
+    with fitz.open() as pdf:
+        for page_no in range(N_SYNTHETIC_PAGES):
+            page = pdf.new_page()
+            for line_no in range(45):
+                page.insert_text(
+                    (72, 72 + line_no * 15),
+                    f"Line {line_no} of page {page_no + 1}: the quick brown fox jumps over the lazy dog",
+                    fontsize=10,
+                )
+        pdf.save(pdf_path)
+
+
+def predict_stub(page) -> int:
+    time.sleep(INFERENCE_LATENCY)
+    return page.shape[0]
+
+
+def run_mode(mode: str, pdf_path: str):
+    start = time.perf_counter()
+    if mode == "list":
+        pages = list(check_and_read(pdf_path))
+    elif mode == "generator":
+        pages = check_and_read(pdf_path)
+    else:
+        pages = prefetch(check_and_read(pdf_path))
+    first_page_time = None
+    n_pages = 0
+    for page in pages:
+        if first_page_time is None:
+            first_page_time = time.perf_counter() - start
+        predict_stub(page)
+        n_pages += 1
+    print(json.dumps({
+        "pages": n_pages,
+        "first_page": first_page_time,
+        "total": time.perf_counter() - start,
+        # kilobytes on Linux
+        "peak_rss_mb": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024,
+    }))
+
+
+def bench(mode: str, pdf_path: str) -> dict:
+    output = subprocess.run(
+        [sys.executable, __file__, "--mode", mode, pdf_path],
+        check=True,
+        capture_output=True,
+        text=True,
+    ).stdout
+    return json.loads(output.strip().splitlines()[-1])
+
+
+if __name__ == "__main__":
+    if sys.argv[1:2] == ["--mode"]:
+        run_mode(sys.argv[2], sys.argv[3])
+        sys.exit(0)
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        if len(sys.argv) > 1:
+            pdf_path = sys.argv[1]
+        else:
+            pdf_path = os.path.join(tmp_dir, "synthetic.pdf")
+            write_synthetic_pdf(pdf_path)
+
+        for mode in MODES:
+            result = bench(mode, pdf_path)
+            print(
+                f"{mode:>9}: {result['pages']} pages, peak RSS {result['peak_rss_mb']:.0f} MB, "
+                f"first page {result['first_page']:.2f} s, total {result['total']:.1f} s"
+            )
@@ -0,0 +1,92 @@
+"""
+Throughput benchmark of structure_predict with page workers.
+
+structure_predict runs once per PAGE_WORKERS value, each run in its own
+process since the ONNX sessions split their threads between the workers
+when they are created. Reports pages/sec and checks that the document is
+identical to the one of a single worker.
+
+Needs the ETL models and PyMuPDF. Run from source/model/etl/code:
+    MODEL_PATH=/opt/ml/model python test/structure_predict_benchmark.py [PDF]
+A synthetic multi-page PDF is written when no file is given.
+"""
+import hashlib
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+
+N_SYNTHETIC_PAGES = 20
+WORKER_COUNTS = (1, 2, 4)
+
+
+def write_synthetic_pdf(pdf_path: str):
+    import fitz
+
+    with fitz.open() as pdf:
+        for page_no in range(N_SYNTHETIC_PAGES):
+            page = pdf.new_page()
+            page.insert_text((72, 72), f"Section {page_no + 1}", fontsize=18)
+            for line_no in range(40):
+                page.insert_text(
+                    (72, 110 + line_no * 16),
+                    f"Line {line_no} of page {page_no + 1}: the quick brown fox jumps over the lazy dog",
+                    fontsize=10,
+                )
+        pdf.save(pdf_path)
+
+
+def run_worker(pdf_path: str):
+    sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+    from main import structure_predict
+    from utils import check_and_read
+
+    n_pages = sum(1 for _ in check_and_read(pdf_path))
+    # warm up the sessions
+    structure_predict(pdf_path, "en", True, False, None)
+    start = time.perf_counter()
+    doc, _ = structure_predict(pdf_path, "en", True, False, None)
+    elapsed = time.perf_counter() - start
+    print(json.dumps({
+        "pages": n_pages,
+        "elapsed": elapsed,
+        "doc_sha256": hashlib.sha256(doc.encode("utf-8")).hexdigest(),
+    }))
+
+
+def bench(pdf_path: str, page_workers: int) -> dict:
+    output = subprocess.run(
+        [sys.executable, __file__, "--worker", pdf_path],
+        env=dict(os.environ, PAGE_WORKERS=str(page_workers)),
+        check=True,
+        capture_output=True,
+        text=True,
+    ).stdout
+    return json.loads(output.strip().splitlines()[-1])
+
+
+if __name__ == "__main__":
+    if sys.argv[1:2] == ["--worker"]:
+        run_worker(sys.argv[2])
+        sys.exit(0)
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        if len(sys.argv) > 1:
+            pdf_path = sys.argv[1]
+        else:
+            pdf_path = os.path.join(tmp_dir, "synthetic.pdf")
+            write_synthetic_pdf(pdf_path)
+
+        baseline = None
+        for page_workers in WORKER_COUNTS:
+            result = bench(pdf_path, page_workers)
+            if baseline is None:
+                baseline = result
+            same_doc = result["doc_sha256"] == baseline["doc_sha256"]
+            print(
+                f"{page_workers} page workers: {result['pages'] / result['elapsed']:.2f} pages/sec, "
+                f"{result['elapsed']:.1f} s for {result['pages']} pages, "
+                f"{'same' if same_doc else 'DIFFERENT'} document"
+            )
@@ -0,0 +1,89 @@
+"""
+Benchmark of batched text recognition on CPU.
+
+Text crops are detected on sample pages, then recognized with one ONNX run
+per crop, i.e. the previous CPU path, and with width-bucketed batches.
+Reports crops/sec, the number of ONNX runs and how many crops got the same
+text from both paths.
+
+Needs the ETL models. Run from source/model/etl/code:
+    MODEL_PATH=/opt/ml/model python test/text_recognition_benchmark.py [image or PDF ...]
+Synthetic pages are rendered when no file is given.
+"""
+import os
+import random
+import sys
+import time
+
+import cv2
+import numpy as np
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+
+from ocr import REC_CPU_MAX_PADDING_RATIO, TextSystem, sorted_boxes
+from utils import check_and_read
+
+LANG = "ch"
+N_SYNTHETIC_PAGES = 4
+WORDS = ["invoice", "total", "amount", "2024", "customer", "service", "price", "quantity", "A-1", "report", "summary", "of"]
+
+
+def get_synthetic_page(seed: int):
+    """A page with titles, table cells and paragraph lines of mixed widths"""
+    rng = random.Random(seed)
+    page = np.full((2200, 1700, 3), 255, dtype=np.uint8)
+    y = 80
+    while y < 2100:
+        n_words = rng.choice([1, 1, 2, 3, 6, 10, 14])
+        n_columns = 4 if n_words == 1 else 1
+        for column in range(n_columns):
+            text = " ".join(rng.choice(WORDS) for _ in range(n_words))
+            cv2.putText(page, text, (80 + column * 400, y), cv2.FONT_HERSHEY_SIMPLEX, 1.0, (0, 0, 0), 2)
+        y += rng.choice([45, 60, 90])
+    return page
+
+
+def get_crops(text_system, pages):
+    crops = []
+    for page in pages:
+        dt_boxes = text_system.text_detector[LANG](page)
+        for box in sorted_boxes(dt_boxes):
+            crops.append(text_system.get_rotate_crop_image(page, box.copy()))
+    return crops
+
+
+def bench(recognizer, crops, batch_num, max_padding_ratio):
+    recognizer.rec_batch_num = batch_num
+    recognizer.max_padding_ratio = max_padding_ratio
+    width_list = [crop.shape[1] / float(crop.shape[0]) for crop in crops]
+    n_runs = len(recognizer.get_batches(width_list, np.argsort(np.array(width_list))))
+    start = time.perf_counter()
+    rec_res = recognizer(crops)
+    elapsed = time.perf_counter() - start
+    return rec_res, elapsed, n_runs
+
+
+if __name__ == "__main__":
+    if len(sys.argv) > 1:
+        pages = [page for file_path in sys.argv[1:] for page in check_and_read(file_path)]
+    else:
+        pages = [get_synthetic_page(seed) for seed in range(N_SYNTHETIC_PAGES)]
+
+    text_system = TextSystem()
+    recognizer = text_system.text_recognizer[LANG]
+    crops = get_crops(text_system, pages)
+    # warm up the session
+    recognizer(crops[:8])
+    print(f"{len(pages)} pages, {len(crops)} crops")
+
+    baseline, elapsed, n_runs = bench(recognizer, crops, 1, None)
+    print(f"one crop per run:  {len(crops) / elapsed:.1f} crops/sec, {n_runs} runs")
+    for batch_num in (8, 16, 32):
+        rec_res, elapsed, n_runs = bench(recognizer, crops, batch_num, REC_CPU_MAX_PADDING_RATIO)
+        same_text = sum(a[0] == b[0] for a, b in zip(baseline, rec_res))
+        print(
+            f"width buckets, batch {batch_num:>2}: {len(crops) / elapsed:.1f} crops/sec, "
+            f"{n_runs} runs, same text for {same_text}/{len(crops)} crops"
+        )
+    rec_res, elapsed, n_runs = bench(recognizer, crops, 16, None)
+    print(f"fixed batches of 16, no padding cap: {len(crops) / elapsed:.1f} crops/sec, {n_runs} runs")
@@ -0,0 +1,107 @@
+"""
+Golden check and micro-benchmark of xycut.recursive_xy_cut.
+
+The reading order of the NumPy implementation is compared with the previous
+implementation, which projected the boxes with a Python loop and copied the
+boxes at every level of the recursion, on synthetic pages including
+duplicated, touching and empty boxes. Both are then timed on pages with
+many boxes.
+
+Run from source/model/etl/code:
+    python test/xycut_benchmark.py
+"""
+import os
+import sys
+import time
+
+import numpy as np
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+
+from xycut import recursive_xy_cut, split_projection_profile
+
+
+def legacy_projection_by_bboxes(boxes, axis):
+    length = np.max(boxes[:, axis::2])
+    res = np.zeros(length, dtype=int)
+    for start, end in boxes[:, axis::2]:
+        res[start:end] += 1
+    return res
+
+
+def legacy_recursive_xy_cut(boxes, indices, res):
+    _indices = boxes[:, 1].argsort()
+    y_sorted_boxes = boxes[_indices]
+    y_sorted_indices = indices[_indices]
+    y_projection = legacy_projection_by_bboxes(boxes=y_sorted_boxes, axis=1)
+    pos_y = split_projection_profile(y_projection, 0, 1)
+    if not pos_y:
+        return
+    arr_y0, arr_y1 = pos_y
+    for r0, r1 in zip(arr_y0, arr_y1):
+        _indices = (r0 <= y_sorted_boxes[:, 1]) & (y_sorted_boxes[:, 1] < r1)
+        y_sorted_boxes_chunk = y_sorted_boxes[_indices]
+        y_sorted_indices_chunk = y_sorted_indices[_indices]
+        _indices = y_sorted_boxes_chunk[:, 0].argsort()
+        x_sorted_boxes_chunk = y_sorted_boxes_chunk[_indices]
+        x_sorted_indices_chunk = y_sorted_indices_chunk[_indices]
+        x_projection = legacy_projection_by_bboxes(boxes=x_sorted_boxes_chunk, axis=0)
+        pos_x = split_projection_profile(x_projection, 0, 1)
+        if not pos_x:
+            continue
+        arr_x0, arr_x1 = pos_x
+        if len(arr_x0) == 1:
+            res.extend(x_sorted_indices_chunk)
+            continue
+        for c0, c1 in zip(arr_x0, arr_x1):
+            _indices = (c0 <= x_sorted_boxes_chunk[:, 0]) & (x_sorted_boxes_chunk[:, 0] < c1)
+            legacy_recursive_xy_cut(
+                x_sorted_boxes_chunk[_indices], x_sorted_indices_chunk[_indices], res
+            )
+
+
+def get_page_boxes(n_boxes: int, seed: int) -> np.ndarray:
+    """Boxes laid out in 1 to 3 columns of lines, with some noise"""
+    rng = np.random.default_rng(seed)
+    n_columns = rng.integers(1, 4)
+    column_width = 1600 // n_columns
+    boxes = []
+    for i in range(n_boxes):
+        column = rng.integers(n_columns)
+        x0 = 50 + column * column_width + rng.integers(0, column_width // 2)
+        y0 = rng.integers(0, 2200)
+        boxes.append([x0, y0, x0 + rng.integers(0, column_width // 2), y0 + rng.integers(0, 40)])
+    boxes = np.array(boxes, dtype=int)
+    # duplicated and touching boxes
+    if n_boxes > 4:
+        boxes[1] = boxes[0]
+        boxes[3, 1] = boxes[2, 3]
+    return boxes
+
+
+def get_order(fn, boxes):
+    res = []
+    fn(boxes, np.arange(len(boxes)), res)
+    return [int(i) for i in res]
+
+
+def timed(fn, pages) -> float:
+    start = time.perf_counter()
+    for boxes in pages:
+        fn(boxes, np.arange(len(boxes)), [])
+    return (time.perf_counter() - start) / len(pages) * 1000
+
+
+if __name__ == "__main__":
+    golden_pages = [np.array([[10, 10, 200, 30], [220, 10, 400, 30], [10, 40, 400, 60]])]
+    golden_pages += [get_page_boxes(n_boxes, seed) for seed in range(200) for n_boxes in (1, 2, 5, 20, 80)]
+    for boxes in golden_pages:
+        assert get_order(recursive_xy_cut, boxes) == get_order(legacy_recursive_xy_cut, boxes), boxes
+    print(f"same reading order as the previous implementation on {len(golden_pages)} pages")
+
+    for n_boxes in (50, 500, 2000):
+        pages = [get_page_boxes(n_boxes, seed) for seed in range(10)]
+        print(
+            f"{n_boxes} boxes: previous {timed(legacy_recursive_xy_cut, pages):.1f} ms/page, "
+            f"numpy {timed(recursive_xy_cut, pages):.1f} ms/page"
+        )
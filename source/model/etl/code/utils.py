@@ -2,6 +2,8 @@
 # -*- coding:utf-8 -*-
 
 import os
+import queue
+import threading
 import cv2
 import logging
 import numpy as np
@@ -18,10 +20,16 @@ except ImportError:
 
 __all__ = [
     "check_and_read",
+    "prefetch",
     "readimg",
     "lambda_return"
 ]
 
+# 后台线程最多提前渲染的页数
+PREFETCH_PAGES = int(os.environ.get("PREFETCH_PAGES", 2))
+
+_END = object()
+
 def check_and_read(img_path):
     """Check and read image file in different formats.
     
@@ -76,6 +84,59 @@ def check_and_read(img_path):
             img = cv2.cvtColor(img, cv2.COLOR_GRAY2RGB)
         yield img[:, :, ::-1]
 
+def prefetch(iterable, size=PREFETCH_PAGES):
+    """Iterate over an iterable in a background thread.
+    
+    Used to render the pages of a PDF while the previous pages are being
+    predicted. At most `size` items wait in the queue, so memory does not
+    grow with the page count.
+    
+    Args:
+        iterable: Iterable to consume, e.g. the generator of check_and_read
+        size: Max number of items produced ahead of the consumer
+        
+    Returns:
+        Generator of the items, in order. An exception raised by the
+        iterable is raised again in the consumer.
+    """
+    items = queue.Queue(maxsize=max(1, size))
+    stop = threading.Event()
+
+    def put(entry):
+        while not stop.is_set():
+            try:
+                items.put(entry, timeout=0.1)
+                return True
+            except queue.Full:
+                continue
+        return False
+
+    def produce():
+        try:
+            for item in iterable:
+                if not put((item, None)):
+                    return
+            put((_END, None))
+        except Exception as e:
+            put((_END, e))
+
+    thread = threading.Thread(target=produce, daemon=True)
+    thread.start()
+    try:
+        while True:
+            item, error = items.get()
+            if item is _END:
+                if error is not None:
+                    raise error
+                return
+            yield item
+    finally:
+        # stop the producer when the consumer stops early
+        stop.set()
+        thread.join()
+        if hasattr(iterable, "close"):
+            iterable.close()
+
 def readimg(body, keys=None):
     """Read images from various sources in a request body.
     
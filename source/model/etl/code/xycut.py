@@ -17,11 +17,28 @@ def projection_by_bboxes(boxes: np.array, axis: int) -> np.ndarray:
     """
     assert axis in [0, 1]
     length = np.max(boxes[:, axis::2])
-    res = np.zeros(length, dtype=int)
-    # TODO: how to remove for loop?
-    for start, end in boxes[:, axis::2]:
-        res[start:end] += 1
-    return res
+    return _projection(boxes[:, axis], boxes[:, axis + 2], 0, length)
+
+
+def _projection(starts: np.ndarray, ends: np.ndarray, offset: int, length: int) -> np.ndarray:
+    """
+    区间 [offset, length) 内的投影直方图: 在每个 box 的起点 +1、终点 -1, 再求累加和
+
+    Args:
+        starts: box 在投影方向的起点, 不小于 offset
+        ends: box 在投影方向的终点, 不大于 length
+        offset: 直方图第一个像素的坐标
+        length: 直方图的结束坐标
+
+    Returns:
+        1D 投影直方图, 长度为 length - offset
+    """
+    valid = starts < ends
+    size = length - offset + 1
+    diff = np.bincount(starts[valid] - offset, minlength=size) - np.bincount(
+        ends[valid] - offset, minlength=size
+    )
+    return np.cumsum(diff[:-1])
 
 
 # from: https://dothinking.github.io/2021-06-19-%E9%80%92%E5%BD%92%E6%8A%95%E5%BD%B1%E5%88%86%E5%89%B2%E7%AE%97%E6%B3%95/#:~:text=%E9%80%92%E5%BD%92%E6%8A%95%E5%BD%B1%E5%88%86%E5%89%B2%EF%BC%88Recursive%20XY,%EF%BC%8C%E5%8F%AF%E4%BB%A5%E5%88%92%E5%88%86%E6%AE%B5%E8%90%BD%E3%80%81%E8%A1%8C%E3%80%82
@@ -68,6 +85,37 @@ def split_projection_profile(arr_values: np.array, min_value: float, min_gap: fl
     return arr_start, arr_end
 
 
+def projection_groups(boxes: np.ndarray, pos: np.ndarray, axis: int):
+    """
+    按投影方向的起点对 box 排序, 并按投影直方图把它们切分成组
+
+    Args:
+        boxes: (N, 4)
+        pos: 参与切分的 box 在 boxes 中的位置
+        axis: 0-按 x 方向切分, 1-按 y 方向切分
+
+    Returns:
+        tuple: 排序后的 pos, 以及每组在排序后的 pos 中的 (start, end) 切片; 没有投影时为 None
+    """
+    pos = pos[boxes[pos, axis].argsort()]
+    starts = boxes[pos, axis]
+    ends = boxes[pos, axis + 2]
+    # 只在 box 覆盖的坐标范围内投影
+    offset = starts[0]
+    length = max(starts[-1], ends.max())
+    pos_groups = split_projection_profile(
+        _projection(starts, ends, offset, length), 0, 1
+    )
+    if not pos_groups:
+        return pos, None
+
+    # 起点落在 [group_start, group_end) 内的 box 在排序后是连续的
+    arr_start, arr_end = pos_groups
+    group_start = np.searchsorted(starts, arr_start + offset, side="left")
+    group_end = np.searchsorted(starts, arr_end + offset, side="left")
+    return pos, list(zip(group_start, group_end))
+
+
 def recursive_xy_cut(boxes: np.ndarray, indices: List[int], res: List[int]):
     """
 
@@ -77,49 +125,40 @@ def recursive_xy_cut(boxes: np.ndarray, indices: List[int], res: List[int]):
         res: 保存输出结果
 
     """
-    # 向 y 轴投影
     assert len(boxes) == len(indices)
+    _recursive_xy_cut(boxes, np.arange(len(boxes)), indices, res)
 
-    _indices = boxes[:, 1].argsort()
-    y_sorted_boxes = boxes[_indices]
-    y_sorted_indices = indices[_indices]
-
-    # debug_vis(y_sorted_boxes, y_sorted_indices)
 
-    y_projection = projection_by_bboxes(boxes=y_sorted_boxes, axis=1)
-    pos_y = split_projection_profile(y_projection, 0, 1)
-    if not pos_y:
+def _recursive_xy_cut(boxes: np.ndarray, pos: np.ndarray, indices: List[int], res: List[int]):
+    """
+    递归过程中不复制 boxes, 只传递 box 在 boxes 中的位置 pos
+    """
+    if len(pos) == 1:
+        # 单个 box 不需要投影, 宽高都不为 0 时输出
+        x0, y0, x1, y1 = boxes[pos[0]]
+        if x0 < x1 and y0 < y1:
+            res.append(indices[pos[0]])
         return
 
-    arr_y0, arr_y1 = pos_y
-    for r0, r1 in zip(arr_y0, arr_y1):
-        # [r0, r1] 表示按照水平切分，有 bbox 的区域，对这些区域会再进行垂直切分
-        _indices = (r0 <= y_sorted_boxes[:, 1]) & (y_sorted_boxes[:, 1] < r1)
-
-        y_sorted_boxes_chunk = y_sorted_boxes[_indices]
-        y_sorted_indices_chunk = y_sorted_indices[_indices]
-
-        _indices = y_sorted_boxes_chunk[:, 0].argsort()
-        x_sorted_boxes_chunk = y_sorted_boxes_chunk[_indices]
-        x_sorted_indices_chunk = y_sorted_indices_chunk[_indices]
+    # 向 y 轴投影
+    y_sorted_pos, y_groups = projection_groups(boxes, pos, axis=1)
+    if y_groups is None:
+        return
 
+    for r0, r1 in y_groups:
+        # y_sorted_pos[r0:r1] 表示按照水平切分，同一区域的 bbox，对这些区域会再进行垂直切分
         # 往 x 方向投影
-        x_projection = projection_by_bboxes(boxes=x_sorted_boxes_chunk, axis=0)
-        pos_x = split_projection_profile(x_projection, 0, 1)
-        if not pos_x:
+        x_sorted_pos, x_groups = projection_groups(
+            boxes, y_sorted_pos[r0:r1], axis=0
+        )
+        if x_groups is None:
             continue
 
-        arr_x0, arr_x1 = pos_x
-        if len(arr_x0) == 1:
+        if len(x_groups) == 1:
             # x 方向无法切分
-            res.extend(x_sorted_indices_chunk)
+            res.extend(indices[x_sorted_pos])
             continue
 
         # x 方向上能分开，继续递归调用
-        for c0, c1 in zip(arr_x0, arr_x1):
-            _indices = (c0 <= x_sorted_boxes_chunk[:, 0]) & (
-                x_sorted_boxes_chunk[:, 0] < c1
-            )
-            recursive_xy_cut(
-                x_sorted_boxes_chunk[_indices], x_sorted_indices_chunk[_indices], res
-            )
+        for c0, c1 in x_groups:
+            _recursive_xy_cut(boxes, x_sorted_pos[c0:c1], indices, res)